@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def ensure_search_index(sender, using, **kwargs):
+    from django.db import connections
+    from .search import GAME_TABLE, install_search_index
+
+    connection = connections[using]
+    if GAME_TABLE in connection.introspection.table_names():
+        install_search_index(connection)
 
 
 class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'catalog'
+
+    def ready(self):
+        import catalog.signals  # Keeps the facet counts in sync with games
+
+        # SQLite drops the search triggers whenever a migration rebuilds the
+        # game table, so make sure they are back after every migrate
+        post_migrate.connect(ensure_search_index, sender=self)
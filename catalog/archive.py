@@ -0,0 +1,78 @@
+"""
+Moving old history out of the hot tables, behind `manage.py archive_history`.
+
+Returned loans and processed borrow requests are only ever read again as
+history, so once they are older than a cutoff they are copied into
+ArchivedLoan / ArchivedBorrowRequest under the same ids and deleted from
+Loan / BorrowRequest. Each batch is one transaction, so an interrupted run
+leaves every row in exactly one tier and the next run carries on with
+whatever is still left.
+
+History reads go through loan_history and request_history, which union both
+tiers so callers never need to know where a row lives.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import ArchivedBorrowRequest, ArchivedLoan, BorrowRequest, Loan
+
+AGE = timedelta(days=180)
+BATCH_SIZE = 500
+
+LOAN_FIELDS = ('id', 'game_id', 'borrower_id', 'borrow_date', 'due_date', 'return_date')
+REQUEST_FIELDS = ('id', 'game_id', 'requester_id', 'status', 'duration_days',
+                  'request_date', 'processed_date', 'processed_by_id')
+
+
+def _move(rows, fields, archive_model, batch_size):
+    moved = 0
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(rows.filter(pk__gt=last_id).order_by('pk').values(*fields)[:batch_size])
+            if not batch:
+                return moved
+            # Conflicts can only be rows copied by hand, the copy here and the delete commit together
+            archive_model.objects.bulk_create([archive_model(**row) for row in batch], ignore_conflicts=True)
+            ids = [row['id'] for row in batch]
+            rows.model.objects.filter(pk__in=ids).delete()
+        moved += len(batch)
+        last_id = ids[-1]
+
+
+def archive_loans(now=None, age=AGE, batch_size=BATCH_SIZE):
+    """Move loans returned more than ``age`` ago, returns how many moved."""
+    cutoff = (now or timezone.now()) - age
+    rows = Loan.objects.filter(is_returned=True, return_date__lt=cutoff)
+    return _move(rows, LOAN_FIELDS, ArchivedLoan, batch_size)
+
+
+def archive_borrow_requests(now=None, age=AGE, batch_size=BATCH_SIZE):
+    """Move requests approved or rejected more than ``age`` ago, returns how many moved."""
+    cutoff = (now or timezone.now()) - age
+    # Older rejections never recorded when they were processed, their request date stands in
+    rows = (
+        BorrowRequest.objects.exclude(status=BorrowRequest.PENDING)
+        .annotate(processed=Coalesce('processed_date', 'request_date'))
+        .filter(processed__lt=cutoff)
+    )
+    return _move(rows, REQUEST_FIELDS, ArchivedBorrowRequest, batch_size)
+
+
+def loan_history(user):
+    """``user``'s returned loans from both tiers as dicts, most recently returned first."""
+    fields = ('id', 'game__title', 'game__upc', 'borrow_date', 'due_date', 'return_date')
+    hot = Loan.objects.filter(borrower=user, is_returned=True).values(*fields)
+    archived = ArchivedLoan.objects.filter(borrower=user).values(*fields)
+    return hot.union(archived, all=True).order_by('-return_date', '-id')
+
+
+def request_history(user):
+    """``user``'s processed borrow requests from both tiers as dicts, newest first."""
+    fields = ('id', 'game__title', 'game__upc', 'status', 'request_date', 'processed_date')
+    hot = BorrowRequest.objects.filter(requester=user).exclude(status=BorrowRequest.PENDING).values(*fields)
+    archived = ArchivedBorrowRequest.objects.filter(requester=user).values(*fields)
+    return hot.union(archived, all=True).order_by('-request_date', '-id')
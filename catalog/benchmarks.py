@@ -0,0 +1,87 @@
+"""
+Helpers shared by the benchmark_* management commands.
+
+Benchmarks seed synthetic rows inside a transaction that is rolled back at
+the end, so they can be pointed at a development database without leaving
+anything behind.
+"""
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from django.db import transaction
+
+from .models import Game, calculate_upc_check_digit
+
+WORDS = [
+    'legend', 'dragon', 'space', 'galaxy', 'racer', 'shadow', 'kingdom', 'quest', 'battle', 'hero',
+    'zelda', 'halo', 'mario', 'metroid', 'souls', 'craft', 'city', 'island', 'knight', 'ninja',
+    'puzzle', 'rhythm', 'strike', 'storm', 'frontier', 'empire', 'tactics', 'arena', 'dungeon', 'forest',
+]
+# A few thousand made-up words on top of the real ones, drawn with a Zipf
+# distribution so term frequencies look like real catalog text
+SYLLABLES = ['ka', 'ri', 'to', 'mon', 'zel', 'da', 'ha', 'lo', 'vor', 'tex', 'qui', 'ne', 'sa', 'gor', 'pel']
+VOCABULARY = WORDS + [''.join(parts) for parts in itertools.product(SYLLABLES, repeat=3)]
+ZIPF_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+GENRES = ['Action', 'Adventure', 'RPG', 'Strategy', 'Puzzle', 'Racing', 'Sports', 'Shooter', 'Platformer']
+PLATFORMS = ['PC', 'Xbox', 'PlayStation', 'Switch', 'Wii', 'GameCube']
+LOCATIONS = ['Main Library, Shelf A', 'Main Library, Shelf B', 'Science Library', 'Music Library']
+
+
+class Rollback(Exception):
+    pass
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction and always roll it back."""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
+
+
+@contextmanager
+def timer(results, name):
+    start = time.perf_counter()
+    yield
+    results[name] = time.perf_counter() - start
+
+
+def synthetic_games(count, start=0, seed=0):
+    """Yield unsaved Game instances with unique UPCs and plausible text."""
+    rng = random.Random(seed + start)
+    for i in range(start, start + count):
+        title = ' '.join(rng.choices(VOCABULARY, cum_weights=ZIPF_WEIGHTS, k=3)).title()
+        base_upc = f'{i:011d}'
+        yield Game(
+            title=f'{title} {i}',
+            description=' '.join(rng.choices(VOCABULARY, cum_weights=ZIPF_WEIGHTS, k=40)),
+            release_date=date(1985, 1, 1) + timedelta(days=rng.randrange(14000)),
+            genre=rng.choice(GENRES),
+            platform=rng.choice(PLATFORMS),
+            location=rng.choice(LOCATIONS),
+            image='game_images/placeholder.jpg',
+            upc=base_upc + calculate_upc_check_digit(base_upc),
+        )
+
+
+def seed_games(count, batch_size=5000, start=0):
+    created = 0
+    games = synthetic_games(count, start=start)
+    while created < count:
+        batch = [game for _, game in zip(range(min(batch_size, count - created)), games)]
+        Game.objects.bulk_create(batch, batch_size=batch_size)
+        created += len(batch)
+    return created
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,105 @@
+"""
+ETags for the catalog and collection pages.
+
+An ETag is a hash of everything a page is rendered from: the rows'
+updated_at plus the comment/rating/circulation versions on Game, the
+collection and access request timestamps, and who is asking (user and
+role, the pages differ per user). Computing one is an aggregate query or
+two, so a browser or polling client that already has the page gets a 304
+without the page being rendered. The catalog index covers every game, so
+it reads the single CatalogVersion counter instead of aggregating them.
+
+No Last-Modified is sent: deleting a comment, rating or request bumps a
+version but leaves no timestamp behind, so a date alone would hand out
+stale 304s.
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.db.models import Count, Max, Sum
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from collection.models import Collection, CollectionAccessRequest
+from .models import CatalogVersion, Game
+
+
+def game_state(games):
+    """One row summing up a Game queryset, it changes whenever any card of it would."""
+    return games.aggregate(
+        count=Count('id'),
+        ids=Sum('id'),
+        updated=Max('updated_at'),
+        ratings=Sum('rating_version'),
+        circulation=Sum('circulation_version'),
+    )
+
+
+def change_state(rows):
+    """Row count and latest updated_at, for tables whose rows carry one."""
+    return rows.aggregate(count=Count('id'), updated=Max('updated_at'))
+
+
+def page_etag(request, *parts):
+    """Hash ``parts`` together with who is asking, or None if the page must be rendered."""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    # Queued messages only show up in a freshly rendered page
+    if len(get_messages(request)):
+        return None
+    user = request.user
+    role = user.userprofile.role if user.is_authenticated else None
+    parts = (user.pk, role, request.headers.get('x-requested-with'), *parts)
+    return hashlib.blake2b(repr(parts).encode(), digest_size=16).hexdigest()
+
+
+def catalog_etag(request):
+    # The whole catalog rather than just the visible games, one counter row
+    # that changes whenever any card or facet count would
+    user = request.user
+    granted = CollectionAccessRequest.objects.none()
+    if user.is_authenticated:
+        granted = CollectionAccessRequest.objects.filter(requester=user)
+    return page_etag(
+        request,
+        CatalogVersion.current(),
+        change_state(Collection.objects.all()),
+        change_state(granted),
+    )
+
+
+def game_detail_etag(request, upc):
+    game = (
+        Game.objects.filter(upc=upc)
+        .annotate(collection_count=Count('collections'), collections_updated=Max('collections__updated_at'))
+        .values_list(
+            'id', 'updated_at', 'comment_version', 'rating_version', 'circulation_version',
+            'collection_count', 'collections_updated',
+        )
+        .first()
+    )
+    # Let the view answer with its 404
+    return page_etag(request, game) if game else None
+
+
+def collection_etag(request, pk):
+    collection = Collection.objects.filter(pk=pk).values_list('updated_at', 'is_private', 'creator_id').first()
+    if collection is None:
+        return None
+    return page_etag(
+        request,
+        collection,
+        game_state(Game.objects.filter(collections=pk)),
+        change_state(CollectionAccessRequest.objects.filter(collection=pk)),
+    )
+
+
+def conditional_page(etag_func):
+    """
+    Answer conditional GETs of a view with 304 using ``etag_func``. The
+    pages are per user, so shared caches must not keep them and browsers
+    should check back every time.
+    """
+    def decorator(view):
+        return cache_control(private=True, no_cache=True)(condition(etag_func=etag_func)(view))
+    return decorator
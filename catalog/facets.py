@@ -0,0 +1,154 @@
+"""
+Facet counts for the catalog (genre, platform, location and release decade).
+
+Counts are stored per visibility scope in FacetCount and adjusted by deltas
+whenever a game is saved, deleted or changes visibility, so showing
+"Action (412)" only means summing the handful of scopes a user can see.
+"""
+from collections import Counter
+from datetime import date
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractYear
+
+from .models import FacetCount, Game
+
+FACETS = [FacetCount.GENRE, FacetCount.PLATFORM, FacetCount.LOCATION, FacetCount.DECADE]
+
+# Columns needed to work out which facet values a game contributes to
+GAME_FACET_FIELDS = ['genre', 'platform', 'location', 'release_date', 'visibility', 'private_collection_id']
+
+
+def visibility_scope(visibility, private_collection_id):
+    if visibility == Game.PRIVATE:
+        return f'private:{private_collection_id}'
+    return visibility
+
+
+def scopes_for(user):
+    """Scopes whose games ``user`` can see, or None for every scope."""
+    if not user.is_authenticated:
+        return [Game.PUBLIC]
+    if user.userprofile.role == 'Librarian':
+        return None
+    from collection.models import CollectionAccessRequest
+    approved = CollectionAccessRequest.objects.filter(
+        requester=user,
+        status=CollectionAccessRequest.APPROVED,
+    ).values_list('collection_id', flat=True)
+    return [Game.PUBLIC, Game.UNLISTED] + [visibility_scope(Game.PRIVATE, pk) for pk in approved]
+
+
+def decade_of(release_date):
+    return f'{release_date.year // 10 * 10}s'
+
+
+def decade_range(decade):
+    """Release date bounds for a decade value such as '1990s', or None if it isn't one."""
+    try:
+        start = int(decade.rstrip('s'))
+    except ValueError:
+        return None
+    if start % 10 or not 1000 <= start <= 9990:
+        return None
+    return date(start, 1, 1), date(start + 10, 1, 1)
+
+
+def facet_values(row):
+    """Facet/value pairs for a dict of GAME_FACET_FIELDS."""
+    values = [
+        (FacetCount.GENRE, row['genre']),
+        (FacetCount.PLATFORM, row['platform']),
+        (FacetCount.LOCATION, row['location']),
+        (FacetCount.DECADE, decade_of(row['release_date'])),
+    ]
+    return [(facet, value) for facet, value in values if value]
+
+
+def game_deltas(row, delta, scope=None):
+    if scope is None:
+        scope = visibility_scope(row['visibility'], row['private_collection_id'])
+    return Counter({(facet, value, scope): delta for facet, value in facet_values(row)})
+
+
+def apply_deltas(deltas):
+    """Add a Counter of (facet, value, scope) -> delta to the stored counts."""
+    for (facet, value, scope), delta in deltas.items():
+        if not delta:
+            continue
+        updated = FacetCount.objects.filter(facet=facet, value=value, scope=scope).update(
+            count=F('count') + delta
+        )
+        if updated or delta < 0:
+            continue
+        try:
+            with transaction.atomic():
+                FacetCount.objects.create(facet=facet, value=value, scope=scope, count=delta)
+        except IntegrityError:
+            # Another process created the row first
+            FacetCount.objects.filter(facet=facet, value=value, scope=scope).update(
+                count=F('count') + delta
+            )
+
+
+def facet_counts(user):
+    """
+    Visible facet values with their counts for ``user``, as
+    ``{facet: [(value, count), ...]}`` sorted by count.
+    """
+    counts = FacetCount.objects.filter(count__gt=0)
+    scopes = scopes_for(user)
+    if scopes is not None:
+        counts = counts.filter(scope__in=scopes)
+    counts = counts.values('facet', 'value').annotate(total=Sum('count')).order_by('facet', '-total', 'value')
+
+    result = {facet: [] for facet in FACETS}
+    for row in counts:
+        result[row['facet']].append((row['value'], row['total']))
+    result[FacetCount.DECADE].sort(reverse=True)
+    return result
+
+
+def filter_games(games, filters):
+    """Narrow a Game queryset by selected facet values, e.g. {'genre': 'RPG'}."""
+    for facet in (FacetCount.GENRE, FacetCount.PLATFORM, FacetCount.LOCATION):
+        if filters.get(facet):
+            games = games.filter(**{facet: filters[facet]})
+    if filters.get(FacetCount.DECADE):
+        bounds = decade_range(filters[FacetCount.DECADE])
+        games = games.filter(release_date__gte=bounds[0], release_date__lt=bounds[1]) if bounds else games.none()
+    return games
+
+
+def count_new_games(games):
+    """Add freshly bulk-inserted games (which skip signals) to the counts."""
+    deltas = Counter()
+    for game in games:
+        deltas.update(game_deltas({field: getattr(game, field) for field in GAME_FACET_FIELDS}, 1))
+    apply_deltas(deltas)
+
+
+@transaction.atomic
+def rebuild_facet_counts():
+    """Recompute every count from the game table."""
+    scope_fields = ['visibility', 'private_collection_id']
+    counts = Counter()
+    for field in ('genre', 'platform', 'location'):
+        rows = Game.objects.values(field, *scope_fields).annotate(n=Count('id')).order_by()
+        for row in rows:
+            if row[field]:
+                scope = visibility_scope(row['visibility'], row['private_collection_id'])
+                counts[(field, row[field], scope)] += row['n']
+    years = Game.objects.annotate(year=ExtractYear('release_date')).values('year', *scope_fields).annotate(
+        n=Count('id')
+    ).order_by()
+    for row in years:
+        scope = visibility_scope(row['visibility'], row['private_collection_id'])
+        counts[(FacetCount.DECADE, f'{row["year"] // 10 * 10}s', scope)] += row['n']
+
+    FacetCount.objects.all().delete()
+    FacetCount.objects.bulk_create(
+        [FacetCount(facet=facet, value=value, scope=scope, count=n) for (facet, value, scope), n in counts.items()],
+        batch_size=1000,
+    )
@@ -16,6 +16,12 @@ class GameForm(forms.ModelForm):
         }
 
 
+class GameImportForm(GameForm):
+    """GameForm rules for one imported row, the image is checked separately by catalog.importer."""
+    class Meta(GameForm.Meta):
+        fields = [field for field in GameForm.Meta.fields if field != 'image']
+
+
 class CommentForm(forms.ModelForm):
     class Meta:
         model = Comment
@@ -0,0 +1,47 @@
+"""
+Typo tolerant title search, used when the regular search finds nothing.
+
+Postgres answers it with pg_trgm's word_similarity backed by a GIN trigram
+index on catalog_game.title. Other databases use the trigram postings kept
+by the in-memory title index in catalog.typeahead.
+"""
+from django.db import connections
+from django.db.models import Case, FloatField, Value, When
+from django.db.models.expressions import RawSQL
+
+from . import typeahead
+from .search import GAME_TABLE
+
+# Same as pg_trgm.word_similarity_threshold's default, which the <% operator uses
+SIMILARITY_THRESHOLD = 0.6
+
+
+def fuzzy_search(queryset, query, limit=60):
+    """
+    Games of ``queryset`` whose title is similar to ``query``, annotated
+    with ``similarity`` and ordered by it. Slice the result to ``limit``.
+    """
+    query = query.strip()
+    if not query:
+        return queryset.none()
+
+    if connections[queryset.db].vendor == 'postgresql':
+        return queryset.extra(
+            where=[f'%s <%% {GAME_TABLE}.title'],
+            params=[query],
+        ).annotate(
+            similarity=RawSQL(f'word_similarity(%s, {GAME_TABLE}.title)', (query,), output_field=FloatField())
+        ).order_by('-similarity', 'id')
+
+    typeahead.index.ensure_fresh()
+    # Ask for extra candidates, some may be filtered out by ``queryset``
+    matches = typeahead.index.similar(query, limit=limit * 4, threshold=SIMILARITY_THRESHOLD)
+    if not matches:
+        return queryset.none()
+    return queryset.filter(id__in=[game_id for game_id, _ in matches]).annotate(
+        similarity=Case(
+            *[When(id=game_id, then=Value(score)) for game_id, score in matches],
+            output_field=FloatField(),
+        )
+    ).order_by('-similarity', 'id')
+
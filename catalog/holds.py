@@ -0,0 +1,64 @@
+"""
+Waitlist for games that are out.
+
+Each game hands out ticket numbers from Game.hold_tail, so the queue is
+just the game's holds in ticket order, read front first off the
+(game, ticket) unique index. When a loan ends, catalog.loans.end_loan
+calls hand_off in the same transaction and the first hold becomes a loan
+for that patron straight away, so nobody has to keep checking back.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import Game, Hold
+
+
+class CannotHold(Exception):
+    """The game can be requested right away, or the patron already has it or a hold on it."""
+
+
+def place_hold(game, patron, duration_days=14):
+    """Put ``patron`` at the back of ``game``'s queue, returns their position."""
+    with transaction.atomic():
+        on_loan_to_others = Game.objects.filter(pk=game.pk, current_loan__isnull=False).exclude(
+            current_loan__borrower=patron
+        )
+        # Taking a ticket locks the game row, so tickets are handed out one at a time
+        if not on_loan_to_others.update(hold_tail=F('hold_tail') + 1, circulation_version=F('circulation_version') + 1):
+            raise CannotHold('Only games on loan to someone else can be put on hold.')
+        ticket = Game.objects.filter(pk=game.pk).values_list('hold_tail', flat=True).get()
+        try:
+            with transaction.atomic():
+                hold = Hold.objects.create(game=game, patron=patron, ticket=ticket, duration_days=duration_days)
+        except IntegrityError:
+            raise CannotHold('You are already on the waitlist.')
+    return queue_position(hold)
+
+
+def cancel_hold(game, patron):
+    """Take ``patron`` off ``game``'s queue, returns whether they were on it."""
+    deleted, _ = Hold.objects.filter(game=game, patron=patron).delete()
+    if deleted:
+        Game.objects.filter(pk=game.pk).update(circulation_version=F('circulation_version') + 1)
+    return bool(deleted)
+
+
+def queue_position(hold):
+    """1 for the front of the queue. Counts along the index, holds ahead may have been cancelled."""
+    return Hold.objects.filter(game_id=hold.game_id, ticket__lte=hold.ticket).count()
+
+
+def hand_off(game_id):
+    """
+    Lend the game to the first patron in its queue, returns the Loan or None
+    if nobody is waiting. Callers must hold the game's row lock and have
+    just cleared current_loan, as end_loan does.
+    """
+    from .loans import start_loans
+
+    hold = Hold.objects.filter(game_id=game_id).order_by('ticket').first()
+    if hold is None:
+        return None
+    hold.delete()
+    loan, = start_loans([(game_id, hold.patron_id, hold.duration_days)])
+    return loan
@@ -0,0 +1,111 @@
+"""
+Resized copies of uploaded images (game covers and profile pictures).
+
+Each original gets a WebP and a JPEG at every width in WIDTHS, stored next
+to the other media at a path derived from the original's name, e.g.
+game_images/zelda.jpg -> derivatives/game_images/zelda.400w.webp. They are
+made on a background thread once the upload is committed; the model then
+records which original they were made from (``*_derived_from``), and the
+``responsive_image`` tag only points browsers at them when that matches the
+current image.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+# Sent with the model and pk once a row's derivatives are made and marked
+derivatives_ready = Signal()
+
+# Name -> width in pixels
+WIDTHS = {
+    'thumb': 160,
+    'card': 400,
+    'detail': 800,
+}
+FORMATS = [
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+]
+DERIVATIVES_DIR = 'derivatives'
+
+# Pillow releases the GIL while resizing and encoding, so a couple of threads
+# keep uploads moving without a separate worker service
+executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-derivatives')
+
+
+def derivative_name(name, width, extension):
+    stem = os.path.splitext(name)[0]
+    return f'{DERIVATIVES_DIR}/{stem}.{width}w.{extension}'
+
+
+def render_derivatives(source):
+    """Yield (width, extension, bytes) for every derivative of an image file object."""
+    from PIL import Image
+
+    with Image.open(source) as original:
+        original.load()
+        image = original.convert('RGB') if original.mode not in ('RGB', 'L') else original
+        for width in sorted(set(WIDTHS.values()), reverse=True):
+            resized = image.copy()
+            # Never upscales, small originals keep their size
+            resized.thumbnail((width, width * 4))
+            for extension, image_format, options in FORMATS:
+                output = io.BytesIO()
+                resized.save(output, image_format, **options)
+                yield width, extension, output.getvalue()
+            image = resized
+
+
+def generate_derivatives(name, storage=default_storage):
+    """Write any missing derivatives of the stored image ``name``, returns how many were written."""
+    wanted = [
+        derivative_name(name, width, extension)
+        for width in set(WIDTHS.values()) for extension, _, _ in FORMATS
+    ]
+    if all(storage.exists(path) for path in wanted):
+        return 0
+    written = 0
+    with storage.open(name, 'rb') as source:
+        for width, extension, content in render_derivatives(source):
+            path = derivative_name(name, width, extension)
+            if not storage.exists(path):
+                storage.save(path, ContentFile(content))
+                written += 1
+    return written
+
+
+def derive(model, pk, field, marker):
+    """Build derivatives for one row's image and mark them as ready."""
+    name = model.objects.filter(pk=pk).values_list(field, flat=True).first()
+    if not name:
+        return
+    generate_derivatives(name)
+    # Only if the image wasn't replaced meanwhile, the new one has its own job
+    if model.objects.filter(pk=pk, **{field: name}).update(**{marker: name}):
+        derivatives_ready.send(sender=model, pk=pk)
+
+
+def _derive_in_background(model, pk, field, marker):
+    try:
+        derive(model, pk, field, marker)
+    except Exception:
+        logger.exception('Could not build image derivatives for %s %s', model.__name__, pk)
+    finally:
+        connection.close()
+
+
+def schedule_derivatives(instance, field, marker):
+    """Build derivatives for ``instance``'s image off the request thread once the save commits."""
+    name = getattr(instance, field).name
+    if not name or name == getattr(instance, marker):
+        return
+    model, pk = type(instance), instance.pk
+    transaction.on_commit(lambda: executor.submit(_derive_in_background, model, pk, field, marker))
@@ -0,0 +1,175 @@
+"""
+Bulk catalog import behind `manage.py import_games`.
+
+Rows are streamed from CSV or JSON Lines and handled a batch at a time, so
+memory stays flat however large the source is:
+
+1. every row is validated with GameImportForm (GameForm without the image),
+2. cover images are decoded and shrunk in a process pool,
+3. the batch is inserted with bulk_create, which numbers it from a single
+   UPC block, and added to the facet counts,
+4. the checkpoint is moved past the batch in the same transaction, so an
+   interrupted import resumes after the last committed batch. The covers
+   of a batch that fails are deleted again.
+"""
+import csv
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.text import slugify
+
+from .facets import count_new_games
+from .forms import GameImportForm
+from .models import CatalogVersion, Game, ImportCheckpoint
+
+# Covers are scaled down to fit this box; catalog cards never show more
+MAX_IMAGE_SIZE = (1200, 1200)
+JPEG_QUALITY = 85
+IMAGE_DIR = 'game_images'
+
+
+class BadRow:
+    """Stands in for a line that isn't a row at all, so it is rejected and counted like any other."""
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def read_rows(path):
+    """Yield dicts from a .csv or .jsonl file, one row at a time."""
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as source:
+        if extension == '.csv':
+            yield from csv.DictReader(source)
+        elif extension in ('.jsonl', '.ndjson'):
+            for line in source:
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as error:
+                    yield BadRow(f'Invalid JSON: {error}')
+                    continue
+                yield row if isinstance(row, dict) else BadRow('Expected a JSON object.')
+        else:
+            raise ValueError(f'Unsupported file type {extension!r}, use .csv or .jsonl')
+
+
+def prepare_image(path):
+    """
+    Decode, shrink and re-encode one cover as JPEG bytes. Runs in a worker
+    process, so it takes and returns plain values only.
+    """
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            # Lets JPEGs decode straight at a fraction of their size
+            image.draft('RGB', MAX_IMAGE_SIZE)
+            image.thumbnail(MAX_IMAGE_SIZE)
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    # Anything a decoder raises, DecompressionBombError included, rejects this row
+    # rather than coming back through the pool and stopping the import
+    except Exception as error:
+        return None, f'image {path}: {error}'
+    return output.getvalue(), None
+
+
+class GameImporter:
+    def __init__(self, name, image_root='', batch_size=1000, workers=None, progress=None, on_reject=None):
+        self.name = name
+        self.image_root = image_root
+        self.batch_size = batch_size
+        # workers=0 processes images in this process, handy for tests and tiny files
+        self.workers = os.cpu_count() if workers is None else workers
+        self.progress = progress or (lambda importer: None)
+        self.on_reject = on_reject or (lambda line, reason: None)
+        self.checkpoint, _ = ImportCheckpoint.objects.get_or_create(name=name)
+        self.started = None
+        self.rows_this_run = 0
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.perf_counter() - self.started if self.started else 0
+        return self.rows_this_run / elapsed if elapsed else 0
+
+    def run(self, rows):
+        """Import an iterable of row dicts, skipping the ones a previous run already handled."""
+        self.started = time.perf_counter()
+        rows = itertools.islice(enumerate(rows, start=1), self.checkpoint.position, None)
+        pool = ProcessPoolExecutor(self.workers) if self.workers else None
+        try:
+            while True:
+                batch = list(itertools.islice(rows, self.batch_size))
+                if not batch:
+                    break
+                self.import_batch(batch, pool)
+                self.progress(self)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return self.checkpoint
+
+    def import_batch(self, batch, pool):
+        games, image_paths = [], []
+        for line, row in batch:
+            if isinstance(row, BadRow):
+                self.reject(line, row.reason)
+                continue
+            form = GameImportForm(data=row)
+            if not form.is_valid():
+                self.reject(line, '; '.join(f'{field}: {" ".join(errors)}' for field, errors in form.errors.items()))
+                continue
+            image_path = (row.get('image') or '').strip()
+            if not image_path:
+                self.reject(line, 'image: This field is required.')
+                continue
+            games.append((line, form.save(commit=False)))
+            image_paths.append(os.path.join(self.image_root, image_path))
+
+        images = pool.map(prepare_image, image_paths, chunksize=16) if pool else map(prepare_image, image_paths)
+        ready = []
+        try:
+            for (line, game), (content, error) in zip(games, images):
+                if error:
+                    self.reject(line, error)
+                    continue
+                name = f'{IMAGE_DIR}/{slugify(game.title)[:80] or "game"}.jpg'
+                game.image = default_storage.save(name, ContentFile(content))
+                ready.append(game)
+
+            with transaction.atomic():
+                Game.objects.bulk_create(ready, batch_size=self.batch_size)
+                # bulk_create skips the signals that keep the facet counts
+                count_new_games(ready)
+                if ready:
+                    CatalogVersion.bump()
+                self.checkpoint.position = batch[-1][0]
+                self.checkpoint.created += len(ready)
+                self.checkpoint.rejected += len(batch) - len(ready)
+                self.checkpoint.save()
+        except BaseException:
+            self.discard_images([game.image.name for game in ready])
+            raise
+        self.rows_this_run += len(batch)
+
+    def discard_images(self, names):
+        """
+        Delete the covers saved for a batch that didn't commit. Storage hands
+        out the same name for the same bytes, so files a stored game uses stay.
+        """
+        in_use = set(Game.objects.filter(image__in=names).values_list('image', flat=True))
+        for name in set(names) - in_use:
+            default_storage.delete(name)
+
+    def reject(self, line, reason):
+        self.on_reject(line, reason)
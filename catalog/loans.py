@@ -0,0 +1,191 @@
+"""
+Starting and ending loans.
+
+Game.current_loan points at the game's open loan so availability can be
+read off the game row. These helpers are the only place that sets or
+clears it, always in the same transaction as the loan change.
+
+Approvals lock just the rows involved, the borrow request and its game, so
+librarians working on different games never wait for each other. The
+loan_one_open_per_game constraint backs this up in the database.
+"""
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BorrowRequest, CatalogVersion, Game, Loan
+
+
+class GameUnavailable(Exception):
+    """The game is already on loan."""
+
+
+class RequestAlreadyProcessed(Exception):
+    """The borrow request was approved or rejected by someone else."""
+
+
+# What the bulk helpers report for each request
+APPROVED = 'approved'
+REJECTED = 'rejected'
+ON_LOAN = 'on_loan'
+ALREADY_PROCESSED = 'already_processed'
+
+
+def _locked_requests():
+    # Locks the request rows only, not the games and users joined in
+    return BorrowRequest.objects.select_for_update(of=('self',)).select_related('game', 'requester')
+
+
+def start_loan(game, borrower, duration_days, borrow_date=None):
+    """
+    Lend ``game`` to ``borrower`` and return the new Loan, or raise
+    GameUnavailable if someone else got there first.
+    """
+    borrow_date = borrow_date or timezone.now()
+    try:
+        with transaction.atomic():
+            # Concurrent loans of this game queue up here, the row lock is
+            # released when the surrounding transaction ends
+            current_loan = Game.objects.select_for_update().filter(pk=game.pk).values_list('current_loan', flat=True)
+            if current_loan.first() is not None:
+                raise GameUnavailable(game.title)
+            loan = Loan.objects.create(
+                game=game,
+                borrower=borrower,
+                borrow_date=borrow_date,
+                due_date=borrow_date + timedelta(days=duration_days),
+            )
+            Game.objects.filter(pk=game.pk).update(current_loan=loan)
+    except IntegrityError:
+        # An open loan the game row didn't point at, loan_one_open_per_game caught it
+        raise GameUnavailable(game.title)
+    game.current_loan = loan
+    return loan
+
+
+def approve_borrow_request(borrow_request, librarian):
+    """
+    Approve a pending ``borrow_request`` and lend its game to the requester,
+    returning the Loan. Raises RequestAlreadyProcessed if it isn't pending
+    any more and GameUnavailable if the game is out; nothing changes then.
+    """
+    with transaction.atomic():
+        locked = _locked_requests().get(pk=borrow_request.pk)
+        if locked.status != BorrowRequest.PENDING:
+            raise RequestAlreadyProcessed(locked.status)
+        loan = start_loan(locked.game, locked.requester, locked.duration_days)
+        borrow_request.status = locked.status = BorrowRequest.APPROVED
+        borrow_request.processed_date = locked.processed_date = timezone.now()
+        borrow_request.processed_by = locked.processed_by = librarian
+        locked.save(update_fields=['status', 'processed_date', 'processed_by'])
+    return loan
+
+
+def start_loans(wanted, borrow_date=None):
+    """
+    Lend several games at once. ``wanted`` is a list of (game id, borrower id,
+    duration in days), earlier entries win when they want the same game.
+    Returns a list matching ``wanted`` with the new Loan, or None where the
+    game was out already. A fixed handful of queries however many there are.
+    """
+    borrow_date = borrow_date or timezone.now()
+    with transaction.atomic():
+        games = Game.objects.select_for_update().filter(pk__in={game_id for game_id, _, _ in wanted}).order_by('pk')
+        taken = {game_id for game_id, current_loan in games.values_list('pk', 'current_loan') if current_loan}
+        loans = []
+        for game_id, borrower_id, duration_days in wanted:
+            if game_id in taken:
+                loans.append(None)
+                continue
+            taken.add(game_id)
+            loans.append(Loan(
+                game_id=game_id,
+                borrower_id=borrower_id,
+                borrow_date=borrow_date,
+                due_date=borrow_date + timedelta(days=duration_days),
+            ))
+        new_loans = [loan for loan in loans if loan is not None]
+        if new_loans:
+            Loan.objects.bulk_create(new_loans)
+            # bulk_create and bulk_update skip the signals that bump circulation_version
+            Game.objects.bulk_update(
+                [Game(pk=loan.game_id, current_loan=loan, circulation_version=F('circulation_version') + 1)
+                 for loan in new_loans],
+                ['current_loan', 'circulation_version'],
+            )
+            CatalogVersion.bump()
+    return loans
+
+
+def bulk_approve_borrow_requests(request_ids, librarian):
+    """
+    Approve a batch of borrow requests in one transaction, the oldest first
+    when several want the same game. Returns (request, outcome) pairs;
+    requests whose game is out stay pending.
+    """
+    with transaction.atomic():
+        requests = list(_locked_requests().filter(pk__in=request_ids).order_by('request_date', 'pk'))
+        pending = [borrow_request for borrow_request in requests if borrow_request.status == BorrowRequest.PENDING]
+        now = timezone.now()
+        loans = start_loans(
+            [(borrow_request.game_id, borrow_request.requester_id, borrow_request.duration_days)
+             for borrow_request in pending],
+            borrow_date=now,
+        )
+        outcomes = {borrow_request.pk: ALREADY_PROCESSED for borrow_request in requests}
+        approved = []
+        for borrow_request, loan in zip(pending, loans):
+            if loan is None:
+                outcomes[borrow_request.pk] = ON_LOAN
+                continue
+            borrow_request.status = BorrowRequest.APPROVED
+            borrow_request.processed_date = now
+            borrow_request.processed_by = librarian
+            approved.append(borrow_request)
+            outcomes[borrow_request.pk] = APPROVED
+        BorrowRequest.objects.bulk_update(approved, ['status', 'processed_date', 'processed_by'])
+    return [(borrow_request, outcomes[borrow_request.pk]) for borrow_request in requests]
+
+
+def bulk_reject_borrow_requests(request_ids, librarian):
+    """Reject a batch of borrow requests in one transaction, returns (request, outcome) pairs."""
+    with transaction.atomic():
+        requests = list(_locked_requests().filter(pk__in=request_ids).order_by('request_date', 'pk'))
+        now = timezone.now()
+        report, rejected = [], []
+        for borrow_request in requests:
+            if borrow_request.status != BorrowRequest.PENDING:
+                report.append((borrow_request, ALREADY_PROCESSED))
+                continue
+            borrow_request.status = BorrowRequest.REJECTED
+            borrow_request.processed_date = now
+            borrow_request.processed_by = librarian
+            rejected.append(borrow_request)
+            report.append((borrow_request, REJECTED))
+        BorrowRequest.objects.bulk_update(rejected, ['status', 'processed_date', 'processed_by'])
+        if rejected:
+            Game.objects.filter(pk__in={borrow_request.game_id for borrow_request in rejected}).update(
+                circulation_version=F('circulation_version') + 1
+            )
+            CatalogVersion.bump()
+    return report
+
+
+def end_loan(loan, return_date=None):
+    """
+    Mark ``loan`` returned and make its game available again, or lend it to
+    the first patron on the waitlist. Returns that new Loan, if any.
+    """
+    from .holds import hand_off
+
+    with transaction.atomic():
+        loan.is_returned = True
+        loan.return_date = return_date or timezone.now()
+        loan.save()
+        # The update locks the game row; a concurrent return of the same loan
+        # waits for it and then finds nothing left to clear
+        if Game.objects.filter(pk=loan.game_id, current_loan=loan).update(current_loan=None):
+            return hand_off(loan.game_id)
+    return None
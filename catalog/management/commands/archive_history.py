@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from catalog.archive import AGE, BATCH_SIZE, archive_borrow_requests, archive_loans
+
+
+class Command(BaseCommand):
+    help = 'Move returned loans and processed borrow requests older than --days into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=AGE.days)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                            help='Rows moved per transaction, a stopped run is picked up by the next one')
+
+    def handle(self, *args, **options):
+        age = timedelta(days=options['days'])
+        loans = archive_loans(age=age, batch_size=options['batch_size'])
+        requests = archive_borrow_requests(age=age, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {loans} loans and {requests} borrow requests.'))
@@ -0,0 +1,70 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from catalog import typeahead
+from catalog.benchmarks import percentile, rolled_back, seed_games
+from catalog.fuzzy import fuzzy_search
+from catalog.models import Game
+
+
+def misspell(title, rng):
+    """Drop, double or swap one letter of a title, like a hurried patron would."""
+    chars = list(title)
+    i = rng.randrange(1, len(chars) - 1)
+    edit = rng.choice(['drop', 'double', 'swap'])
+    if edit == 'drop':
+        del chars[i]
+    elif edit == 'double':
+        chars.insert(i, chars[i])
+    else:
+        chars[i], chars[i + 1] = chars[i + 1], chars[i]
+    return ''.join(chars)
+
+
+class Command(BaseCommand):
+    help = 'Compare trigram title search latency against the old icontains filter on synthetic catalogs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000])
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--limit', type=int, default=60)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        self.stdout.write(f'Backend: {connection.vendor}')
+        self.stdout.write(f'{"games":>10} {"path":>10} {"p50 ms":>10} {"p95 ms":>10} {"found":>8}')
+
+        with rolled_back():
+            seeded = Game.objects.count()
+            for size in sorted(options['sizes']):
+                if size > seeded:
+                    seed_games(size - seeded, start=seeded)
+                    seeded = size
+
+                titles = list(Game.objects.order_by('?').values_list('title', flat=True)[:options['queries']])
+                # Drop the trailing serial number so only the misspelled words are searched for
+                queries = [misspell(title.rsplit(' ', 1)[0], rng) for title in titles]
+
+                if connection.vendor != 'postgresql':
+                    start = time.perf_counter()
+                    typeahead.index.rebuild()
+                    self.stdout.write(f'{size:>10} {"build":>10} {(time.perf_counter() - start) * 1000:>10.0f}')
+
+                for name, search in [
+                    ('icontains', lambda query: Game.objects.filter(title__icontains=query)),
+                    ('trigram', lambda query: fuzzy_search(Game.objects.all(), query)),
+                ]:
+                    samples, found = [], 0
+                    for query in queries:
+                        start = time.perf_counter()
+                        ids = list(search(query).values_list('id', flat=True)[:options['limit']])
+                        samples.append((time.perf_counter() - start) * 1000)
+                        found += bool(ids)
+                    self.stdout.write(
+                        f'{size:>10} {name:>10} {percentile(samples, 50):>10.2f} '
+                        f'{percentile(samples, 95):>10.2f} {found:>5}/{len(queries)}'
+                    )
+        typeahead.index.clear()
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from catalog.benchmarks import percentile, rolled_back, seed_games
+from catalog.models import Game
+from catalog.search import _icontains_search, search_games
+
+QUERIES = ['zelda', 'dragon quest', 'kni', 'shadow empire tactics', 'kariton', 'vortexqui', 'strategy']
+
+
+class Command(BaseCommand):
+    help = 'Compare full-text search latency against the old icontains filters on synthetic catalogs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--page-size', type=int, default=60)
+        parser.add_argument('--skip-icontains', action='store_true',
+                            help='Only time the full-text backend (icontains is very slow at 1M rows)')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Backend: {connection.vendor}')
+        self.stdout.write(f'{"games":>10} {"path":>10} {"p50 ms":>10} {"p95 ms":>10}')
+
+        with rolled_back():
+            seeded = Game.objects.count()
+            for size in sorted(options['sizes']):
+                if size > seeded:
+                    seed_games(size - seeded, start=seeded)
+                    seeded = size
+                if connection.vendor == 'sqlite':
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE')
+
+                paths = [('fts', search_games)]
+                if not options['skip_icontains']:
+                    paths.append(('icontains', _icontains_search))
+
+                for name, search in paths:
+                    samples = []
+                    for _ in range(options['repeat']):
+                        for query in QUERIES:
+                            start = time.perf_counter()
+                            list(search(Game.objects.all(), query)[:options['page_size']].values_list('id', flat=True))
+                            samples.append((time.perf_counter() - start) * 1000)
+                    self.stdout.write(
+                        f'{size:>10} {name:>10} {percentile(samples, 50):>10.2f} {percentile(samples, 95):>10.2f}'
+                    )
@@ -0,0 +1,73 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.benchmarks import rolled_back, synthetic_games
+from catalog.models import Game, calculate_upc_check_digit
+from catalog.upc import allocator
+
+
+def legacy_upc():
+    """The old generator: random codes checked one by one against the table."""
+    attempts = 0
+    while True:
+        attempts += 1
+        base_upc = f'{random.randint(0, 999999):06d}{random.randint(0, 99999):05d}'
+        upc = base_upc + calculate_upc_check_digit(base_upc)
+        if not Game.objects.filter(upc=upc).exists():
+            return upc, attempts
+
+
+def unnumbered_games(count, start):
+    for game in synthetic_games(count, start=start):
+        game.upc = ''
+        yield game
+
+
+class Command(BaseCommand):
+    help = 'Time inserting games with block allocated UPCs against the old random generator'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100_000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--sample', type=int, default=2000,
+                            help='Games saved one at a time for the per-row comparison')
+
+    def handle(self, *args, **options):
+        count, batch_size, sample = options['count'], options['batch_size'], options['sample']
+
+        with rolled_back():
+            start = time.perf_counter()
+            attempts = 0
+            for game in unnumbered_games(sample, start=0):
+                game.upc, tries = legacy_upc()
+                attempts += tries
+                # Skip Game.save() so only the UPC strategy differs from the next run
+                Game.objects.bulk_create([game])
+            legacy = time.perf_counter() - start
+            self.stdout.write(
+                f'Random UPCs, one row at a time: {sample / legacy:,.0f} games/s '
+                f'({attempts / sample:.3f} attempts per code)'
+            )
+
+        allocator.clear()
+        with rolled_back():
+            start = time.perf_counter()
+            for game in unnumbered_games(sample, start=0):
+                Game.objects.bulk_create([game])
+            blocks = time.perf_counter() - start
+            self.stdout.write(f'Block UPCs, one row at a time: {sample / blocks:,.0f} games/s')
+
+        allocator.clear()
+        with rolled_back():
+            start = time.perf_counter()
+            games = unnumbered_games(count, start=0)
+            created = 0
+            while created < count:
+                batch = [game for _, game in zip(range(min(batch_size, count - created)), games)]
+                Game.objects.bulk_create(batch, batch_size=batch_size)
+                created += len(batch)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'Block UPCs, bulk_create: {count:,} games in {elapsed:.1f}s ({count / elapsed:,.0f} games/s)')
+        allocator.clear()
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+
+from catalog.images import derive
+from catalog.models import Game
+from home.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = 'Build the resized copies of game covers and profile pictures that are missing them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        default_picture = UserProfile._meta.get_field('profile_pic').default
+        jobs = [
+            (Game, pk, 'image', 'image_derived_from')
+            for pk in Game.objects.exclude(image='').exclude(image=F('image_derived_from'))
+                                  .values_list('pk', flat=True).iterator()
+        ] + [
+            (UserProfile, pk, 'profile_pic', 'profile_pic_derived_from')
+            for pk in UserProfile.objects.exclude(profile_pic__in=['', default_picture])
+                                         .exclude(profile_pic=F('profile_pic_derived_from'))
+                                         .values_list('pk', flat=True).iterator()
+        ]
+        self.stdout.write(f'{len(jobs)} images to process')
+
+        failed = 0
+        with ThreadPoolExecutor(options['workers']) as pool:
+            for job, error in zip(jobs, pool.map(self.run, jobs)):
+                if error:
+                    failed += 1
+                    model, pk, field, marker = job
+                    self.stderr.write(f'{model.__name__} {pk}: {error}')
+        self.stdout.write(self.style.SUCCESS(f'Done, {len(jobs) - failed} processed, {failed} failed.'))
+
+    def run(self, job):
+        try:
+            derive(*job)
+        except Exception as error:
+            return error
+        finally:
+            connection.close()
@@ -0,0 +1,59 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from catalog.importer import GameImporter, read_rows
+from catalog.models import ImportCheckpoint
+
+
+class Command(BaseCommand):
+    help = 'Import games from a CSV or JSON Lines file, resuming where an earlier run stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='.csv or .jsonl file with title, description, release_date, '
+                                         'genre, platform, location and image columns')
+        parser.add_argument('--image-root', default=None,
+                            help='Directory image paths are relative to (default: next to the file)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Image processes (default: one per CPU, 0 to process images inline)')
+        parser.add_argument('--checkpoint', default=None,
+                            help='Checkpoint name (default: the absolute path of the file)')
+        parser.add_argument('--restart', action='store_true', help='Ignore any checkpoint and start over')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'No such file: {path}')
+        name = options['checkpoint'] or os.path.abspath(path)
+        if options['restart']:
+            ImportCheckpoint.objects.filter(name=name).delete()
+
+        importer = GameImporter(
+            name,
+            image_root=options['image_root'] or os.path.dirname(os.path.abspath(path)),
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            progress=self.report,
+            on_reject=lambda line, reason: self.stderr.write(f'Row {line} skipped: {reason}'),
+        )
+        if importer.checkpoint.position:
+            self.stdout.write(f'Resuming after row {importer.checkpoint.position}')
+
+        try:
+            checkpoint = importer.run(read_rows(path))
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {checkpoint.created} games imported, {checkpoint.rejected} rows skipped '
+            f'({importer.rows_per_second:,.0f} rows/s this run).'
+        ))
+        # bulk_create skips the signal that schedules the responsive image sizes
+        self.stdout.write('Run generate_image_derivatives to build the resized covers.')
+
+    def report(self, importer):
+        checkpoint = importer.checkpoint
+        self.stdout.write(
+            f'Row {checkpoint.position}: {checkpoint.created} imported, {checkpoint.rejected} skipped, '
+            f'{importer.rows_per_second:,.0f} rows/s'
+        )
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from catalog.facets import rebuild_facet_counts
+from catalog.models import FacetCount
+
+
+class Command(BaseCommand):
+    help = 'Recompute the catalog facet counts from scratch'
+
+    def handle(self, *args, **options):
+        rebuild_facet_counts()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {FacetCount.objects.count()} facet counts.'))
@@ -0,0 +1,21 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from catalog.recommendations import TOP_K, refresh
+
+
+class Command(BaseCommand):
+    help = 'Count loans and ratings added since the last run and refresh the neighbors of the games they touched'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Forget the kept counts and recount the whole history')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        games = refresh(top_k=options['top_k'], rebuild=options['rebuild'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed neighbors for {games} games in {time.perf_counter() - start:.1f}s.'
+        ))
@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.core.mail import send_mass_mail
+from django.core.management.base import BaseCommand
+
+from catalog.models import Loan
+from catalog.overdue import CHUNK_SIZE, DUE_SOON, scan_loans
+
+HEADINGS = {
+    Loan.OVERDUE: 'Overdue',
+    Loan.DUE_SOON: 'Due soon',
+}
+
+
+def digest_text(states):
+    lines = []
+    for state, heading in HEADINGS.items():
+        for loan in states.get(state, []):
+            lines.append(f'{heading}: {loan.game.title}, due {loan.due_date:%Y-%m-%d}')
+    return '\n'.join(lines)
+
+
+class Command(BaseCommand):
+    help = 'Mark loans that became overdue or due soon since the last run and print a digest per borrower'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--due-soon-days', type=int, default=DUE_SOON.days)
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--name', default='default', help='Scans with different names keep separate marks')
+        parser.add_argument('--email', action='store_true', help='Also mail each borrower their digest')
+
+    def handle(self, *args, **options):
+        digest = scan_loans(
+            name=options['name'],
+            due_soon=timedelta(days=options['due_soon_days']),
+            chunk_size=options['chunk_size'],
+        )
+        mails = []
+        for borrower, states in sorted(digest.items(), key=lambda item: item[0].username):
+            text = digest_text(states)
+            self.stdout.write(f'{borrower.username}\n' + '\n'.join(f'  {line}' for line in text.splitlines()))
+            if options['email'] and borrower.email:
+                mails.append(('Your game loans', f'Hi {borrower.username},\n\n{text}\n', None, [borrower.email]))
+        if mails:
+            send_mass_mail(mails)
+
+        marked = sum(len(loans) for states in digest.values() for loans in states.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Marked {marked} loans for {len(digest)} borrowers, {len(mails)} digests mailed.'
+        ))
@@ -0,0 +1,72 @@
+from django.db import migrations
+
+# The DDL as it stood when this migration was written, later changes to
+# catalog.search must not change what it does
+COLUMNS = "title, description, genre, platform, location"
+NEW_COLUMNS = "new.title, new.description, new.genre, new.platform, new.location"
+OLD_COLUMNS = "old.title, old.description, old.genre, old.platform, old.location"
+
+SQLITE_INSTALL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS catalog_game_fts USING fts5("
+    f"{COLUMNS}, content='catalog_game', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS catalog_game_fts_ai AFTER INSERT ON catalog_game BEGIN "
+    f"INSERT INTO catalog_game_fts(rowid, {COLUMNS}) VALUES (new.id, {NEW_COLUMNS}); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS catalog_game_fts_ad AFTER DELETE ON catalog_game BEGIN "
+    f"INSERT INTO catalog_game_fts(catalog_game_fts, rowid, {COLUMNS}) "
+    f"VALUES ('delete', old.id, {OLD_COLUMNS}); "
+    f"END",
+    f"CREATE TRIGGER IF NOT EXISTS catalog_game_fts_au AFTER UPDATE OF {COLUMNS} ON catalog_game BEGIN "
+    f"INSERT INTO catalog_game_fts(catalog_game_fts, rowid, {COLUMNS}) "
+    f"VALUES ('delete', old.id, {OLD_COLUMNS}); "
+    f"INSERT INTO catalog_game_fts(rowid, {COLUMNS}) VALUES (new.id, {NEW_COLUMNS}); "
+    f"END",
+    "INSERT INTO catalog_game_fts(catalog_game_fts) VALUES ('rebuild')",
+]
+
+SQLITE_UNINSTALL = [
+    "DROP TRIGGER IF EXISTS catalog_game_fts_ai",
+    "DROP TRIGGER IF EXISTS catalog_game_fts_ad",
+    "DROP TRIGGER IF EXISTS catalog_game_fts_au",
+    "DROP TABLE IF EXISTS catalog_game_fts",
+]
+
+POSTGRES_INSTALL = [
+    "ALTER TABLE catalog_game ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(genre, '') || ' ' || coalesce(platform, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(location, '')), 'C') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'D')"
+    ") STORED",
+    "CREATE INDEX IF NOT EXISTS catalog_game_search_vector_idx "
+    "ON catalog_game USING GIN (search_vector)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS catalog_game_search_vector_idx",
+    "ALTER TABLE catalog_game DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0011_borrowrequest_duration_days"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"sqlite": SQLITE_INSTALL, "postgresql": POSTGRES_INSTALL}),
+            run({"sqlite": SQLITE_UNINSTALL, "postgresql": POSTGRES_UNINSTALL}),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0012_game_search_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="game",
+            index=models.Index(
+                fields=["created_at", "id"], name="game_created_at_id_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="game",
+            index=models.Index(fields=["title", "id"], name="game_title_id_idx"),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_visibility(apps, schema_editor):
+    Game = apps.get_model("catalog", "Game")
+    Collection = apps.get_model("collection", "Collection")
+    memberships = Collection.games.through.objects.values_list(
+        "game_id", "collection_id", "collection__is_private"
+    )
+    for game_id, collection_id, is_private in memberships.iterator():
+        if is_private:
+            Game.objects.filter(id=game_id).update(private_collection_id=collection_id)
+            Game.objects.filter(id=game_id, visibility="unlisted").update(visibility="private")
+        else:
+            Game.objects.filter(id=game_id).update(visibility="public")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("collection", "0002_collectionaccessrequest"),
+        ("catalog", "0013_game_listing_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="private_collection",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="collection.collection",
+            ),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="visibility",
+            field=models.CharField(
+                choices=[
+                    ("public", "Public"),
+                    ("unlisted", "Unlisted"),
+                    ("private", "Private"),
+                ],
+                db_index=True,
+                default="unlisted",
+                editable=False,
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(backfill_visibility, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:53
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_games(apps, schema_editor):
+    Game = apps.get_model("catalog", "Game")
+    FacetCount = apps.get_model("catalog", "FacetCount")
+    counts = Counter()
+    rows = (
+        Game.objects.values_list(
+            "genre",
+            "platform",
+            "location",
+            "release_date__year",
+            "visibility",
+            "private_collection_id",
+        )
+        .annotate(n=Count("id"))
+        .order_by()
+    )
+    for genre, platform, location, year, visibility, private_collection_id, n in rows:
+        scope = (
+            f"private:{private_collection_id}"
+            if visibility == "private"
+            else visibility
+        )
+        for facet, value in [
+            ("genre", genre),
+            ("platform", platform),
+            ("location", location),
+            ("decade", f"{year // 10 * 10}s"),
+        ]:
+            if value:
+                counts[(facet, value, scope)] += n
+    FacetCount.objects.bulk_create(
+        [
+            FacetCount(facet=f, value=v, scope=s, count=n)
+            for (f, v, s), n in counts.items()
+        ]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0014_game_visibility"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FacetCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "facet",
+                    models.CharField(
+                        choices=[
+                            ("genre", "Genre"),
+                            ("platform", "Platform"),
+                            ("location", "Location"),
+                            ("decade", "Release Decade"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("value", models.CharField(max_length=100)),
+                ("scope", models.CharField(max_length=30)),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "unique_together": {("facet", "value", "scope")},
+            },
+        ),
+        migrations.RunPython(count_existing_games, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.18 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0015_facetcount"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="game",
+            index=models.Index(fields=["updated_at"], name="game_updated_at_idx"),
+        ),
+    ]
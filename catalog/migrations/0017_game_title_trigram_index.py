@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# The DDL as it stood when this migration was written, later changes to
+# catalog.fuzzy must not change what it does
+POSTGRES_INSTALL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS catalog_game_title_trgm_idx "
+    "ON catalog_game USING GIN (title gin_trgm_ops)",
+]
+
+POSTGRES_UNINSTALL = [
+    "DROP INDEX IF EXISTS catalog_game_title_trgm_idx",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement, params=None)
+
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0016_game_updated_at_idx"),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({"postgresql": POSTGRES_INSTALL}),
+            run({"postgresql": POSTGRES_UNINSTALL}),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:02
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Game = apps.get_model("catalog", "Game")
+    Rating = apps.get_model("catalog", "Rating")
+    totals = (
+        Rating.objects.values("game_id")
+        .annotate(
+            rating_count=Count("id"),
+            rating_sum=Sum("rating"),
+            **{
+                f"rating_{stars}": Count("id", filter=Q(rating=stars))
+                for stars in range(1, 6)
+            },
+        )
+        .order_by()
+    )
+    for row in totals.iterator():
+        Game.objects.filter(id=row.pop("game_id")).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0017_game_title_trigram_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="rating_1",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="rating_2",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="rating_3",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="rating_4",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="rating_5",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="rating_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_current_loan(apps, schema_editor):
+    Game = apps.get_model("catalog", "Game")
+    Loan = apps.get_model("catalog", "Loan")
+    open_loans = Loan.objects.filter(is_returned=False).order_by("borrow_date", "id")
+    # Later loans win if a game somehow has more than one open
+    for loan_id, game_id in open_loans.values_list("id", "game_id").iterator():
+        Game.objects.filter(id=game_id).update(current_loan_id=loan_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0018_game_rating_aggregates"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="current_loan",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="catalog.loan",
+            ),
+        ),
+        migrations.RunPython(backfill_current_loan, migrations.RunPython.noop),
+    ]
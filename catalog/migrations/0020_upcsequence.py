@@ -0,0 +1,23 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0019_game_current_loan"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UpcSequence",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=20, primary_key=True, serialize=False),
+                ),
+                ("next_value", models.BigIntegerField()),
+            ],
+        ),
+    ]
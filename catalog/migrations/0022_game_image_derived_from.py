@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0021_importcheckpoint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="image_derived_from",
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
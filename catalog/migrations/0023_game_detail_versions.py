@@ -0,0 +1,29 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0022_game_image_derived_from"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="comment_version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="game",
+            name="rating_version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["game", "created_at", "id"], name="comment_game_created_idx"
+            ),
+        ),
+    ]
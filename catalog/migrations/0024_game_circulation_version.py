@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0023_game_detail_versions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="circulation_version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:36
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_open_loans(apps, schema_editor):
+    Loan = apps.get_model("catalog", "Loan")
+    # Which of two open loans is real is for a librarian to decide, not a migration
+    games = (
+        Loan.objects.filter(is_returned=False)
+        .values("game_id")
+        .annotate(open_loans=Count("id"))
+        .filter(open_loans__gt=1)
+        .values("game_id")
+    )
+    conflicts = (
+        Loan.objects.filter(is_returned=False, game_id__in=games)
+        .order_by("game_id", "borrow_date", "id")
+        .values_list(
+            "id", "game_id", "game__title", "borrower__username", "borrow_date"
+        )
+    )
+    if conflicts:
+        lines = "\n".join(
+            f"  loan {loan_id}: game {game_id} ({title}) lent to {borrower} on {borrowed:%Y-%m-%d}"
+            for loan_id, game_id, title, borrower, borrowed in conflicts
+        )
+        raise RuntimeError(
+            "Some games have more than one open loan. Return the loans that are no "
+            "longer out and run migrate again:\n" + lines
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0024_game_circulation_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_open_loans, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="loan",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("is_returned", False)),
+                fields=("game",),
+                name="loan_one_open_per_game",
+            ),
+        ),
+    ]
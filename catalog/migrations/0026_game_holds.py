@@ -0,0 +1,77 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("catalog", "0025_loan_one_open_per_game"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="game",
+            name="hold_tail",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name="Hold",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ticket", models.PositiveIntegerField()),
+                (
+                    "duration_days",
+                    models.IntegerField(
+                        choices=[
+                            (7, "1 Week"),
+                            (14, "2 Weeks"),
+                            (21, "3 Weeks"),
+                            (28, "4 Weeks"),
+                        ],
+                        default=14,
+                    ),
+                ),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="holds",
+                        to="catalog.game",
+                    ),
+                ),
+                (
+                    "patron",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="holds",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="hold",
+            constraint=models.UniqueConstraint(
+                fields=("game", "ticket"), name="hold_game_ticket_unique"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="hold",
+            constraint=models.UniqueConstraint(
+                fields=("game", "patron"), name="hold_one_per_patron"
+            ),
+        ),
+    ]
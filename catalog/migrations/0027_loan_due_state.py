@@ -0,0 +1,58 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0026_game_holds"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OverdueScan",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("overdue_until", models.DateTimeField(blank=True, null=True)),
+                ("due_soon_until", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="loan",
+            name="due_state",
+            field=models.CharField(
+                blank=True,
+                choices=[("due_soon", "Due soon"), ("overdue", "Overdue")],
+                default="",
+                editable=False,
+                max_length=10,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                condition=models.Q(("is_returned", False)),
+                fields=["due_date", "id"],
+                name="loan_open_due_date_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                condition=models.Q(("is_returned", False)),
+                fields=["due_state", "due_date"],
+                name="loan_open_due_state_idx",
+            ),
+        ),
+    ]
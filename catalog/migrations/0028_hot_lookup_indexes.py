@@ -0,0 +1,37 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0027_loan_due_state"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="borrowrequest",
+            index=models.Index(
+                condition=models.Q(("status", "pending")),
+                fields=["request_date", "id"],
+                name="borrow_pending_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="borrowrequest",
+            index=models.Index(
+                condition=models.Q(("status", "pending")),
+                fields=["game", "requester"],
+                name="borrow_pending_game_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="loan",
+            index=models.Index(
+                condition=models.Q(("is_returned", False)),
+                fields=["borrower", "due_date"],
+                name="loan_open_borrower_idx",
+            ),
+        ),
+    ]
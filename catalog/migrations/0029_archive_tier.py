@@ -0,0 +1,115 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:59
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("catalog", "0028_hot_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedLoan",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("borrow_date", models.DateTimeField()),
+                ("due_date", models.DateTimeField()),
+                ("return_date", models.DateTimeField(blank=True, null=True)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "borrower",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_loans",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_loans",
+                        to="catalog.game",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["borrower", "return_date"],
+                        name="archived_loan_borrower_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="ArchivedBorrowRequest",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("approved", "Approved"),
+                            ("rejected", "Rejected"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "duration_days",
+                    models.IntegerField(
+                        choices=[
+                            (7, "1 Week"),
+                            (14, "2 Weeks"),
+                            (21, "3 Weeks"),
+                            (28, "4 Weeks"),
+                        ]
+                    ),
+                ),
+                ("request_date", models.DateTimeField()),
+                ("processed_date", models.DateTimeField(blank=True, null=True)),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_borrow_requests",
+                        to="catalog.game",
+                    ),
+                ),
+                (
+                    "processed_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "requester",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_borrow_requests",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["requester", "request_date"],
+                        name="archived_request_requester_idx",
+                    )
+                ],
+            },
+        ),
+    ]
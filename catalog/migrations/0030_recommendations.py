@@ -0,0 +1,150 @@
+# Generated by Django 4.2.18 on 2026-10-18 14:06
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("catalog", "0029_archive_tier"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RecommendationBuild",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, unique=True)),
+                ("loans_until", models.BigIntegerField(default=0)),
+                ("ratings_until", models.DateTimeField(blank=True, null=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="PatronGame",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="catalog.game",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="GamePair",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("patrons", models.PositiveIntegerField()),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="catalog.game",
+                    ),
+                ),
+                (
+                    "other",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="catalog.game",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="GameNeighbor",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("score", models.FloatField()),
+                (
+                    "game",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="neighbors",
+                        to="catalog.game",
+                    ),
+                ),
+                (
+                    "neighbor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="neighbor_of",
+                        to="catalog.game",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name="patrongame",
+            constraint=models.UniqueConstraint(
+                fields=("user", "game"), name="patron_game_unique"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="gamepair",
+            constraint=models.UniqueConstraint(
+                fields=("game", "other"), name="game_pair_unique"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="gameneighbor",
+            index=models.Index(
+                fields=["game", "-score"], name="game_neighbor_score_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="gameneighbor",
+            constraint=models.UniqueConstraint(
+                fields=("game", "neighbor"), name="game_neighbor_unique"
+            ),
+        ),
+    ]
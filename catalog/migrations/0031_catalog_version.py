@@ -0,0 +1,34 @@
+# Generated by Django 4.2.18 on 2026-10-18 14:23
+
+from django.db import migrations, models
+
+
+def create_row(apps, schema_editor):
+    CatalogVersion = apps.get_model("catalog", "CatalogVersion")
+    CatalogVersion.objects.create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("catalog", "0030_recommendations"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_row, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import BooleanField, Case, Exists, ExpressionWrapper, F, FloatField, OuterRef, Q, Value, When
+from django.db.models.functions import Cast
 from django.contrib.auth.models import User
 from django.utils import timezone
-import random
 from datetime import timedelta
 from django.core.exceptions import ValidationError
 
@@ -15,17 +16,78 @@ def calculate_upc_check_digit(upc_without_check_digit):
 
 
 def generate_upc():
-    while True:
-        manufacturer = f"{random.randint(0, 999999):06d}"
-        product = f"{random.randint(0, 99999):05d}"
-        base_upc = manufacturer + product
-        check_digit = calculate_upc_check_digit(base_upc)
-        upc = base_upc + check_digit
-        if not Game.objects.filter(upc=upc).exists():
-            return upc
+    from .upc import allocate_upcs
+    return allocate_upcs(1)[0]
+
+
+class GameQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # Number the whole batch from one reserved block instead of a lookup per game
+        from .upc import assign_upcs
+        objs = assign_upcs(list(objs))
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def visible_to(self, user):
+        """
+        Games ``user`` may see in the catalog: librarians see everything,
+        patrons see public and unlisted games plus private collections they
+        were granted access to, and anonymous visitors only see games in
+        public collections.
+        """
+        if not user.is_authenticated:
+            return self.filter(visibility=Game.PUBLIC)
+        if user.userprofile.role == 'Librarian':
+            return self
+        from collection.models import CollectionAccessRequest
+        approved_collections = CollectionAccessRequest.objects.filter(
+            requester=user,
+            status=CollectionAccessRequest.APPROVED,
+        ).values('collection_id')
+        return self.filter(
+            Q(visibility__in=[Game.PUBLIC, Game.UNLISTED]) |
+            Q(private_collection__in=approved_collections)
+        )
+
+    def with_card_state(self, user):
+        """
+        Annotate everything a game card shows so a page of cards is a single
+        query: on_loan, current_borrower_username, has_pending_borrow_request,
+        rating_average, and whether ``user`` has the game on loan
+        (user_has_loan) or a pending request for it (user_has_pending_request).
+        """
+        pending = BorrowRequest.objects.filter(game=OuterRef('pk'), status=BorrowRequest.PENDING)
+        if user.is_authenticated:
+            user_has_loan = ExpressionWrapper(Q(current_loan__borrower=user), output_field=BooleanField())
+            user_has_pending_request = Exists(pending.filter(requester=user))
+        else:
+            user_has_loan = user_has_pending_request = Value(False)
+        return self.annotate(
+            on_loan=ExpressionWrapper(Q(current_loan__isnull=False), output_field=BooleanField()),
+            current_borrower_username=F('current_loan__borrower__username'),
+            has_pending_borrow_request=Exists(pending),
+            rating_average=Case(
+                When(rating_count=0, then=Value(0.0)),
+                default=Cast('rating_sum', FloatField()) / F('rating_count'),
+                output_field=FloatField(),
+            ),
+            user_has_loan=user_has_loan,
+            user_has_pending_request=user_has_pending_request,
+        )
 
 
 class Game(models.Model):
+    # Who can see a game, maintained from its collection memberships by
+    # collection.visibility.refresh_game_visibility
+    PUBLIC = 'public'      # in at least one public collection
+    UNLISTED = 'unlisted'  # not in any collection
+    PRIVATE = 'private'    # only in a private collection
+
+    VISIBILITY_CHOICES = [
+        (PUBLIC, 'Public'),
+        (UNLISTED, 'Unlisted'),
+        (PRIVATE, 'Private'),
+    ]
+
     title = models.CharField(max_length=200)
     description = models.TextField()
     release_date = models.DateField()
@@ -36,11 +98,61 @@ class Game(models.Model):
     upc = models.CharField(max_length=12, unique=True, blank=True, editable=False)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default=UNLISTED,
+                                  editable=False, db_index=True)
+    private_collection = models.ForeignKey('collection.Collection', on_delete=models.SET_NULL, null=True,
+                                           blank=True, editable=False, related_name='+')
+    # Name of the image the resized copies were made from, set by catalog.images
+    image_derived_from = models.CharField(max_length=100, blank=True, editable=False)
+    # The open loan if the game is lent out, maintained by catalog.loans
+    current_loan = models.ForeignKey('Loan', on_delete=models.SET_NULL, null=True, blank=True,
+                                     editable=False, related_name='+')
+    # Bumped whenever a comment or rating of the game changes, the detail
+    # page's cached fragments are keyed on them
+    comment_version = models.PositiveIntegerField(default=0, editable=False)
+    rating_version = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped whenever a loan or borrow request of the game changes, part of
+    # the ETags in catalog.etags
+    circulation_version = models.PositiveIntegerField(default=0, editable=False)
+    # Ticket number of the last hold placed on the game, see catalog.holds
+    hold_tail = models.PositiveIntegerField(default=0, editable=False)
+    # Rating aggregates, maintained by catalog.ratings
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = GameQuerySet.as_manager()
+
+    # Columns maintained elsewhere with queryset updates. A plain save() leaves
+    # them alone so a stale instance can't overwrite newer values.
+    MAINTAINED_FIELDS = {
+        'visibility', 'private_collection', 'current_loan', 'image_derived_from', 'comment_version', 'rating_version',
+        'circulation_version',
+        'rating_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+    }
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the catalog listing
+            models.Index(fields=['created_at', 'id'], name='game_created_at_id_idx'),
+            models.Index(fields=['title', 'id'], name='game_title_id_idx'),
+            # Lets the typeahead index in each worker catch up on changes
+            models.Index(fields=['updated_at'], name='game_updated_at_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         self.clean()
         if not self.upc:
             self.upc = generate_upc()
+        if self.pk is not None and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.MAINTAINED_FIELDS
+            ]
         super().save(*args, **kwargs)
 
     @property
@@ -49,30 +161,34 @@ class Game(models.Model):
             return False     # Return a default value when not yet saved
         return self.collections.filter(is_private=True).exists()
 
-    @property
-    def private_collection(self):
-        return self.collections.filter(is_private=True).first()
-
     def clean(self):
         if self.is_in_private_collection and self.collections.count() > 1:
             raise ValidationError("A game in a private collection cannot be in any other collections.")
 
     @property
     def is_on_loan(self):
-        return self.loans.filter(is_returned=False).exists()
+        return self.current_loan_id is not None
 
     @property
     def current_borrower(self):
-        active_loan = self.loans.filter(is_returned=False).first()
-        return active_loan.borrower if active_loan else None
+        # select_related('current_loan__borrower') avoids the queries
+        return self.current_loan.borrower if self.current_loan_id else None
 
     @property
     def average_rating(self):
-        ratings = self.ratings.all()
-        if ratings:
-            return sum(rating.rating for rating in ratings) / len(ratings)
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
         return 0
 
+    @property
+    def rating_histogram(self):
+        """(stars, count, percent of all ratings) from 5 stars down to 1."""
+        histogram = []
+        for stars in range(5, 0, -1):
+            count = getattr(self, f'rating_{stars}')
+            histogram.append((stars, count, round(100 * count / self.rating_count) if self.rating_count else 0))
+        return histogram
+
     def __str__(self):
         return self.title
 
@@ -102,11 +218,43 @@ class BorrowRequest(models.Model):
     request_date = models.DateTimeField(auto_now_add=True)
     processed_date = models.DateTimeField(null=True, blank=True)
     processed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='processed_requests')
+
+    class Meta:
+        indexes = [
+            # Pending requests, oldest first, for the librarians
+            models.Index(fields=['request_date', 'id'], condition=models.Q(status='pending'),
+                         name='borrow_pending_idx'),
+            # "Does this game / this patron have a pending request", asked for every card
+            models.Index(fields=['game', 'requester'], condition=models.Q(status='pending'),
+                         name='borrow_pending_game_idx'),
+        ]
     
     def __str__(self):
         return f"{self.requester.username}'s request for {self.game.title}"
 
 
+class ArchivedBorrowRequest(models.Model):
+    """An approved or rejected request moved out of BorrowRequest by catalog.archive, keeping its id."""
+    id = models.BigIntegerField(primary_key=True)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='archived_borrow_requests')
+    requester = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_borrow_requests')
+    status = models.CharField(max_length=10, choices=BorrowRequest.STATUS_CHOICES)
+    duration_days = models.IntegerField(choices=BorrowRequest.DURATION_CHOICES)
+    request_date = models.DateTimeField()
+    processed_date = models.DateTimeField(null=True, blank=True)
+    processed_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # A patron's request history, newest first, see catalog.archive.request_history
+            models.Index(fields=['requester', 'request_date'], name='archived_request_requester_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.requester.username}'s request for {self.game.title} (archived)"
+
+
 class Loan(models.Model):
     game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='loans')
     borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='loans')
@@ -114,11 +262,76 @@ class Loan(models.Model):
     due_date = models.DateTimeField()
     return_date = models.DateTimeField(null=True, blank=True)
     is_returned = models.BooleanField(default=False)
+    # Set by catalog.overdue as the due date comes close and passes
+    DUE_SOON = 'due_soon'
+    OVERDUE = 'overdue'
+    DUE_STATE_CHOICES = [
+        (DUE_SOON, 'Due soon'),
+        (OVERDUE, 'Overdue'),
+    ]
+    due_state = models.CharField(max_length=10, choices=DUE_STATE_CHOICES, blank=True, default='', editable=False)
+
+    class Meta:
+        constraints = [
+            # A game can only be lent out once at a time, whatever raced to lend it
+            models.UniqueConstraint(fields=['game'], condition=models.Q(is_returned=False),
+                                    name='loan_one_open_per_game'),
+        ]
+        indexes = [
+            # The overdue scan walks open loans by due date, the loans page filters them by state
+            models.Index(fields=['due_date', 'id'], condition=models.Q(is_returned=False),
+                         name='loan_open_due_date_idx'),
+            models.Index(fields=['due_state', 'due_date'], condition=models.Q(is_returned=False),
+                         name='loan_open_due_state_idx'),
+            # A patron's open loans, see catalog.views.my_loans. Open loans by game
+            # come from the loan_one_open_per_game constraint's index.
+            models.Index(fields=['borrower', 'due_date'], condition=models.Q(is_returned=False),
+                         name='loan_open_borrower_idx'),
+        ]
     
     def __str__(self):
         return f"{self.borrower.username}'s loan of {self.game.title}"
 
 
+class ArchivedLoan(models.Model):
+    """A returned loan moved out of Loan by catalog.archive, keeping its id."""
+    id = models.BigIntegerField(primary_key=True)
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='archived_loans')
+    borrower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_loans')
+    borrow_date = models.DateTimeField()
+    due_date = models.DateTimeField()
+    return_date = models.DateTimeField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # A patron's loan history, newest first, see catalog.archive.loan_history
+            models.Index(fields=['borrower', 'return_date'], name='archived_loan_borrower_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.borrower.username}'s loan of {self.game.title} (archived)"
+
+
+class Hold(models.Model):
+    """A patron waiting for a game that is out, served in ticket order by catalog.holds."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='holds')
+    patron = models.ForeignKey(User, on_delete=models.CASCADE, related_name='holds')
+    ticket = models.PositiveIntegerField()
+    duration_days = models.IntegerField(choices=BorrowRequest.DURATION_CHOICES, default=14)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Also the index the queue is read from, front first
+            models.UniqueConstraint(fields=['game', 'ticket'], name='hold_game_ticket_unique'),
+            models.UniqueConstraint(fields=['game', 'patron'], name='hold_one_per_patron'),
+        ]
+
+    def __str__(self):
+        return f"{self.patron.username}'s hold on {self.game.title}"
+
+
 class Comment(models.Model):
     game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
@@ -128,6 +341,10 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination of a game's comments, newest first
+            models.Index(fields=['game', 'created_at', 'id'], name='comment_game_created_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.user.username} on {self.game.title}'
@@ -154,3 +371,155 @@ class Rating(models.Model):
 
     def __str__(self):
         return f'Rating {self.rating} by {self.user.username} on {self.game.title}'
+
+
+class FacetCount(models.Model):
+    """
+    Number of games per facet value and visibility scope, kept up to date by
+    catalog.facets so the catalog can show counts without a GROUP BY over
+    the game table.
+    """
+    GENRE = 'genre'
+    PLATFORM = 'platform'
+    LOCATION = 'location'
+    DECADE = 'decade'
+
+    FACET_CHOICES = [
+        (GENRE, 'Genre'),
+        (PLATFORM, 'Platform'),
+        (LOCATION, 'Location'),
+        (DECADE, 'Release Decade'),
+    ]
+
+    facet = models.CharField(max_length=10, choices=FACET_CHOICES)
+    value = models.CharField(max_length=100)
+    # 'public', 'unlisted' or 'private:<collection id>', see catalog.facets.visibility_scope
+    scope = models.CharField(max_length=30)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['facet', 'value', 'scope']
+
+    def __str__(self):
+        return f'{self.facet}={self.value} ({self.scope}): {self.count}'
+
+
+class CatalogVersion(models.Model):
+    """
+    One row, bumped whenever a catalog card or facet count could change: a
+    game saved, deleted, imported, lent, requested, rated or moved between
+    collections. The catalog's ETag reads it instead of aggregating every game.
+
+    The bump waits until the change commits and then runs as a statement of
+    its own, so the row is never locked by a transaction doing other work and
+    writers on different games don't queue behind each other on it.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def bump(cls):
+        transaction.on_commit(cls._increment)
+
+    @classmethod
+    def _increment(cls):
+        if not cls.objects.update(version=F('version') + 1):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    @classmethod
+    def current(cls):
+        return cls.objects.values_list('version', flat=True).first()
+
+    def __str__(self):
+        return f'catalog version {self.version}'
+
+
+class UpcSequence(models.Model):
+    """
+    Next unused UPC body (the 11 digits before the check digit). Workers
+    reserve blocks from it through catalog.upc instead of guessing codes.
+    """
+    name = models.CharField(max_length=20, primary_key=True)
+    next_value = models.BigIntegerField()
+
+    def __str__(self):
+        return f'{self.name}: {self.next_value}'
+
+
+class ImportCheckpoint(models.Model):
+    """How far `manage.py import_games` got through a source, saved with each batch."""
+    name = models.CharField(max_length=255, unique=True)
+    position = models.PositiveIntegerField(default=0)  # rows read, valid or not
+    created = models.PositiveIntegerField(default=0)
+    rejected = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: row {self.position}'
+
+
+class OverdueScan(models.Model):
+    """How far `manage.py scan_overdue_loans` has marked loans, so each run only looks at what changed."""
+    name = models.CharField(max_length=255, unique=True)
+    # Loans due up to these times have been marked overdue / due soon
+    overdue_until = models.DateTimeField(null=True, blank=True)
+    due_soon_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: overdue up to {self.overdue_until}'
+
+
+class PatronGame(models.Model):
+    """A patron borrowed or liked a game, counted once by catalog.recommendations."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'game'], name='patron_game_unique'),
+        ]
+
+
+class GamePair(models.Model):
+    """
+    How many patrons have both games, kept both ways round. The pair of a
+    game with itself counts the game's patrons.
+    """
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='+')
+    patrons = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'other'], name='game_pair_unique'),
+        ]
+
+
+class GameNeighbor(models.Model):
+    """One of a game's most similar games, as last worked out by `manage.py refresh_recommendations`."""
+    game = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='neighbors')
+    neighbor = models.ForeignKey(Game, on_delete=models.CASCADE, related_name='neighbor_of')
+    score = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['game', 'neighbor'], name='game_neighbor_unique'),
+        ]
+        indexes = [
+            # A game's neighbors, best first, for the detail page
+            models.Index(fields=['game', '-score'], name='game_neighbor_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.game.title} -> {self.neighbor.title} ({self.score:.2f})'
+
+
+class RecommendationBuild(models.Model):
+    """How far the recommendation counts have read the loan and rating history."""
+    name = models.CharField(max_length=255, unique=True)
+    loans_until = models.BigIntegerField(default=0)  # highest loan id counted
+    ratings_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: loans up to {self.loans_until}'
@@ -0,0 +1,76 @@
+"""
+Marking loans due soon and overdue, behind `manage.py scan_overdue_loans`.
+
+Open loans only change state because the clock moves, so a run just reads
+the stretches of the due date index the clock moved over since the last
+one, remembered in OverdueScan:
+
+    overdue:   overdue_until  < due_date <= now
+    due soon:  due_soon_until < due_date <= now + due_soon
+
+A loan lent after its stretch was read, e.g. a 7 day loan with a 14 day
+due soon window, is still unmarked behind the marks, so those are picked
+up along the (due_state, due_date) index as well.
+
+Each stretch is streamed in chunks with iterator(), marked with one UPDATE
+per chunk and gathered into a digest per borrower. A run holds its
+OverdueScan row locked, so overlapping runs take turns instead of both
+sending the same digest.
+"""
+import itertools
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Loan, OverdueScan
+
+DUE_SOON = timedelta(days=3)
+CHUNK_SIZE = 500
+
+
+def _due_between(since, until):
+    loans = Loan.objects.filter(is_returned=False, due_date__lte=until)
+    if since is not None:
+        loans = loans.filter(due_date__gt=since)
+    return loans.order_by('due_date', 'id')
+
+
+def _missed(until):
+    """Open loans nobody marked although their due date is behind the marks."""
+    if until is None:
+        return Loan.objects.none()
+    return Loan.objects.filter(is_returned=False, due_state='', due_date__lte=until).order_by('due_date', 'id')
+
+
+def scan_loans(name='default', now=None, due_soon=DUE_SOON, chunk_size=CHUNK_SIZE):
+    """
+    Mark the loans that became overdue or due soon since the last run
+    called ``name``. Returns {borrower: {state: [loans]}}.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        # A second run waits here and then only finds what the first one left
+        scan, _ = OverdueScan.objects.select_for_update().get_or_create(name=name)
+        digest = defaultdict(lambda: defaultdict(list))
+        # Each query runs once the ones before it are marked, so nothing is picked twice
+        stretches = [
+            (Loan.OVERDUE, _due_between(scan.overdue_until, now)),
+            (Loan.OVERDUE, _missed(scan.due_soon_until).filter(due_date__lte=now)),
+            (Loan.DUE_SOON, _missed(scan.due_soon_until)),
+            # Loans that went straight to overdue were marked just before
+            (Loan.DUE_SOON, _due_between(scan.due_soon_until, now + due_soon).exclude(due_state=Loan.OVERDUE)),
+        ]
+        for state, loans in stretches:
+            rows = loans.select_related('game', 'borrower').iterator(chunk_size=chunk_size)
+            while chunk := list(itertools.islice(rows, chunk_size)):
+                Loan.objects.filter(pk__in=[loan.pk for loan in chunk]).update(due_state=state)
+                for loan in chunk:
+                    loan.due_state = state
+                    digest[loan.borrower][state].append(loan)
+
+        scan.overdue_until = now
+        scan.due_soon_until = max(now + due_soon, scan.due_soon_until or now)
+        scan.save()
+    return digest
@@ -0,0 +1,109 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of an OFFSET, every page starts right after the last row of the
+previous one, so page 500 costs the same index range scan as page 1 and
+rows inserted while someone scrolls don't shift later pages.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, (date, datetime)) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _ordering_field(queryset, name):
+    annotation = queryset.query.annotations.get(name)
+    if annotation is not None:
+        return annotation.output_field
+    return queryset.model._meta.get_field(name)
+
+
+def cursor_values(queryset, ordering, cursor):
+    """
+    The values ``cursor`` holds for ``ordering`` as the fields' own types, or
+    None if it can't be decoded or doesn't fit, e.g. a string where the id goes.
+    """
+    values = decode_cursor(cursor)
+    if values is None or len(values) != len(ordering):
+        return None
+    try:
+        values = [_ordering_field(queryset, order.lstrip('-')).to_python(value)
+                  for order, value in zip(ordering, values)]
+    except (FieldDoesNotExist, ValidationError, TypeError, ValueError):
+        return None
+    # The ordering columns are never NULL, and a NULL can't be compared
+    return None if None in values else values
+
+
+def _row_value(row, field):
+    return row[field] if isinstance(row, dict) else getattr(row, field)
+
+
+def _after(ordering, values):
+    """
+    Build the condition selecting rows that sort after ``values``, i.e.
+    (a, b) > (x, y) expanded to ``a > x OR (a = x AND b > y)``.
+    """
+    condition = Q()
+    equal = Q()
+    for order, value in zip(ordering, values):
+        field = order.lstrip('-')
+        lookup = 'lt' if order.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{field}__{lookup}': value})
+        equal &= Q(**{field: value})
+    return condition
+
+
+def paginate_keyset(queryset, ordering, cursor=None, page_size=60):
+    """
+    Return one KeysetPage of ``queryset`` sorted by ``ordering``.
+
+    The last field of ``ordering`` must be unique (normally the primary key)
+    so that every row has a distinct position. A cursor that can't be
+    decoded or holds the wrong types just starts from the first page.
+    """
+    queryset = queryset.order_by(*ordering)
+    values = cursor_values(queryset, ordering, cursor)
+    if values is not None:
+        queryset = queryset.filter(_after(ordering, values))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor([_row_value(rows[-1], order.lstrip('-')) for order in ordering])
+    return KeysetPage(rows, next_cursor)
@@ -0,0 +1,74 @@
+"""
+Rating aggregates stored on Game (count, sum and a 1-5 histogram).
+
+They are adjusted with single F() updates whenever a Rating is created,
+changed or deleted, so the average and histogram can be read straight off
+the game row instead of loading every rating.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import CatalogVersion, Game, Rating
+
+STARS = [value for value, label in Rating.RATING_CHOICES]
+
+
+def histogram_field(stars):
+    return f'rating_{stars}'
+
+
+AGGREGATE_FIELDS = ['rating_count', 'rating_sum'] + [histogram_field(stars) for stars in STARS]
+
+
+def rating_deltas(stars, delta):
+    """Column -> delta for adding (delta=1) or removing (delta=-1) one rating."""
+    return Counter({'rating_count': delta, 'rating_sum': stars * delta, histogram_field(stars): delta})
+
+
+def apply_rating_deltas(game_id, deltas):
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if deltas:
+        Game.objects.filter(pk=game_id).update(
+            rating_version=F('rating_version') + 1,
+            **{field: F(field) + delta for field, delta in deltas.items()},
+        )
+        CatalogVersion.bump()
+
+
+def rating_changed(old, new):
+    """
+    Update the aggregates for one rating going from ``old`` to ``new``,
+    each a (game id, stars) pair or None when the rating didn't/doesn't exist.
+    """
+    deltas = {}
+    if old is not None:
+        deltas.setdefault(old[0], Counter()).update(rating_deltas(old[1], -1))
+    if new is not None:
+        deltas.setdefault(new[0], Counter()).update(rating_deltas(new[1], 1))
+    for game_id, game_deltas in deltas.items():
+        apply_rating_deltas(game_id, game_deltas)
+
+
+@transaction.atomic
+def rebuild_rating_aggregates(batch_size=1000):
+    """Recompute every game's aggregates from the rating table, returns the number of games updated."""
+    totals = Rating.objects.values('game_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{histogram_field(stars): Count('id', filter=Q(rating=stars)) for stars in STARS},
+    ).order_by()
+    totals = {row.pop('game_id'): row for row in totals}
+
+    changed = []
+    for game in Game.objects.only(*AGGREGATE_FIELDS).iterator(chunk_size=batch_size):
+        expected = totals.get(game.pk, {})
+        if any(getattr(game, field) != expected.get(field, 0) for field in AGGREGATE_FIELDS):
+            for field in AGGREGATE_FIELDS:
+                setattr(game, field, expected.get(field, 0))
+            changed.append(game)
+    Game.objects.bulk_update(changed, AGGREGATE_FIELDS, batch_size=batch_size)
+    if changed:
+        CatalogVersion.bump()
+    return len(changed)
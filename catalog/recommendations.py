@@ -0,0 +1,217 @@
+"""
+"Patrons who borrowed this also borrowed", behind `manage.py refresh_recommendations`.
+
+A patron counts towards a game once they have borrowed it or rated it
+LIKED or better. Two games are as similar as the cosine of their patron
+sets, patrons(a, b) / sqrt(patrons(a) * patrons(b)), and each game keeps
+its top_k most similar games in GameNeighbor, so a page reads them with
+one query along GameNeighbor's (game, score) index.
+
+The counts are kept between runs instead of rebuilt. A refresh only reads
+the loans and ratings added since the last one (RecommendationBuild). For
+each patron with something new, it adds the pairs of their new games with
+all their games to GamePair. That is a self join of the patrons' games,
+done with NumPy on a chunk of patrons at a time, so a run costs what the
+new history and those patrons' games cost, not the whole history.
+
+Ids and timestamps are handed out before their transaction commits, so a
+loan can become visible after one with a higher id was already counted.
+Each run therefore reads back LOAN_ID_MARGIN ids and RATING_MARGIN of
+time behind its marks; whatever was counted before is dropped against
+PatronGame.
+
+Counts only ever grow. A patron who once borrowed or liked a game keeps
+counting for it when the rating is lowered or deleted, or the loan is
+archived.
+
+Only the games whose counts moved get their neighbors rewritten. A game
+whose partner gained patrons keeps a slightly stale score for it until it
+is touched itself. `--rebuild` recounts everything from the current history.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.db import transaction
+from django.db.models import F, Max, Sum
+
+from .models import ArchivedLoan, Game, GameNeighbor, GamePair, Loan, PatronGame, Rating, RecommendationBuild
+
+LIKED = 4
+TOP_K = 10
+FOR_YOU = 8
+CHUNK_SIZE = 500
+# Pairs of ids are packed into one int64 for the set operations
+ID_BITS = 32
+# How far behind the marks each run reads again, for rows committed late
+LOAN_ID_MARGIN = 10_000
+RATING_MARGIN = timedelta(hours=1)
+
+
+def _chunks(ids, size=CHUNK_SIZE):
+    for start in range(0, len(ids), size):
+        yield [int(pk) for pk in ids[start:start + size]]
+
+
+def _array(rows, width):
+    return np.array(list(rows), dtype=np.int64).reshape(-1, width)
+
+
+def _pack(left, right):
+    return (left << ID_BITS) | right
+
+
+def _unpack(keys):
+    return keys >> ID_BITS, keys & ((1 << ID_BITS) - 1)
+
+
+def _lookup(keys, values, wanted):
+    """``values`` for each of ``wanted`` in the sorted ``keys``, 0 where missing."""
+    if not len(keys):
+        return np.zeros(len(wanted), dtype=np.int64)
+    pos = np.searchsorted(keys, wanted).clip(max=len(keys) - 1)
+    return np.where(keys[pos] == wanted, values[pos], 0)
+
+
+def _new_history(build):
+    """Unique (patron, game) rows added since ``build``, and the marks to move it to."""
+    loans = np.concatenate([
+        _array(
+            model.objects.filter(pk__gt=build.loans_until - LOAN_ID_MARGIN)
+            .values_list('pk', 'borrower_id', 'game_id'), 3,
+        )
+        for model in (Loan, ArchivedLoan)
+    ])
+    ratings_until = Rating.objects.aggregate(until=Max('updated_at'))['until']
+    ratings = Rating.objects.none()
+    if ratings_until is not None:
+        ratings = Rating.objects.filter(rating__gte=LIKED, updated_at__lte=ratings_until)
+        if build.ratings_until is not None:
+            # Anything seen twice is dropped against PatronGame
+            ratings = ratings.filter(updated_at__gte=build.ratings_until - RATING_MARGIN)
+    rows = np.concatenate([loans[:, 1:], _array(ratings.values_list('user_id', 'game_id'), 2)])
+    loans_until = max(int(loans[:, 0].max()) if len(loans) else 0, build.loans_until)
+    # Sorted by patron, then game
+    return np.unique(rows, axis=0), loans_until, ratings_until or build.ratings_until
+
+
+def _shared(users, games, new):
+    """
+    Every ordered pair of games with a patron in common where at least one
+    side is new to them, a new game paired with itself included. Rows must
+    be grouped by user.
+    """
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    sizes = np.diff(np.r_[starts, len(users)])
+    repeats = np.repeat(sizes, sizes)
+    left = np.repeat(np.arange(len(users)), repeats)
+    group_start = np.repeat(np.repeat(starts, sizes), repeats)
+    right = group_start + np.arange(len(left)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    keep = new[left] | new[right]
+    return games[left[keep]], games[right[keep]]
+
+
+def _count_pairs(history):
+    """Record the new (patron, game) rows, returns the GamePair increments as packed keys and counts."""
+    deltas = []
+    for users in _chunks(np.unique(history[:, 0])):
+        lo = np.searchsorted(history[:, 0], users[0], side='left')
+        hi = np.searchsorted(history[:, 0], users[-1], side='right')
+        new = history[lo:hi]
+        known = _array(PatronGame.objects.filter(user_id__in=users).values_list('user_id', 'game_id'), 2)
+        new = new[~np.isin(_pack(new[:, 0], new[:, 1]), _pack(known[:, 0], known[:, 1]))]
+        PatronGame.objects.bulk_create([PatronGame(user_id=user, game_id=game) for user, game in new.tolist()])
+
+        rows = np.concatenate([known, new])
+        is_new = np.r_[np.zeros(len(known), dtype=bool), np.ones(len(new), dtype=bool)]
+        order = np.argsort(rows[:, 0], kind='stable')
+        deltas.append(_pack(*_shared(rows[order, 0], rows[order, 1], is_new[order])))
+    return np.unique(np.concatenate(deltas) if deltas else np.empty(0, dtype=np.int64), return_counts=True)
+
+
+def _add_pairs(keys, counts):
+    """Add the increments to GamePair, returns the games whose counts moved."""
+    games, others = _unpack(keys)
+    touched = np.unique(games)
+    existing = np.concatenate([np.empty((0, 3), dtype=np.int64)] + [
+        _array(GamePair.objects.filter(game_id__in=chunk).values_list('game_id', 'other_id', 'patrons'), 3)
+        for chunk in _chunks(touched)
+    ])
+    existing_keys = _pack(existing[:, 0], existing[:, 1])
+    order = np.argsort(existing_keys)
+    totals = counts + _lookup(existing_keys[order], existing[order, 2], keys)
+    GamePair.objects.bulk_create(
+        [GamePair(game_id=game, other_id=other, patrons=total)
+         for game, other, total in zip(games.tolist(), others.tolist(), totals.tolist())],
+        update_conflicts=True, unique_fields=['game', 'other'], update_fields=['patrons'], batch_size=CHUNK_SIZE,
+    )
+    return touched
+
+
+def _rewrite_neighbors(games, top_k):
+    pairs = np.concatenate([np.empty((0, 3), dtype=np.int64)] + [
+        _array(GamePair.objects.filter(game_id__in=chunk).values_list('game_id', 'other_id', 'patrons'), 3)
+        for chunk in _chunks(games)
+    ])
+    # Each game's own patron count is its pair with itself
+    partners = np.unique(pairs[:, 1])
+    sizes = np.concatenate([np.empty((0, 2), dtype=np.int64)] + [
+        _array(GamePair.objects.filter(game_id__in=chunk, other_id=F('game_id')).values_list('game_id', 'patrons'), 2)
+        for chunk in _chunks(partners)
+    ])
+    order = np.argsort(sizes[:, 0])
+    size_ids, size_counts = sizes[order, 0], sizes[order, 1]
+
+    pairs = pairs[pairs[:, 0] != pairs[:, 1]]
+    score = pairs[:, 2] / np.sqrt(
+        _lookup(size_ids, size_counts, pairs[:, 0]) * _lookup(size_ids, size_counts, pairs[:, 1])
+    )
+    # Best first within each game, then keep the first top_k of each
+    order = np.lexsort((pairs[:, 1], -score, pairs[:, 0]))
+    pairs, score = pairs[order], score[order]
+    starts = np.flatnonzero(np.r_[True, pairs[1:, 0] != pairs[:-1, 0]]) if len(pairs) else np.empty(0, dtype=np.int64)
+    rank = np.arange(len(pairs)) - np.repeat(starts, np.diff(np.r_[starts, len(pairs)]))
+    keep = rank < top_k
+
+    for chunk in _chunks(games):
+        GameNeighbor.objects.filter(game_id__in=chunk).delete()
+        # The detail page's ETag is keyed on it
+        Game.objects.filter(pk__in=chunk).update(circulation_version=F('circulation_version') + 1)
+    GameNeighbor.objects.bulk_create(
+        [GameNeighbor(game_id=game, neighbor_id=neighbor, score=value)
+         for game, neighbor, value in zip(pairs[keep, 0].tolist(), pairs[keep, 1].tolist(), score[keep].tolist())],
+        batch_size=CHUNK_SIZE,
+    )
+
+
+def refresh(top_k=TOP_K, rebuild=False):
+    """
+    Count the history added since the last run and rewrite the neighbors
+    of the games it touched. Returns how many games were rewritten.
+    """
+    with transaction.atomic():
+        if rebuild:
+            for model in (GameNeighbor, GamePair, PatronGame, RecommendationBuild):
+                model.objects.all().delete()
+        build, _ = RecommendationBuild.objects.select_for_update().get_or_create(name='default')
+        history, build.loans_until, build.ratings_until = _new_history(build)
+        games = _add_pairs(*_count_pairs(history))
+        _rewrite_neighbors(games, top_k)
+        build.save()
+    return len(games)
+
+
+def neighbors(game, user, limit=TOP_K):
+    """``game``'s most similar games that ``user`` may see, best first."""
+    return (
+        GameNeighbor.objects.filter(game=game, neighbor__in=Game.objects.visible_to(user))
+        .select_related('neighbor').order_by('-score')[:limit]
+    )
+
+
+def for_you(user, limit=FOR_YOU):
+    """The games closest to everything ``user`` borrowed or liked, leaving out those."""
+    had = PatronGame.objects.filter(user=user).values('game_id')
+    return (
+        Game.objects.visible_to(user).filter(neighbor_of__game__in=had).exclude(pk__in=had)
+        .annotate(affinity=Sum('neighbor_of__score')).order_by('-affinity', 'pk')[:limit]
+    )
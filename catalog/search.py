@@ -0,0 +1,152 @@
+"""
+Full-text search for the game catalog.
+
+The backend is picked from the database the queryset runs against:
+
+* SQLite keeps an FTS5 table (catalog_game_fts) that mirrors the searchable
+  columns of catalog_game through triggers.
+* Postgres keeps a generated tsvector column (catalog_game.search_vector)
+  with a GIN index on it.
+
+Either way the index lives in the database and is updated in the same
+statement as the row, so saves, deletes and bulk inserts all stay in sync.
+Any other backend falls back to the old icontains filters.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Game
+
+SEARCH_FIELDS = ['title', 'description', 'genre', 'platform', 'location']
+
+GAME_TABLE = Game._meta.db_table
+FTS_TABLE = f'{GAME_TABLE}_fts'
+
+# Column weights used for ranking, in SEARCH_FIELDS order
+FTS_WEIGHTS = '10.0, 1.0, 4.0, 4.0, 2.0'
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query.lower())
+
+
+def search_games(queryset, query):
+    """
+    Filter a Game queryset down to the games matching ``query``.
+
+    The result is annotated with ``search_rank`` (higher is more relevant)
+    and ordered by it. Every search term has to match, and the last one is
+    treated as a prefix so partially typed words still find results.
+    """
+    tokens = tokenize(query)
+    vendor = connections[queryset.db].vendor
+    if not tokens or vendor not in ('sqlite', 'postgresql'):
+        return _icontains_search(queryset, query)
+
+    if vendor == 'sqlite':
+        # Quote every token so FTS5 never sees user input as query syntax
+        match = ' '.join(f'"{token}"' for token in tokens) + '*'
+        queryset = queryset.extra(
+            tables=[FTS_TABLE],
+            where=[f'{FTS_TABLE}.rowid = {GAME_TABLE}.id', f'{FTS_TABLE} MATCH %s'],
+            params=[match],
+        ).annotate(
+            # bm25() is lower for better matches, flip it so both backends agree
+            search_rank=RawSQL(f'-bm25({FTS_TABLE}, {FTS_WEIGHTS})', (), output_field=FloatField())
+        )
+    else:
+        tsquery = ' & '.join(tokens[:-1] + [f'{tokens[-1]}:*'])
+        queryset = queryset.extra(
+            where=[f"{GAME_TABLE}.search_vector @@ to_tsquery('english', %s)"],
+            params=[tsquery],
+        ).annotate(
+            search_rank=RawSQL(
+                f"ts_rank({GAME_TABLE}.search_vector, to_tsquery('english', %s))",
+                (tsquery,),
+                output_field=FloatField(),
+            )
+        )
+    return queryset.order_by('-search_rank', 'id')
+
+
+def _icontains_search(queryset, query):
+    condition = Q()
+    for field in SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__icontains': query})
+    return queryset.filter(condition)
+
+
+def install_search_index(connection, rebuild=False):
+    """
+    Create the search index for ``connection`` if it is missing.
+
+    Safe to call repeatedly. On SQLite the triggers are attached to the
+    catalog_game table itself, so they are dropped whenever a migration has to
+    rebuild that table; the catalog app re-runs this after every migrate.
+    """
+    columns = ', '.join(SEARCH_FIELDS)
+    new_columns = ', '.join(f'new.{field}' for field in SEARCH_FIELDS)
+    old_columns = ', '.join(f'old.{field}' for field in SEARCH_FIELDS)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE]
+            )
+            rebuild = rebuild or cursor.fetchone() is None
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"{columns}, content='{GAME_TABLE}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {GAME_TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_columns}); "
+                f"END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {GAME_TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                f"VALUES ('delete', old.id, {old_columns}); "
+                f"END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} ON {GAME_TABLE} BEGIN "
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                f"VALUES ('delete', old.id, {old_columns}); "
+                f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new_columns}); "
+                f"END"
+            )
+            if rebuild:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        elif connection.vendor == 'postgresql':
+            # Title weighs most, then genre/platform, location and finally the description
+            cursor.execute(
+                f"ALTER TABLE {GAME_TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                f"GENERATED ALWAYS AS ("
+                f"setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+                f"setweight(to_tsvector('english', coalesce(genre, '') || ' ' || coalesce(platform, '')), 'B') || "
+                f"setweight(to_tsvector('english', coalesce(location, '')), 'C') || "
+                f"setweight(to_tsvector('english', coalesce(description, '')), 'D')"
+                f") STORED"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {GAME_TABLE}_search_vector_idx "
+                f"ON {GAME_TABLE} USING GIN (search_vector)"
+            )
+
+
+def uninstall_search_index(connection):
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}')
+            cursor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+        elif connection.vendor == 'postgresql':
+            cursor.execute(f'DROP INDEX IF EXISTS {GAME_TABLE}_search_vector_idx')
+            cursor.execute(f'ALTER TABLE {GAME_TABLE} DROP COLUMN IF EXISTS search_vector')
@@ -0,0 +1,161 @@
+from collections import Counter
+
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from .models import BorrowRequest, CatalogVersion, Comment, Game, Loan, Rating
+from . import facets, images, ratings, typeahead
+
+# Sent by collection.visibility after Game.visibility/private_collection were
+# updated in bulk. ``changes`` maps game id -> ((old visibility, old private
+# collection id), (new visibility, new private collection id)).
+game_visibility_changed = Signal()
+
+
+def _stored_facet_row(game):
+    return Game.objects.filter(pk=game.pk).values(*facets.GAME_FACET_FIELDS).first()
+
+
+@receiver(pre_save, sender=Game)
+def remember_facets_before_save(sender, instance, raw=False, **kwargs):
+    instance._stored_facet_row = None if raw or instance._state.adding else _stored_facet_row(instance)
+
+
+@receiver(post_save, sender=Game)
+def update_facets_after_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_row = getattr(instance, '_stored_facet_row', None)
+    # Game.save() never writes the visibility columns, so they are the stored ones
+    new_row = {field: getattr(instance, field) for field in facets.GAME_FACET_FIELDS}
+    if old_row is not None:
+        new_row['visibility'] = old_row['visibility']
+        new_row['private_collection_id'] = old_row['private_collection_id']
+
+    deltas = facets.game_deltas(new_row, 1)
+    if old_row is not None:
+        deltas.update(facets.game_deltas(old_row, -1))
+    facets.apply_deltas(deltas)
+
+
+@receiver(pre_delete, sender=Game)
+def remember_facets_before_delete(sender, instance, **kwargs):
+    instance._stored_facet_row = _stored_facet_row(instance)
+
+
+@receiver(post_delete, sender=Game)
+def update_facets_after_delete(sender, instance, **kwargs):
+    if getattr(instance, '_stored_facet_row', None) is not None:
+        facets.apply_deltas(facets.game_deltas(instance._stored_facet_row, -1))
+
+
+@receiver(game_visibility_changed)
+def move_facets_between_scopes(sender, changes, **kwargs):
+    rows = Game.objects.filter(id__in=changes).values('id', *facets.GAME_FACET_FIELDS)
+    deltas = Counter()
+    for row in rows:
+        old_state, new_state = changes[row['id']]
+        deltas.update(facets.game_deltas(row, -1, scope=facets.visibility_scope(*old_state)))
+        deltas.update(facets.game_deltas(row, 1, scope=facets.visibility_scope(*new_state)))
+    facets.apply_deltas(deltas)
+
+
+@receiver(post_save, sender=Game)
+def update_typeahead_after_save(sender, instance, raw=False, **kwargs):
+    if raw or typeahead.index.built_at is None:
+        return
+    row = Game.objects.filter(pk=instance.pk).values(*typeahead.INDEX_FIELDS).first()
+    if row is not None:
+        typeahead.index.add(row)
+
+
+@receiver(post_delete, sender=Game)
+def update_typeahead_after_delete(sender, instance, **kwargs):
+    typeahead.index.remove(instance.pk)
+
+
+@receiver(game_visibility_changed)
+def update_typeahead_visibility(sender, changes, **kwargs):
+    for game_id, (old_state, (visibility, private_collection_id)) in changes.items():
+        typeahead.index.set_visibility(game_id, visibility, private_collection_id)
+
+
+@receiver(post_save, sender=Game)
+def derive_cover_images(sender, instance, raw=False, **kwargs):
+    if not raw:
+        images.schedule_derivatives(instance, 'image', 'image_derived_from')
+
+
+def _stored_rating(rating):
+    return Rating.objects.filter(pk=rating.pk).values_list('game_id', 'rating').first()
+
+
+def _deleting_rated_game(rating, origin):
+    # The game row is about to go too, no point keeping its aggregates right
+    return isinstance(origin, Game) and origin.pk == rating.game_id
+
+
+@receiver(pre_save, sender=Rating)
+def remember_rating_before_save(sender, instance, raw=False, **kwargs):
+    instance._stored_rating = None if raw or instance._state.adding else _stored_rating(instance)
+
+
+@receiver(post_save, sender=Rating)
+def update_rating_aggregates_after_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    ratings.rating_changed(getattr(instance, '_stored_rating', None), (instance.game_id, instance.rating))
+
+
+@receiver(pre_delete, sender=Rating)
+def remember_rating_before_delete(sender, instance, origin=None, **kwargs):
+    instance._stored_rating = None if _deleting_rated_game(instance, origin) else _stored_rating(instance)
+
+
+@receiver(post_delete, sender=Rating)
+def update_rating_aggregates_after_delete(sender, instance, **kwargs):
+    if getattr(instance, '_stored_rating', None) is not None:
+        ratings.rating_changed(instance._stored_rating, None)
+
+
+@receiver(post_save, sender=Comment)
+def bump_comment_version_after_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Game.objects.filter(pk=instance.game_id).update(comment_version=F('comment_version') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def bump_comment_version_after_delete(sender, instance, origin=None, **kwargs):
+    if not (isinstance(origin, Game) and origin.pk == instance.game_id):
+        Game.objects.filter(pk=instance.game_id).update(comment_version=F('comment_version') + 1)
+
+
+@receiver(post_save, sender=Loan)
+@receiver(post_save, sender=BorrowRequest)
+def bump_circulation_version_after_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        Game.objects.filter(pk=instance.game_id).update(circulation_version=F('circulation_version') + 1)
+        CatalogVersion.bump()
+
+
+@receiver(post_delete, sender=Loan)
+@receiver(post_delete, sender=BorrowRequest)
+def bump_circulation_version_after_delete(sender, instance, origin=None, **kwargs):
+    # Returned loans and processed requests show nowhere but in history, and
+    # catalog.archive deletes them by the thousand
+    if isinstance(instance, Loan) and instance.is_returned:
+        return
+    if isinstance(instance, BorrowRequest) and instance.status != BorrowRequest.PENDING:
+        return
+    if not (isinstance(origin, Game) and origin.pk == instance.game_id):
+        Game.objects.filter(pk=instance.game_id).update(circulation_version=F('circulation_version') + 1)
+        CatalogVersion.bump()
+
+
+@receiver(post_save, sender=Game)
+@receiver(post_delete, sender=Game)
+@receiver(game_visibility_changed)
+@receiver(images.derivatives_ready, sender=Game)
+def bump_catalog_version(sender, raw=False, **kwargs):
+    if not raw:
+        CatalogVersion.bump()
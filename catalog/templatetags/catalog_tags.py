@@ -1,12 +1,66 @@
 from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from catalog.images import FORMATS, WIDTHS, derivative_name
 from catalog.models import BorrowRequest, Loan
 
 register = template.Library()
 
+# Both filters use the GameQuerySet.with_card_state annotations when the game
+# has them and only fall back to a query for plain instances
+
 @register.filter
 def is_borrowed_by(game, user):
-    return game.is_on_loan and game.current_borrower == user
+    if not game.is_on_loan:
+        return False
+    if hasattr(game, 'current_borrower_username'):
+        return game.current_borrower_username == user.username
+    return Loan.objects.filter(pk=game.current_loan_id, borrower_id=user.id).exists()
 
 @register.filter
 def has_pending_borrow_request(game):
+    if hasattr(game, 'has_pending_borrow_request'):
+        return game.has_pending_borrow_request
     return BorrowRequest.objects.filter(game=game, status='pending').exists()
+
+# How wide each kind of image shows up, for the browser to pick from srcset
+IMAGE_SIZES = {
+    'thumb': '160px',
+    'card': '(min-width: 768px) 33vw, 100vw',
+    'detail': '(min-width: 768px) 50vw, 100vw',
+}
+
+@register.simple_tag
+def responsive_image(image, derived_from='', size='card', alt='', css_class='', style=''):
+    """
+    Lazy loaded <img> for a stored image (file field or name), wrapped in a
+    <picture> with WebP/JPEG srcsets once catalog.images has resized it.
+
+        {% responsive_image game.image game.image_derived_from 'card' alt=game.title css_class='card-img-top' %}
+    """
+    name = getattr(image, 'name', image) or ''
+    if not name:
+        return ''
+    attributes = format_html(
+        'alt="{}" class="{}" style="{}" loading="lazy" decoding="async"', alt, css_class, style
+    )
+    if name != derived_from:
+        return format_html('<img src="{}" {}>', default_storage.url(name), attributes)
+
+    def srcset(extension):
+        return ', '.join(
+            f'{default_storage.url(derivative_name(name, width, extension))} {width}w'
+            for width in sorted(set(WIDTHS.values()))
+        )
+
+    sizes = IMAGE_SIZES[size]
+    sources = format_html_join(
+        '', '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((image_format.lower(), srcset(extension), sizes)
+         for extension, image_format, _ in FORMATS if extension != 'jpg'),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" {}></picture>',
+        sources, default_storage.url(derivative_name(name, WIDTHS[size], 'jpg')), srcset('jpg'), sizes, attributes,
+    )
@@ -1,9 +1,19 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth.models import User
 from datetime import date
 from .models import Game
 from .forms import GameForm
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from django.utils import timezone
+from unittest.mock import patch
+import io
+import itertools
+import os
+import random
+import time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 class GameFormTest(TestCase):
     def setUp(self):
@@ -47,3 +57,1389 @@ class GameFormTest(TestCase):
         form = GameForm(data=invalid_data, files=self.game_files)
         self.assertFalse(form.is_valid())
         self.assertIn('release_date', form.errors)
+
+
+class GameSearchTest(TestCase):
+    def setUp(self):
+        self.zelda = Game.objects.create(
+            title='The Legend of Zelda',
+            description='Explore Hyrule',
+            release_date=date(1986, 2, 21),
+            genre='Adventure',
+            platform='NES',
+        )
+        self.halo = Game.objects.create(
+            title='Halo Infinite',
+            description='Master Chief returns, no zelda in sight',
+            release_date=date(2021, 12, 8),
+            genre='Shooter',
+            platform='Xbox',
+        )
+
+    def search(self, query):
+        from .search import search_games
+        return list(search_games(Game.objects.all(), query))
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('zelda'), [self.zelda, self.halo])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search('master chief'), [self.halo])
+        self.assertEqual(self.search('zelda shooter'), [self.halo])
+
+    def test_last_term_is_a_prefix(self):
+        self.assertEqual(self.search('hyr'), [self.zelda])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.zelda.title = 'Breath of the Wild'
+        self.zelda.save()
+        self.assertEqual(self.search('breath'), [self.zelda])
+        self.assertEqual(self.search('legend'), [])
+
+        self.halo.delete()
+        self.assertEqual(self.search('chief'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('"zelda" (*'), [self.zelda, self.halo])
+        self.assertEqual(self.search('halo NOT zelda'), [])
+
+
+class CatalogPaginationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='patron', password='testpass123')
+        self.client.force_login(self.user)
+        self.games = [
+            Game.objects.create(
+                title=f'Game {i}',
+                description='A long description that the listing should not load',
+                release_date=date(2000 + i, 1, 1),
+                genre='Action',
+                platform='PC',
+            )
+            for i in range(5)
+        ]
+
+    def fetch_all(self, params):
+        titles = []
+        cursor = None
+        with patch('catalog.views.CATALOG_PAGE_SIZE', 2):
+            while True:
+                query = dict(params, **({'cursor': cursor} if cursor else {}))
+                response = self.client.get(reverse('catalog:index'), query)
+                page = response.context['games']
+                titles += [game['title'] for game in page]
+                if not page.has_next:
+                    return titles
+                cursor = page.next_cursor
+
+    def test_pages_cover_catalog_newest_first(self):
+        self.assertEqual(self.fetch_all({}), [f'Game {i}' for i in reversed(range(5))])
+
+    def test_pages_cover_catalog_by_title(self):
+        self.assertEqual(self.fetch_all({'sort': 'title'}), [f'Game {i}' for i in range(5)])
+
+    def test_cards_skip_description(self):
+        response = self.client.get(reverse('catalog:index'))
+        self.assertNotIn('description', response.context['games'].object_list[0])
+        self.assertNotContains(response, 'A long description')
+
+    def test_bad_cursor_starts_over(self):
+        response = self.client.get(reverse('catalog:index'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(len(response.context['games']), 5)
+
+    def test_mistyped_cursor_starts_over(self):
+        from .pagination import encode_cursor
+        for values in (['soon', 'x'], [None, 1], [[1], {'a': 1}]):
+            response = self.client.get(reverse('catalog:index'), {'cursor': encode_cursor(values)})
+            self.assertEqual(len(response.context['games']), 5)
+        response = self.client.get(reverse('catalog:game_detail', args=[self.games[0].upc]),
+                                   {'comments': encode_cursor(['yesterday', 'x'])})
+        self.assertEqual(response.status_code, 200)
+
+    def test_load_more_renders_only_cards(self):
+        with patch('catalog.views.CATALOG_PAGE_SIZE', 2):
+            response = self.client.get(reverse('catalog:index'), HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        self.assertTemplateUsed(response, 'catalog/game_cards.html')
+        self.assertTemplateNotUsed(response, 'index.html')
+        self.assertContains(response, 'Load more games')
+
+    def test_search_results_page_by_relevance(self):
+        titles = self.fetch_all({'search': 'game'})
+        self.assertEqual(sorted(titles), [f'Game {i}' for i in range(5)])
+
+
+class FacetCountTest(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='testpass123')
+        self.librarian.userprofile.role = 'Librarian'
+        self.librarian.userprofile.save()
+        self.patron = User.objects.create_user(username='patron', password='testpass123')
+        self.rpg = Game.objects.create(
+            title='Chrono Trigger', description='Time travel', release_date=date(1995, 3, 11),
+            genre='RPG', platform='SNES', location='Shelf A',
+        )
+        self.shooter = Game.objects.create(
+            title='Halo', description='Ring world', release_date=date(2001, 11, 15),
+            genre='Shooter', platform='Xbox',
+        )
+
+    def counts(self, user, facet):
+        from .facets import facet_counts
+        return dict(facet_counts(user)[facet])
+
+    def stored_counts(self):
+        from .models import FacetCount
+        return {
+            (row.facet, row.value, row.scope): row.count
+            for row in FacetCount.objects.filter(count__gt=0)
+        }
+
+    def test_counts_follow_saves_and_deletes(self):
+        self.assertEqual(self.counts(self.patron, 'genre'), {'RPG': 1, 'Shooter': 1})
+        self.assertEqual(self.counts(self.patron, 'decade'), {'1990s': 1, '2000s': 1})
+        self.assertEqual(self.counts(self.patron, 'location'), {'Shelf A': 1})
+
+        self.shooter.genre = 'RPG'
+        self.shooter.save()
+        self.assertEqual(self.counts(self.patron, 'genre'), {'RPG': 2})
+
+        self.rpg.delete()
+        self.assertEqual(self.counts(self.patron, 'genre'), {'RPG': 1})
+        self.assertEqual(self.counts(self.patron, 'decade'), {'2000s': 1})
+
+    def test_counts_follow_visibility(self):
+        from django.contrib.auth.models import AnonymousUser
+        from collection.models import Collection
+
+        private = Collection.objects.create(
+            name='Private', description='', creator=self.librarian, is_private=True
+        )
+        private.games.add(self.rpg)
+        self.assertEqual(self.counts(self.patron, 'genre'), {'Shooter': 1})
+        self.assertEqual(self.counts(self.librarian, 'genre'), {'RPG': 1, 'Shooter': 1})
+        self.assertEqual(self.counts(AnonymousUser(), 'genre'), {})
+
+        private.is_private = False
+        private.save()
+        self.assertEqual(self.counts(AnonymousUser(), 'genre'), {'RPG': 1})
+
+    def test_rebuild_matches_incremental_counts(self):
+        from collection.models import Collection
+        from .facets import rebuild_facet_counts
+
+        collection = Collection.objects.create(name='Public', description='', creator=self.librarian)
+        collection.games.add(self.shooter)
+        self.rpg.platform = 'PC'
+        self.rpg.save()
+
+        incremental = self.stored_counts()
+        rebuild_facet_counts()
+        self.assertEqual(self.stored_counts(), incremental)
+
+    def test_catalog_filters_by_facet(self):
+        self.client.force_login(self.patron)
+        response = self.client.get(reverse('catalog:index'), {'genre': 'RPG'})
+        self.assertEqual([game['title'] for game in response.context['games']], ['Chrono Trigger'])
+
+        response = self.client.get(reverse('catalog:index'), {'decade': '2000s', 'search': 'ring'})
+        self.assertEqual([game['title'] for game in response.context['games']], ['Halo'])
+        self.assertContains(response, 'Shooter')
+
+
+class TypeaheadTest(TestCase):
+    def setUp(self):
+        from . import typeahead
+        typeahead.index.clear()
+        self.addCleanup(typeahead.index.clear)
+        self.patron = User.objects.create_user(username='patron', password='testpass123')
+        self.client.force_login(self.patron)
+        for title, genre in [('The Legend of Zelda', 'Adventure'), ('Zelda II', 'Action'),
+                             ('Halo Infinite', 'Shooter'), ('Super Mario Bros', 'Platformer')]:
+            Game.objects.create(title=title, description='', release_date=date(2000, 1, 1),
+                                genre=genre, platform='NES')
+
+    def suggest(self, query):
+        response = self.client.get(reverse('catalog:typeahead'), {'q': query})
+        return [result['title'] for result in response.json()['results']]
+
+    def test_title_prefix_then_word_prefix(self):
+        self.assertEqual(self.suggest('zel'), ['Zelda II', 'The Legend of Zelda'])
+        self.assertEqual(self.suggest('legend of z'), ['The Legend of Zelda'])
+        self.assertEqual(self.suggest('shoot'), ['Halo Infinite'])
+        self.assertEqual(self.suggest('xyz'), [])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.suggest('zel')
+        zelda = Game.objects.get(title='Zelda II')
+        zelda.title = 'Adventure of Link'
+        zelda.save()
+        Game.objects.get(title='Halo Infinite').delete()
+
+        self.assertEqual(self.suggest('zel'), ['The Legend of Zelda'])
+        self.assertEqual(self.suggest('link'), ['Adventure of Link'])
+        self.assertEqual(self.suggest('halo'), [])
+
+    def test_hidden_games_are_not_suggested(self):
+        from collection.models import Collection
+        self.suggest('zel')
+        private = Collection.objects.create(name='Private', description='', creator=self.patron, is_private=True)
+        private.games.add(Game.objects.get(title='Zelda II'))
+        self.assertEqual(self.suggest('zel'), ['The Legend of Zelda'])
+
+        self.client.logout()
+        self.assertEqual(self.suggest('zel'), [])
+
+    def test_only_one_thread_refreshes(self):
+        from unittest import mock
+        from . import typeahead
+        self.suggest('zel')
+        typeahead.index.built_at -= typeahead.REBUILD_SECONDS + 1
+        # Another thread is in the middle of a rebuild: this request keeps the index it has
+        with typeahead.index.refresh_lock, mock.patch.object(typeahead.index, 'rebuild') as rebuild:
+            self.assertEqual(self.suggest('zel'), ['Zelda II', 'The Legend of Zelda'])
+        rebuild.assert_not_called()
+
+        self.suggest('zel')
+        self.assertIsNone(typeahead.index.needs_refresh())
+
+
+class FuzzySearchTest(TestCase):
+    def setUp(self):
+        from . import typeahead
+        typeahead.index.clear()
+        self.addCleanup(typeahead.index.clear)
+        self.patron = User.objects.create_user(username='patron', password='testpass123')
+        self.client.force_login(self.patron)
+        for title in ['The Legend of Zelda', 'Halo Infinite', 'Super Mario Bros']:
+            Game.objects.create(title=title, description='', release_date=date(2000, 1, 1),
+                                genre='Action', platform='PC')
+
+    def search(self, query):
+        from .fuzzy import fuzzy_search
+        return [game.title for game in fuzzy_search(Game.objects.all(), query)]
+
+    def test_misspellings_find_titles(self):
+        self.assertEqual(self.search('Zeldda'), ['The Legend of Zelda'])
+        self.assertEqual(self.search('Halo Infinte'), ['Halo Infinite'])
+        self.assertEqual(self.search('Tetris'), [])
+
+    def test_catalog_falls_back_to_similar_titles(self):
+        response = self.client.get(reverse('catalog:index'), {'search': 'Halo Infinte'})
+        self.assertTrue(response.context['fuzzy_matches'])
+        self.assertEqual([game['title'] for game in response.context['games']], ['Halo Infinite'])
+        self.assertContains(response, 'Showing similar titles')
+
+
+class RatingAggregateTest(TestCase):
+    def setUp(self):
+        self.game = Game.objects.create(
+            title='Chrono Trigger', description='Time travel', release_date=date(1995, 3, 11),
+            genre='RPG', platform='SNES',
+        )
+        self.alice = User.objects.create_user(username='alice', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', password='testpass123')
+
+    def test_aggregates_follow_create_update_and_delete(self):
+        from .models import Rating
+        Rating.objects.create(game=self.game, user=self.alice, rating=5)
+        bobs = Rating.objects.create(game=self.game, user=self.bob, rating=2)
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.rating_count, 2)
+        self.assertEqual(self.game.average_rating, 3.5)
+
+        Rating.objects.update_or_create(game=self.game, user=self.bob, defaults={'rating': 4})
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.rating_sum, self.game.rating_2, self.game.rating_4), (9, 0, 1))
+
+        bobs.delete()
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.rating_count, 1)
+        self.assertEqual(self.game.rating_histogram[0], (5, 1, 100))
+
+    def test_saving_a_stale_game_keeps_the_aggregates(self):
+        from .models import Rating
+        stale = Game.objects.get(pk=self.game.pk)
+        Rating.objects.create(game=self.game, user=self.alice, rating=3)
+        stale.title = 'Chrono Trigger DS'
+        stale.save()
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.rating_count, 1)
+
+    def test_rating_from_game_detail(self):
+        self.client.force_login(self.alice)
+        self.client.post(reverse('catalog:game_detail', args=[self.game.upc]), {'rating': 4})
+        self.client.post(reverse('catalog:game_detail', args=[self.game.upc]), {'rating': 2})
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.rating_count, self.game.rating_sum), (1, 2))
+
+    def test_rebuild_fixes_drifted_aggregates(self):
+        from .models import Rating
+        from .ratings import rebuild_rating_aggregates
+        Rating.objects.create(game=self.game, user=self.alice, rating=5)
+        Game.objects.filter(pk=self.game.pk).update(rating_count=7, rating_sum=1)
+        self.assertEqual(rebuild_rating_aggregates(), 1)
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.rating_count, self.game.rating_sum, self.game.rating_5), (1, 5, 1))
+
+    def test_deleting_the_game_deletes_its_ratings(self):
+        from .models import Rating
+        Rating.objects.create(game=self.game, user=self.alice, rating=5)
+        self.game.delete()
+        self.assertFalse(Rating.objects.exists())
+
+
+class CurrentLoanTest(TestCase):
+    def setUp(self):
+        from .models import BorrowRequest
+        self.librarian = User.objects.create_user(username='librarian', password='testpass123')
+        self.librarian.userprofile.role = 'Librarian'
+        self.librarian.userprofile.save()
+        self.patron = User.objects.create_user(username='patron', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.game = Game.objects.create(
+            title='Chrono Trigger', description='Time travel', release_date=date(1995, 3, 11),
+            genre='RPG', platform='SNES',
+        )
+        self.first = BorrowRequest.objects.create(game=self.game, requester=self.patron)
+        self.second = BorrowRequest.objects.create(game=self.game, requester=self.other)
+        self.client.force_login(self.librarian)
+
+    def test_approving_and_returning_moves_the_pointer(self):
+        self.client.post(reverse('catalog:approve_borrow_request', args=[self.first.id]))
+        self.game.refresh_from_db()
+        self.assertTrue(self.game.is_on_loan)
+        self.assertEqual(self.game.current_borrower, self.patron)
+
+        self.client.post(reverse('catalog:return_game', args=[self.game.upc]))
+        self.game.refresh_from_db()
+        self.assertFalse(self.game.is_on_loan)
+        self.assertTrue(self.game.loans.get().is_returned)
+
+    def test_second_approval_is_refused(self):
+        from .models import Loan
+        self.client.post(reverse('libpanel:approve_borrow_request', args=[self.first.id]))
+        self.client.post(reverse('libpanel:approve_borrow_request', args=[self.second.id]))
+        self.second.refresh_from_db()
+        self.assertEqual(self.second.status, 'pending')
+        self.assertEqual(Loan.objects.get().borrower, self.patron)
+
+    def test_saving_a_stale_game_keeps_the_loan(self):
+        from .loans import start_loan
+        stale = Game.objects.get(pk=self.game.pk)
+        start_loan(self.game, self.patron, 14)
+        stale.title = 'Chrono Trigger DS'
+        stale.save()
+        self.game.refresh_from_db()
+        self.assertTrue(self.game.is_on_loan)
+
+    def test_catalog_cards_read_availability_from_the_game_row(self):
+        from .loans import start_loan
+        from .views import game_cards
+        start_loan(self.game, self.patron, 14)
+        with self.assertNumQueries(1):
+            card, = game_cards(Game.objects.all(), self.librarian)
+        self.assertTrue(card['on_loan'])
+        self.assertEqual(card['current_borrower_username'], 'patron')
+
+
+class ConcurrentApprovalTest(TransactionTestCase):
+    GAMES = 4
+    REQUESTS_PER_GAME = 6
+
+    def approve_all(self, requests):
+        from threading import Barrier, Thread
+        from django.db import OperationalError
+        from .loans import GameUnavailable, RequestAlreadyProcessed, approve_borrow_request
+        outcomes = []
+        barrier = Barrier(len(requests))
+
+        def librarian(borrow_request):
+            barrier.wait()
+            try:
+                for attempt in itertools.count():
+                    try:
+                        approve_borrow_request(borrow_request, self.librarian)
+                        outcomes.append('approved')
+                        return
+                    except OperationalError:
+                        # SQLite only has one writer and says so instead of
+                        # waiting like a row lock would, so back off and retry
+                        time.sleep(random.uniform(0, min(0.2, 0.002 * 2 ** attempt)))
+                    except (GameUnavailable, RequestAlreadyProcessed) as error:
+                        outcomes.append(type(error).__name__)
+                        return
+            finally:
+                connection.close()
+
+        threads = [Thread(target=librarian, args=(borrow_request,)) for borrow_request in requests]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_one_loan_per_game_under_concurrent_approvals(self):
+        from collections import Counter
+        from .models import BorrowRequest, Loan
+        self.librarian = User.objects.create(username='librarian')
+        requests = []
+        for g in range(self.GAMES):
+            game = Game.objects.create(title=f'Game {g}', description='', release_date=date(2000, 1, 1),
+                                       genre='RPG', platform='SNES')
+            for r in range(self.REQUESTS_PER_GAME):
+                patron = User.objects.create(username=f'patron{g}-{r}')
+                requests.append(BorrowRequest.objects.create(game=game, requester=patron))
+        # The same request approved twice as well
+        requests.append(BorrowRequest.objects.get(pk=requests[0].pk))
+
+        outcomes = Counter(self.approve_all(requests))
+
+        self.assertEqual(outcomes['approved'], self.GAMES)
+        self.assertEqual(sum(outcomes.values()), len(requests))
+        self.assertEqual(Loan.objects.count(), self.GAMES)
+        self.assertEqual(BorrowRequest.objects.filter(status='approved').count(), self.GAMES)
+        for game in Game.objects.select_related('current_loan'):
+            self.assertEqual(game.current_loan.borrower, BorrowRequest.objects.get(game=game, status='approved').requester)
+
+    def test_constraint_refuses_a_second_open_loan(self):
+        from django.db import IntegrityError
+        from .models import Loan
+        patron = User.objects.create_user(username='patron', password='testpass123')
+        game = Game.objects.create(title='Chrono Trigger', description='', release_date=date(1995, 3, 11),
+                                   genre='RPG', platform='SNES')
+        now = timezone.now()
+        Loan.objects.create(game=game, borrower=patron, borrow_date=now, due_date=now)
+        with self.assertRaises(IntegrityError):
+            Loan.objects.create(game=game, borrower=patron, borrow_date=now, due_date=now)
+
+
+class CardStateTest(TestCase):
+    def setUp(self):
+        from .loans import start_loan
+        from .models import BorrowRequest, Rating
+        self.patron = User.objects.create_user(username='patron', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.lent = Game.objects.create(
+            title='Chrono Trigger', description='Time travel', release_date=date(1995, 3, 11),
+            genre='RPG', platform='SNES',
+        )
+        self.requested = Game.objects.create(
+            title='Halo', description='Ring world', release_date=date(2001, 11, 15),
+            genre='Shooter', platform='Xbox',
+        )
+        start_loan(self.lent, self.patron, 14)
+        BorrowRequest.objects.create(game=self.requested, requester=self.other)
+        Rating.objects.create(game=self.lent, user=self.patron, rating=4)
+        Rating.objects.create(game=self.lent, user=self.other, rating=1)
+
+    def test_card_state_is_annotated(self):
+        games = {game.title: game for game in Game.objects.with_card_state(self.patron)}
+        lent, requested = games['Chrono Trigger'], games['Halo']
+        self.assertTrue(lent.on_loan)
+        self.assertEqual(lent.current_borrower_username, 'patron')
+        self.assertTrue(lent.user_has_loan)
+        self.assertEqual(lent.rating_average, 2.5)
+        self.assertFalse(requested.on_loan)
+        self.assertTrue(requested.has_pending_borrow_request)
+        self.assertFalse(requested.user_has_pending_request)
+        self.assertEqual(requested.rating_average, 0)
+
+        requested = Game.objects.with_card_state(self.other).get(pk=self.requested.pk)
+        self.assertTrue(requested.user_has_pending_request)
+
+    def test_anonymous_card_state(self):
+        from django.contrib.auth.models import AnonymousUser
+        lent = Game.objects.with_card_state(AnonymousUser()).get(pk=self.lent.pk)
+        self.assertFalse(lent.user_has_loan)
+        self.assertFalse(lent.user_has_pending_request)
+
+    def test_card_filters_use_the_annotations(self):
+        from .templatetags.catalog_tags import has_pending_borrow_request, is_borrowed_by
+        games = list(Game.objects.with_card_state(self.patron).order_by('title'))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_borrowed_by(games[0], self.patron))
+            self.assertFalse(is_borrowed_by(games[0], self.other))
+            self.assertTrue(has_pending_borrow_request(games[1]))
+
+    def test_collection_page_queries_do_not_grow_with_games(self):
+        from collection.models import Collection
+        collection = Collection.objects.create(name='Favourites', description='', creator=self.patron)
+        collection.games.add(self.lent, self.requested)
+        self.client.force_login(self.patron)
+        with CaptureQueriesContext(connection) as two_games:
+            self.client.get(reverse('collection:view_collection', args=[collection.pk]))
+        for i in range(5):
+            collection.games.add(Game.objects.create(
+                title=f'Extra {i}', description='', release_date=date(2020, 1, 1), genre='RPG', platform='PC',
+            ))
+        with CaptureQueriesContext(connection) as seven_games:
+            response = self.client.get(reverse('collection:view_collection', args=[collection.pk]))
+        self.assertContains(response, 'Borrowed by you')
+        self.assertEqual(len(seven_games), len(two_games))
+
+
+class UpcAllocatorTest(TestCase):
+    def setUp(self):
+        from .upc import allocator
+        allocator.clear()
+        self.addCleanup(allocator.clear)
+
+    def test_codes_are_unique_and_check_digit_valid(self):
+        from .models import calculate_upc_check_digit
+        from .upc import allocate_upcs
+        upcs = allocate_upcs(5) + allocate_upcs(2500)
+        self.assertEqual(len(set(upcs)), 2505)
+        for upc in upcs:
+            self.assertEqual(len(upc), 12)
+            self.assertEqual(upc[-1], calculate_upc_check_digit(upc[:11]))
+
+    def test_codes_already_in_use_are_skipped(self):
+        from .upc import FIRST_VALUE, format_upc, allocate_upcs
+        taken = Game.objects.create(
+            title='Printed', description='', release_date=date(2020, 1, 1), genre='RPG', platform='PC',
+        )
+        Game.objects.filter(pk=taken.pk).update(upc=format_upc(FIRST_VALUE + 1001))
+        self.assertNotIn(format_upc(FIRST_VALUE + 1001), allocate_upcs(3000))
+
+    def test_transactions_on_sqlite_reserve_only_what_they_use(self):
+        from .upc import allocator
+        with self.captureOnCommitCallbacks(execute=True):
+            first, = allocator.allocate(1)
+            second, = allocator.allocate(1)
+        self.assertEqual(int(second[:11]), int(first[:11]) + 1)
+        # Nothing of a reservation that could have rolled back is shared
+        self.assertEqual(allocator.pool, [])
+
+    def test_rolled_back_block_is_dropped(self):
+        from django.db import transaction
+        from .upc import allocator
+        try:
+            with transaction.atomic():
+                rolled_back, = allocator.allocate(1)
+                raise ValueError
+        except ValueError:
+            pass
+        # The reservation was rolled back with the savepoint, so the same code
+        # comes round again rather than the rest of the discarded block
+        self.assertEqual(allocator.allocate(1), [rolled_back])
+
+    def test_blocks_reserved_on_their_own_connection_are_pooled_at_once(self):
+        from contextlib import nullcontext
+        from django.db import connection
+        from . import upc
+        # Stands in for Postgres; SQLite can't take a second writer during the test's transaction
+        with patch.object(connection, 'vendor', 'postgresql'), \
+                patch.object(upc, '_separate_connection', return_value=nullcontext(connection)) as separate:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                upc.allocator.allocate(1)
+        separate.assert_called_once_with()
+        self.assertEqual(callbacks, [])
+        self.assertEqual(len(upc.allocator.pool), upc.allocator.block_size - 1)
+
+    def test_separate_connection_is_closed_after_the_reservation(self):
+        from unittest import mock
+        from . import upc
+        with patch.object(upc.connections, 'create_connection') as create_connection:
+            with self.assertRaises(ValueError), upc._separate_connection() as own:
+                raise ValueError
+        own.close.assert_called_once_with()
+        create_connection.assert_called_once_with(mock.ANY)
+
+    def test_bulk_create_numbers_games(self):
+        games = Game.objects.bulk_create([
+            Game(title=f'Bulk {i}', description='', release_date=date(2020, 1, 1), genre='RPG', platform='PC')
+            for i in range(3)
+        ])
+        self.assertEqual(len({game.upc for game in games}), 3)
+        self.assertEqual(Game.objects.filter(upc__in=[game.upc for game in games]).count(), 3)
+
+
+class ImportGamesTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.test import override_settings
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        media = override_settings(MEDIA_ROOT=os.path.join(self.directory, 'media'))
+        media.enable()
+        self.addCleanup(media.disable)
+        with open(os.path.join(self.directory, 'cover.gif'), 'wb') as cover:
+            cover.write(
+                b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00\x00\x21\xf9\x04'
+                b'\x01\x0a\x00\x01\x00\x2c\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02'
+                b'\x02\x4c\x01\x00\x3b'
+            )
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as source:
+            source.write(text)
+        return path
+
+    def test_csv_import_validates_rows_and_counts_facets(self):
+        from django.core.management import call_command
+        from .models import FacetCount
+        path = self.write('games.csv', (
+            'title,description,release_date,genre,platform,location,image\n'
+            'Chrono Trigger,Time travel,1995-03-11,RPG,SNES,Shelf A,cover.gif\n'
+            'Broken,No date,someday,RPG,SNES,,cover.gif\n'
+            'Missing Cover,Oops,2001-01-01,RPG,PC,,missing.gif\n'
+            'Halo,Ring world,2001-11-15,Shooter,Xbox,,cover.gif\n'
+        ))
+        call_command('import_games', path, '--workers', '0', stdout=io.StringIO(), stderr=io.StringIO())
+
+        self.assertEqual(sorted(Game.objects.values_list('title', flat=True)), ['Chrono Trigger', 'Halo'])
+        game = Game.objects.get(title='Halo')
+        self.assertEqual(len(game.upc), 12)
+        self.assertTrue(game.image.name.endswith('.jpg'))
+        self.assertEqual(FacetCount.objects.get(facet='genre', value='RPG').count, 1)
+
+    def test_unreadable_covers_reject_their_row(self):
+        import struct
+        import zlib
+        from .importer import GameImporter, read_rows
+        with open(os.path.join(self.directory, 'cover.gif'), 'rb') as cover:
+            gif = cover.read()
+        with open(os.path.join(self.directory, 'truncated.gif'), 'wb') as cover:
+            cover.write(gif[:20])
+        # A 1x1 PNG whose header claims 20000x20000, Pillow refuses to open it
+        png = bytearray(
+            b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR' + struct.pack('>II', 20000, 20000) + b'\x08\x02\x00\x00\x00'
+        )
+        png += struct.pack('>I', zlib.crc32(bytes(png[12:])))
+        with open(os.path.join(self.directory, 'bomb.png'), 'wb') as cover:
+            cover.write(bytes(png) + b'\x00\x00\x00\x00IEND\xaeB`\x82')
+        path = self.write('games.csv', (
+            'title,description,release_date,genre,platform,location,image\n'
+            'Bomb,Huge,2001-01-01,RPG,PC,,bomb.png\n'
+            'Truncated,Cut off,2001-01-01,RPG,PC,,truncated.gif\n'
+            'Halo,Ring world,2001-11-15,Shooter,Xbox,,cover.gif\n'
+        ))
+        rejected = []
+        GameImporter('covers', self.directory, workers=0,
+                     on_reject=lambda line, reason: rejected.append((line, reason))).run(read_rows(path))
+
+        self.assertEqual(list(Game.objects.values_list('title', flat=True)), ['Halo'])
+        self.assertEqual([line for line, _ in rejected], [1, 2])
+        self.assertIn('decompression bomb', rejected[0][1])
+
+    def test_jsonl_import_resumes_from_checkpoint(self):
+        import json
+        from .importer import GameImporter, read_rows
+        rows = [
+            {'title': f'Game {i}', 'description': 'Imported', 'release_date': '2010-01-01',
+             'genre': 'Puzzle', 'platform': 'PC', 'image': 'cover.gif'}
+            for i in range(5)
+        ]
+        path = self.write('games.jsonl', '\n'.join(json.dumps(row) for row in rows))
+
+        def interrupted(rows):
+            yield from itertools.islice(rows, 3)
+            raise KeyboardInterrupt
+        with self.assertRaises(KeyboardInterrupt):
+            GameImporter('donation', self.directory, batch_size=2, workers=0).run(interrupted(read_rows(path)))
+        # Only the first full batch was committed
+        self.assertEqual(Game.objects.count(), 2)
+
+        checkpoint = GameImporter('donation', self.directory, batch_size=2, workers=0).run(read_rows(path))
+        self.assertEqual((checkpoint.position, checkpoint.created), (5, 5))
+        self.assertEqual(Game.objects.filter(title__startswith='Game ').count(), 5)
+
+    def test_failed_batch_leaves_no_covers_behind(self):
+        from django.core.files.storage import default_storage
+        from PIL import Image
+        from .importer import GameImporter
+        Image.new('RGB', (4, 4), (200, 0, 0)).save(os.path.join(self.directory, 'other.png'))
+        rows = [
+            {'title': title, 'description': 'Imported', 'release_date': '2010-01-01',
+             'genre': 'Puzzle', 'platform': 'PC', 'image': image}
+            for title, image in [('Tetris', 'cover.gif'), ('Lumines', 'cover.gif'), ('Puyo Puyo', 'other.png')]
+        ]
+        GameImporter('first', self.directory, workers=0).run(rows[:1])
+        kept = os.path.basename(Game.objects.get().image.name)
+
+        with patch.object(Game.objects, 'bulk_create', side_effect=RuntimeError('database went away')):
+            with self.assertRaises(RuntimeError):
+                GameImporter('second', self.directory, workers=0).run(rows[1:])
+        # Lumines' cover is the same file as Tetris', only Puyo Puyo's goes
+        covers = [name for _, _, names in os.walk(default_storage.path('game_images')) for name in names]
+        self.assertEqual(covers, [kept])
+
+    def test_lines_that_are_not_rows_are_rejected(self):
+        from .importer import GameImporter, read_rows
+        path = self.write('games.jsonl', (
+            '{"title": "Halo", "description": "Ring world", "release_date": "2001-11-15", '
+            '"genre": "Shooter", "platform": "Xbox", "image": "cover.gif"}\n'
+            '{"title": "Cut off\n'
+            '[1, 2]\n'
+        ))
+        rejected = []
+        checkpoint = GameImporter('messy', self.directory, workers=0,
+                                  on_reject=lambda line, reason: rejected.append((line, reason))).run(read_rows(path))
+        self.assertEqual((checkpoint.position, checkpoint.created, checkpoint.rejected), (3, 1, 2))
+        self.assertEqual([line for line, _ in rejected], [2, 3])
+        self.assertEqual(rejected[1][1], 'Expected a JSON object.')
+
+
+class ImageDerivativeTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from django.test import override_settings
+        from PIL import Image
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        media = override_settings(MEDIA_ROOT=self.directory)
+        media.enable()
+        self.addCleanup(media.disable)
+        cover = io.BytesIO()
+        Image.new('RGB', (1000, 1400), (30, 60, 90)).save(cover, 'PNG')
+        self.game = Game.objects.create(
+            title='Halo', description='Ring world', release_date=date(2001, 11, 15),
+            genre='Shooter', platform='Xbox', image=SimpleUploadedFile('halo.png', cover.getvalue()),
+        )
+
+    def test_upload_schedules_derivatives_after_commit(self):
+        from . import images
+        with patch.object(images, 'executor') as executor:
+            with self.captureOnCommitCallbacks(execute=False) as callbacks:
+                self.game.save()
+            executor.submit.assert_not_called()
+            for callback in callbacks:
+                callback()
+        executor.submit.assert_called_once_with(
+            images._derive_in_background, Game, self.game.pk, 'image', 'image_derived_from'
+        )
+
+    def test_derive_writes_every_size_and_marks_the_game(self):
+        from django.core.files.storage import default_storage
+        from PIL import Image
+        from .images import WIDTHS, derivative_name, derive
+        derive(Game, self.game.pk, 'image', 'image_derived_from')
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.image_derived_from, self.game.image.name)
+        for width in WIDTHS.values():
+            for extension in ('webp', 'jpg'):
+                with default_storage.open(derivative_name(self.game.image.name, width, extension)) as stored:
+                    self.assertEqual(Image.open(stored).width, width)
+
+    def test_srcset_only_once_derivatives_exist(self):
+        from django.template import Context, Template
+        template = Template(
+            "{% load catalog_tags %}{% responsive_image game.image game.image_derived_from 'card' alt=game.title %}"
+        )
+        html = template.render(Context({'game': self.game}))
+        self.assertNotIn('srcset', html)
+        self.assertIn('loading="lazy"', html)
+
+        from .images import derive
+        derive(Game, self.game.pk, 'image', 'image_derived_from')
+        self.game.refresh_from_db()
+        html = template.render(Context({'game': self.game}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('.400w.jpg 400w', html)
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        from mysite.storage import ContentAddressedFileSystemStorage
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.storage = ContentAddressedFileSystemStorage(location=directory)
+
+    def test_identical_uploads_share_one_file(self):
+        import hashlib
+        from django.core.files.base import ContentFile
+        first = self.storage.save('game_images/zelda.jpg', ContentFile(b'box art'))
+        second = self.storage.save('game_images/zelda (1).JPG', ContentFile(b'box art'))
+        other = self.storage.save('game_images/zelda.jpg', ContentFile(b'other art'))
+
+        digest = hashlib.sha256(b'box art').hexdigest()
+        self.assertEqual(first, f'game_images/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+        self.assertEqual(second, first)
+        self.assertNotEqual(other, first)
+        self.assertEqual(len(self.storage.listdir(f'game_images/{digest[:2]}/{digest[2:4]}')[1]), 1)
+
+    def test_derivatives_keep_their_names(self):
+        from django.core.files.base import ContentFile
+        name = self.storage.save('derivatives/game_images/ab/cd/abcd.400w.jpg', ContentFile(b'small'))
+        self.assertEqual(name, 'derivatives/game_images/ab/cd/abcd.400w.jpg')
+
+    def test_s3_objects_are_deduplicated_and_immutable(self):
+        import boto3
+        from django.core.files.base import ContentFile
+        from moto import mock_aws
+        from mysite.storage import IMMUTABLE_CACHE_CONTROL, ContentAddressedS3Storage
+        with mock_aws():
+            boto3.client('s3', region_name='us-east-1').create_bucket(Bucket='media')
+            storage = ContentAddressedS3Storage(
+                bucket_name='media', region_name='us-east-1', access_key='testing', secret_key='testing',
+                file_overwrite=False, default_acl=None, custom_domain='media.example.com',
+            )
+            first = storage.save('game_images/halo.png', ContentFile(b'ring world'))
+            second = storage.save('game_images/halo.png', ContentFile(b'ring world'))
+
+            objects = boto3.client('s3', region_name='us-east-1').list_objects_v2(Bucket='media')['Contents']
+            head = boto3.client('s3', region_name='us-east-1').head_object(Bucket='media', Key=first)
+        self.assertEqual(first, second)
+        self.assertEqual([item['Key'] for item in objects], [first])
+        self.assertEqual(head['CacheControl'], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(storage.url(first), f'https://media.example.com/{first}')
+
+
+class GameDetailTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.game = Game.objects.create(
+            title='Chrono Trigger', description='Time travel', release_date=date(1995, 3, 11),
+            genre='RPG', platform='SNES',
+        )
+        self.patron = User.objects.create_user(username='patron', password='testpass123')
+        self.url = reverse('catalog:game_detail', args=[self.game.upc])
+
+    def add_comments(self, count):
+        from .models import Comment
+        for i in range(count):
+            author = User.objects.create_user(username=f'reader{i}', password='testpass123')
+            Comment.objects.create(game=self.game, user=author, text=f'Comment {i}')
+
+    def test_comments_are_paginated(self):
+        self.add_comments(25)
+        self.client.force_login(self.patron)
+        response = self.client.get(self.url)
+        page = response.context['comments']
+        self.assertEqual([comment.text for comment in page][:2], ['Comment 24', 'Comment 23'])
+        self.assertEqual(len(page), 20)
+
+        response = self.client.get(self.url, {'comments': page.next_cursor})
+        self.assertEqual(len(response.context['comments']), 5)
+        self.assertContains(response, 'Comment 0')
+
+    def test_versions_follow_comments_and_ratings(self):
+        from .models import Rating
+        self.add_comments(1)
+        self.game.comments.get().delete()
+        Rating.objects.create(game=self.game, user=self.patron, rating=4)
+        self.game.refresh_from_db()
+        self.assertEqual((self.game.comment_version, self.game.rating_version), (2, 1))
+
+    def test_cached_fragments_skip_queries_until_something_changes(self):
+        from django.db import connection
+        self.add_comments(3)
+        self.client.force_login(self.patron)
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as cached:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Comment 2')
+        # Only the signed in user's own comment (for the edit form) is still looked up
+        comment_queries = [query['sql'] for query in cached.captured_queries if 'catalog_comment' in query['sql']]
+        self.assertEqual(len(comment_queries), 1)
+        self.assertIn('"catalog_comment"."user_id" =', comment_queries[0])
+
+        from .models import Comment
+        Comment.objects.create(game=self.game, user=self.patron, text='Fresh comment')
+        self.assertContains(self.client.get(self.url), 'Fresh comment')
+
+    def test_comment_pages_are_cached_by_decoded_cursor(self):
+        from django.core.cache import cache
+        from django.db import connection
+        self.add_comments(25)
+        self.client.force_login(self.patron)
+        cursor = self.client.get(self.url).context['comments'].next_cursor
+
+        def comment_pages(params):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(self.url, params)
+            return sum('ORDER BY "catalog_comment"."created_at" DESC' in query['sql']
+                       for query in queries.captured_queries)
+
+        self.assertEqual(comment_pages({'comments': cursor}), 1)
+        # Spelled differently, same page
+        self.assertEqual(comment_pages({'comments': cursor + '=' * (-len(cursor) % 4)}), 0)
+
+        # A cursor that doesn't decode shows the first page without storing it
+        cache.clear()
+        self.assertEqual(comment_pages({'comments': 'junk'}), 1)
+        self.assertEqual(comment_pages({'comments': 'junk'}), 1)
+
+    def test_only_librarians_get_delete_buttons(self):
+        self.add_comments(1)
+        librarian = User.objects.create_user(username='librarian', password='testpass123')
+        librarian.userprofile.role = 'Librarian'
+        librarian.userprofile.save()
+        self.client.force_login(self.patron)
+        self.assertNotContains(self.client.get(self.url), 'Delete Comment')
+        self.client.force_login(librarian)
+        self.assertContains(self.client.get(self.url), 'Delete Comment')
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='testpass123')
+        self.librarian.userprofile.role = 'Librarian'
+        self.librarian.userprofile.save()
+        self.patron = User.objects.create_user(username='patron', password='testpass123')
+        self.game = Game.objects.create(
+            title='Chrono Trigger', description='Time travel', release_date=date(1995, 3, 11),
+            genre='RPG', platform='SNES',
+        )
+        self.url = reverse('catalog:game_detail', args=[self.game.upc])
+        self.client.force_login(self.patron)
+
+    def etag(self, url=None):
+        return self.client.get(url or self.url)['ETag']
+
+    def test_repeat_visit_gets_304_without_rendering(self):
+        etag = self.etag()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.templates)
+        self.assertIn('private', response['Cache-Control'])
+
+        response = self.client.get(reverse('catalog:index'), HTTP_IF_NONE_MATCH=self.etag(reverse('catalog:index')))
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_follows_borrow_requests_and_loans(self):
+        from .loans import end_loan, start_loan
+        from .models import BorrowRequest
+        seen = [self.etag(), self.etag(reverse('catalog:index'))]
+        # The catalog version is bumped once each change commits
+        with self.captureOnCommitCallbacks(execute=True):
+            BorrowRequest.objects.create(game=self.game, requester=self.patron)
+        seen += [self.etag(), self.etag(reverse('catalog:index'))]
+        with self.captureOnCommitCallbacks(execute=True):
+            loan = start_loan(self.game, self.patron, 14)
+        seen += [self.etag(), self.etag(reverse('catalog:index'))]
+        with self.captureOnCommitCallbacks(execute=True):
+            end_loan(loan)
+        seen += [self.etag(), self.etag(reverse('catalog:index'))]
+        self.assertEqual(len(set(seen)), len(seen))
+
+    def test_catalog_etag_follows_the_catalog_version(self):
+        from .loans import start_loans
+        from .models import Rating
+        index = reverse('catalog:index')
+        seen = [self.etag(index)]
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.create(game=self.game, user=self.patron, rating=5)
+        seen.append(self.etag(index))
+        with self.captureOnCommitCallbacks(execute=True):
+            start_loans([(self.game.pk, self.patron.pk, 14)])
+        seen.append(self.etag(index))
+        with self.captureOnCommitCallbacks(execute=True):
+            Game.objects.create(title='Secret of Mana', description='Ring menus', release_date=date(1993, 8, 6))
+        seen.append(self.etag(index))
+        self.assertEqual(len(set(seen)), len(seen))
+
+    def test_etag_varies_by_role(self):
+        patron_etag = self.etag()
+        self.client.force_login(self.librarian)
+        self.assertNotEqual(self.etag(), patron_etag)
+
+    def test_queued_messages_force_a_render(self):
+        from django.contrib.messages import constants
+        etag = self.etag()
+        self.client.post(self.url, {'rating': '4'})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([m.level for m in response.context['messages']], [constants.SUCCESS])
+
+
+class HoldQueueTest(TestCase):
+    def setUp(self):
+        from .loans import start_loan
+        self.borrower = User.objects.create(username='borrower')
+        self.patrons = [User.objects.create(username=f'patron{i}') for i in range(3)]
+        self.game = Game.objects.create(
+            title='Chrono Trigger', description='Time travel', release_date=date(1995, 3, 11),
+            genre='RPG', platform='SNES',
+        )
+        self.loan = start_loan(self.game, self.borrower, 14)
+
+    def test_queue_is_first_come_first_served(self):
+        from .holds import CannotHold, cancel_hold, place_hold
+        self.assertEqual([place_hold(self.game, patron) for patron in self.patrons], [1, 2, 3])
+        with self.assertRaises(CannotHold):
+            place_hold(self.game, self.patrons[0])
+        with self.assertRaises(CannotHold):
+            place_hold(self.game, self.borrower)
+
+        self.assertTrue(cancel_hold(self.game, self.patrons[0]))
+        from .holds import queue_position
+        self.assertEqual(queue_position(self.game.holds.get(patron=self.patrons[2])), 2)
+
+    def test_return_hands_the_game_to_the_front_of_the_queue(self):
+        from .holds import place_hold
+        from .loans import end_loan
+        for patron in self.patrons:
+            place_hold(self.game, patron, 7)
+
+        next_loan = end_loan(self.loan)
+
+        self.game.refresh_from_db()
+        self.assertEqual(self.game.current_loan, next_loan)
+        self.assertEqual(next_loan.borrower, self.patrons[0])
+        self.assertEqual((next_loan.due_date - next_loan.borrow_date).days, 7)
+        self.assertEqual(list(self.game.holds.order_by('ticket').values_list('patron__username', flat=True)),
+                         ['patron1', 'patron2'])
+
+    def test_returning_twice_hands_off_once(self):
+        from .holds import place_hold
+        from .loans import end_loan
+        from .models import Loan
+        place_hold(self.game, self.patrons[0])
+        place_hold(self.game, self.patrons[1])
+        stale = Loan.objects.get(pk=self.loan.pk)
+
+        end_loan(self.loan)
+        self.assertIsNone(end_loan(stale))
+        self.assertEqual(Loan.objects.filter(is_returned=False).get().borrower, self.patrons[0])
+        self.assertEqual(self.game.holds.count(), 1)
+
+    def test_waitlist_views(self):
+        self.client.force_login(self.patrons[0])
+        url = reverse('catalog:game_detail', args=[self.game.upc])
+        self.assertContains(self.client.get(url), 'name="duration_days"')
+        self.client.post(reverse('catalog:place_hold', args=[self.game.upc]), {'duration_days': 21})
+        self.assertEqual(self.game.holds.get().duration_days, 21)
+        self.assertContains(self.client.get(url), 'You are number 1 on the waitlist.')
+        self.client.post(reverse('catalog:cancel_hold', args=[self.game.upc]))
+        self.assertContains(self.client.get(url), 'Join Waitlist')
+
+
+class OverdueScanTest(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from .models import Loan
+        self.now = timezone.now()
+        self.alice = User.objects.create(username='alice', email='alice@example.com')
+        self.bob = User.objects.create(username='bob')
+        self.loans = {}
+        for title, borrower, days in [('Late', self.alice, -2), ('Soon', self.alice, 1), ('Later', self.bob, 5)]:
+            game = Game.objects.create(title=title, description='', release_date=date(2000, 1, 1),
+                                       genre='RPG', platform='SNES')
+            due = self.now + timedelta(days=days)
+            self.loans[title] = Loan.objects.create(game=game, borrower=borrower, borrow_date=due - timedelta(days=14),
+                                                    due_date=due)
+
+    def states(self):
+        from .models import Loan
+        return dict(Loan.objects.values_list('game__title', 'due_state'))
+
+    def test_runs_only_pick_up_what_the_clock_moved_over(self):
+        from datetime import timedelta
+        from .overdue import scan_loans
+        digest = scan_loans(now=self.now, chunk_size=1)
+        self.assertEqual(self.states(), {'Late': 'overdue', 'Soon': 'due_soon', 'Later': ''})
+        self.assertEqual({state: [loan.game.title for loan in loans] for state, loans in digest[self.alice].items()},
+                         {'overdue': ['Late'], 'due_soon': ['Soon']})
+
+        self.assertEqual(scan_loans(now=self.now + timedelta(hours=1)), {})
+
+        digest = scan_loans(now=self.now + timedelta(days=3))
+        self.assertEqual(self.states(), {'Late': 'overdue', 'Soon': 'overdue', 'Later': 'due_soon'})
+        self.assertEqual(set(digest), {self.alice, self.bob})
+
+    def test_loans_lent_behind_the_marks_are_picked_up(self):
+        from datetime import timedelta
+        from .models import Loan
+        from .overdue import scan_loans
+        scan_loans(now=self.now, due_soon=timedelta(days=14))
+        # Shorter than the due soon window, and one already overdue when recorded
+        for title, days in [('Quick', 7), ('Backdated', -1)]:
+            game = Game.objects.create(title=title, description='', release_date=date(2000, 1, 1),
+                                       genre='RPG', platform='SNES')
+            Loan.objects.create(game=game, borrower=self.bob, borrow_date=self.now - timedelta(days=7),
+                                due_date=self.now + timedelta(days=days))
+
+        digest = scan_loans(now=self.now + timedelta(hours=1), due_soon=timedelta(days=14))
+        self.assertEqual({state: [loan.game.title for loan in loans] for state, loans in digest[self.bob].items()},
+                         {'overdue': ['Backdated'], 'due_soon': ['Quick']})
+        self.assertEqual(scan_loans(now=self.now + timedelta(hours=2), due_soon=timedelta(days=14)), {})
+
+    def test_command_prints_and_mails_digests(self):
+        from django.core import mail
+        from django.core.management import call_command
+        out = io.StringIO()
+        call_command('scan_overdue_loans', '--email', stdout=out)
+        self.assertIn('alice\n  Overdue: Late', out.getvalue())
+        self.assertIn('Marked 2 loans for 1 borrowers, 1 digests mailed.', out.getvalue())
+        self.assertEqual(mail.outbox[0].to, ['alice@example.com'])
+
+
+class ArchiveTest(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from .models import BorrowRequest, Loan
+        self.now = timezone.now()
+        self.alice = User.objects.create(username='alice', password='testpass123')
+        long_ago = self.now - timedelta(days=400)
+        for title, returned in [('Old', long_ago), ('Older', long_ago - timedelta(days=1)),
+                                ('Recent', self.now - timedelta(days=2)), ('Out', None)]:
+            game = Game.objects.create(title=title, description='', release_date=date(2000, 1, 1),
+                                       genre='RPG', platform='SNES')
+            Loan.objects.create(game=game, borrower=self.alice, borrow_date=long_ago - timedelta(days=14),
+                                due_date=long_ago, return_date=returned, is_returned=returned is not None)
+            BorrowRequest.objects.create(game=game, requester=self.alice,
+                                         status='pending' if returned is None else 'approved',
+                                         processed_date=returned)
+
+    def test_moves_only_old_history_and_reads_both_tiers(self):
+        from .archive import archive_borrow_requests, archive_loans, loan_history, request_history
+        from .models import ArchivedLoan, BorrowRequest, Loan
+        self.assertEqual(archive_loans(now=self.now, batch_size=1), 2)
+        self.assertEqual(archive_borrow_requests(now=self.now, batch_size=1), 2)
+
+        self.assertEqual(set(Loan.objects.values_list('game__title', flat=True)), {'Recent', 'Out'})
+        self.assertEqual(set(BorrowRequest.objects.values_list('game__title', flat=True)), {'Recent', 'Out'})
+        self.assertEqual(ArchivedLoan.objects.get(game__title='Old').borrower, self.alice)
+        self.assertEqual([loan['game__title'] for loan in loan_history(self.alice)], ['Recent', 'Old', 'Older'])
+        self.assertEqual([request['game__title'] for request in request_history(self.alice)], ['Recent', 'Older', 'Old'])
+
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('catalog:my_loans'))
+        self.assertEqual([loan['game__title'] for loan in response.context['past_loans']], ['Recent', 'Old', 'Older'])
+
+    def test_rejections_made_in_the_panel_are_archived(self):
+        from datetime import timedelta
+        from .archive import archive_borrow_requests
+        from .models import ArchivedBorrowRequest, BorrowRequest
+        librarian = User.objects.create_user(username='librarian', password='testpass123')
+        librarian.userprofile.role = 'Librarian'
+        librarian.userprofile.save()
+        pending = BorrowRequest.objects.get(status='pending')
+        self.client.force_login(librarian)
+        self.client.post(reverse('libpanel:reject_borrow_request', args=[pending.pk]))
+        pending.refresh_from_db()
+        self.assertEqual((pending.status, pending.processed_by), ('rejected', librarian))
+        # A rejection from before processed_date was recorded
+        legacy = BorrowRequest.objects.create(game=pending.game, requester=self.alice, status='rejected')
+        BorrowRequest.objects.filter(pk=legacy.pk).update(request_date=self.now - timedelta(days=400))
+
+        self.assertEqual(archive_borrow_requests(now=self.now), 3)
+        self.assertEqual(archive_borrow_requests(now=self.now + timedelta(days=200)), 2)
+        self.assertEqual(ArchivedBorrowRequest.objects.filter(pk__in=[pending.pk, legacy.pk]).count(), 2)
+
+    def test_interrupted_run_is_picked_up_by_the_next(self):
+        from django.core.management import call_command
+        from .models import ArchivedLoan, Loan
+        bulk_create = ArchivedLoan.objects.bulk_create
+        calls = iter([None, RuntimeError('killed')])
+
+        def flaky(*args, **kwargs):
+            error = next(calls, None)
+            if error:
+                raise error
+            return bulk_create(*args, **kwargs)
+
+        with patch.object(ArchivedLoan.objects, 'bulk_create', side_effect=flaky):
+            with self.assertRaises(RuntimeError):
+                call_command('archive_history', '--batch-size', '1', stdout=io.StringIO())
+        # The batch that failed rolled back whole
+        self.assertEqual(ArchivedLoan.objects.count(), 1)
+        self.assertEqual(Loan.objects.count(), 3)
+
+        out = io.StringIO()
+        call_command('archive_history', '--batch-size', '1', stdout=out)
+        self.assertIn('Archived 1 loans and 2 borrow requests.', out.getvalue())
+        self.assertEqual(Loan.objects.count() + ArchivedLoan.objects.count(), 4)
+
+
+class RecommendationTest(TestCase):
+    def setUp(self):
+        self.users = {name: User.objects.create(username=name) for name in ['alice', 'bob', 'carol', 'dave']}
+        self.games = {
+            title: Game.objects.create(title=title, description='', release_date=date(2000, 1, 1),
+                                       genre='RPG', platform='SNES')
+            for title in 'ABCD'
+        }
+        for name, titles in [('alice', 'AB'), ('bob', 'ABC')]:
+            for title in titles:
+                self.borrow(name, title)
+        self.rate('carol', 'C', 5)
+        self.rate('carol', 'D', 5)
+        self.rate('carol', 'A', 2)
+
+    def borrow(self, name, title, pk=None):
+        from .models import Loan
+        now = timezone.now()
+        Loan.objects.create(pk=pk, game=self.games[title], borrower=self.users[name], borrow_date=now, due_date=now,
+                            return_date=now, is_returned=True)
+
+    def rate(self, name, title, stars):
+        from .models import Rating
+        Rating.objects.update_or_create(game=self.games[title], user=self.users[name], defaults={'rating': stars})
+
+    def neighbors(self, title):
+        from .recommendations import neighbors
+        librarian = User.objects.get_or_create(username='librarian')[0]
+        librarian.userprofile.role = 'Librarian'
+        librarian.userprofile.save()
+        return [(n.neighbor.title, round(n.score, 3)) for n in neighbors(self.games[title], librarian)]
+
+    def counts(self):
+        from .models import GamePair
+        return sorted(GamePair.objects.values_list('game__title', 'other__title', 'patrons'))
+
+    def test_cosine_neighbors(self):
+        from .recommendations import refresh
+        self.assertEqual(refresh(), 4)
+        # A and B share both their patrons, C shares one of bob's with each
+        self.assertEqual(self.neighbors('A'), [('B', 1.0), ('C', 0.5)])
+        self.assertEqual(self.neighbors('C'), [('D', 0.707), ('A', 0.5), ('B', 0.5)])
+
+    def test_incremental_refresh_matches_a_rebuild(self):
+        from .recommendations import refresh
+        refresh()
+        self.borrow('dave', 'A')
+        self.borrow('dave', 'D')
+        self.rate('alice', 'C', 4)
+        self.rate('bob', 'D', 1)
+
+        self.assertEqual(refresh(), 4)
+        incremental = self.counts(), self.neighbors('A'), self.neighbors('D')
+        self.assertEqual(refresh(), 0)
+        refresh(rebuild=True)
+        self.assertEqual((self.counts(), self.neighbors('A'), self.neighbors('D')), incremental)
+
+    def test_loans_committed_after_a_higher_id_are_counted(self):
+        from .recommendations import refresh
+        self.borrow('dave', 'A', pk=1000)
+        refresh()
+        # Its id was handed out first, but it only committed after that run
+        self.borrow('dave', 'D', pk=999)
+        self.assertEqual(refresh(), 2)
+        self.assertIn(('A', 'D', 1), self.counts())
+
+    def test_pages_read_precomputed_neighbors(self):
+        from .recommendations import for_you, neighbors, refresh
+        refresh()
+        with self.assertNumQueries(1):
+            list(neighbors(self.games['A'], self.users['alice']))
+        self.assertEqual([game.title for game in for_you(self.users['alice'])], ['C'])
+
+        self.client.force_login(self.users['alice'])
+        response = self.client.get(reverse('catalog:game_detail', args=[self.games['A'].upc]))
+        self.assertContains(response, 'Patrons who borrowed this also borrowed')
+        response = self.client.get(reverse('home:index'))
+        self.assertEqual([game.title for game in response.context['for_you']], ['C'])
+
+
+class QueryPlanTest(TestCase):
+    """The busy pages only reach the request and loan tables through indexes."""
+    HOT_TABLES = ['catalog_loan', 'catalog_borrowrequest', 'collection_collectionaccessrequest']
+
+    @classmethod
+    def setUpTestData(cls):
+        from datetime import timedelta
+        from collection.models import Collection, CollectionAccessRequest
+        from .models import BorrowRequest, Loan
+        cls.librarian = User.objects.create_user(username='librarian', password='testpass123')
+        cls.librarian.userprofile.role = 'Librarian'
+        cls.librarian.userprofile.save()
+        cls.patron = User.objects.create_user(username='patron', password='testpass123')
+        User.objects.bulk_create([User(username=f'reader{i}') for i in range(300)])
+        readers = list(User.objects.filter(username__startswith='reader'))
+        Game.objects.bulk_create([
+            Game(title=f'Game {i}', description='', release_date=date(2000, 1, 1), genre='RPG', platform='SNES')
+            for i in range(400)
+        ])
+        games = list(Game.objects.order_by('pk'))
+        now = timezone.now()
+
+        # Mostly history, a few open loans and pending requests, like a real library
+        loans = Loan.objects.bulk_create([
+            Loan(game=game, borrower=readers[i % len(readers)], borrow_date=now - timedelta(days=30),
+                 due_date=now - timedelta(days=16), return_date=now, is_returned=True)
+            for i, game in enumerate(games * 5)
+        ] + [
+            Loan(game=game, borrower=readers[i], borrow_date=now, due_date=now + timedelta(days=14))
+            for i, game in enumerate(games[:40])
+        ])
+        Game.objects.bulk_update(
+            [Game(pk=loan.game_id, current_loan=loan) for loan in loans if not loan.is_returned], ['current_loan']
+        )
+        Loan.objects.create(game=games[50], borrower=cls.patron, borrow_date=now, due_date=now + timedelta(days=7))
+        statuses = ['approved'] * 8 + ['rejected', 'pending']
+        BorrowRequest.objects.bulk_create([
+            BorrowRequest(game=games[i % len(games)], requester=readers[i % len(readers)],
+                          status=statuses[i % len(statuses)])
+            for i in range(3000)
+        ])
+        cls.collection = Collection.objects.create(name='Vault', description='', creator=cls.librarian,
+                                                   is_private=True)
+        cls.collection.games.add(*games[:20])
+        collections = Collection.objects.bulk_create([
+            Collection(name=f'Shelf {i}', description='', creator=readers[i]) for i in range(50)
+        ])
+        CollectionAccessRequest.objects.bulk_create([
+            CollectionAccessRequest(collection=collection, requester=reader, status=statuses[j % len(statuses)])
+            for j, (collection, reader) in enumerate(itertools.product(collections, readers[:40]))
+        ])
+        CollectionAccessRequest.objects.create(collection=cls.collection, requester=cls.patron, status='approved')
+        cls.game = games[0]
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def plan(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tables this small are cheaper to scan, only fall back to that when no index fits
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('EXPLAIN ' + sql)
+            else:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scans(self, sql):
+        import re
+        tables = '|'.join(self.HOT_TABLES)
+        # Subqueries refer to the tables by alias, U0 and friends
+        names = set(self.HOT_TABLES) | {
+            alias for alias in re.findall(rf'"(?:{tables})" (?:AS )?"?([A-Z]\d+)"?', sql)
+        }
+        scans = []
+        for line in self.plan(sql):
+            match = (
+                re.search(r'Seq Scan on (\w+)(?: (\w+))?', line)
+                or re.fullmatch(r'SCAN (?:TABLE )?(\S+)(?: AS (\S+))?', line.strip())
+            )
+            if match and names & {name for name in match.groups() if name}:
+                scans.append(line)
+        return scans
+
+    def assertIndexedQueries(self, user, url, params=None):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params or {})
+        self.assertIn(response.status_code, (200, 302))
+        hot = [
+            query['sql'] for query in captured.captured_queries
+            if query['sql'].startswith('SELECT') and any(table in query['sql'] for table in self.HOT_TABLES)
+        ]
+        self.assertTrue(hot, f'{url} made no queries against the request and loan tables')
+        for sql in hot:
+            self.assertFalse(self.full_scans(sql), f'{url}: full scan in\n{sql}\n' + '\n'.join(self.plan(sql)))
+
+    def test_catalog_pages(self):
+        self.assertIndexedQueries(self.patron, reverse('catalog:index'))
+        self.assertIndexedQueries(self.librarian, reverse('catalog:index'), {'sort': 'title'})
+        self.assertIndexedQueries(self.patron, reverse('catalog:game_detail', args=[self.game.upc]))
+        free_game = Game.objects.filter(current_loan__isnull=True).first()
+        self.assertIndexedQueries(self.patron, reverse('catalog:request_borrow', args=[free_game.upc]))
+        self.assertIndexedQueries(self.patron, reverse('catalog:my_loans'))
+        self.assertIndexedQueries(self.librarian, reverse('catalog:manage_borrow_requests'))
+
+    def test_collection_pages(self):
+        self.assertIndexedQueries(self.patron, reverse('collection:index'))
+        self.assertIndexedQueries(self.patron, reverse('collection:view_collection', args=[self.collection.pk]))
+
+    def test_librarian_panel(self):
+        self.assertIndexedQueries(self.librarian, reverse('libpanel:requests'))
+        self.assertIndexedQueries(self.librarian, reverse('libpanel:loans'))
+        self.assertIndexedQueries(self.librarian, reverse('libpanel:loans'), {'state': 'overdue'})
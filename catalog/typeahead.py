@@ -0,0 +1,278 @@
+"""
+In-memory title index behind the search box suggestions and the typo
+tolerant fallback search (see catalog.fuzzy).
+
+Every worker process keeps its own copy. Changes made in the same process
+are applied straight away through signals; changes made by other workers
+are picked up by a cheap catch-up query (games whose updated_at moved)
+every SYNC_SECONDS, and the whole index is rebuilt every REBUILD_SECONDS
+so deletions made elsewhere eventually disappear too.
+"""
+import bisect
+import threading
+from collections import Counter
+import time
+import unicodedata
+from datetime import timedelta
+
+from .facets import scopes_for, visibility_scope
+from .models import Game
+from .search import TOKEN_RE
+
+SYNC_SECONDS = 5
+REBUILD_SECONDS = 15 * 60
+# Re-read a little before the newest change seen, in case a transaction that
+# started earlier committed after our last look
+SYNC_OVERLAP = timedelta(seconds=30)
+
+INDEX_FIELDS = ['id', 'title', 'upc', 'genre', 'platform', 'visibility', 'private_collection_id', 'updated_at']
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def words(text):
+    return TOKEN_RE.findall(normalize(text))
+
+
+def trigrams(text):
+    """Trigrams of every word padded the way pg_trgm does it, e.g. '  z', ' ze', 'zel'."""
+    result = set()
+    for word in words(text):
+        padded = f'  {word} '
+        result.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+class TypeaheadIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        # Held while reading the games table, so one thread refreshes while the others keep searching
+        self.refresh_lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.games = {}           # id -> row dict
+        self.titles = []          # sorted (normalized title, id)
+        self.words = []           # sorted distinct title words
+        self.postings = {}        # title word -> set of ids
+        self.tags = {}            # normalized genre/platform -> set of ids
+        self.trigrams = {}        # title trigram -> set of ids
+        self.built_at = None
+        self.synced_at = None
+        self.watermark = None
+
+    # Maintenance
+
+    def build(self, rows):
+        with self.lock:
+            self.clear()
+            for row in rows:
+                self._add(row, keep_sorted=False)
+            self.titles.sort()
+            self.words = sorted(self.postings)
+            self.built_at = self.synced_at = time.monotonic()
+
+    def add(self, row):
+        with self.lock:
+            self._remove(row['id'])
+            self._add(row, keep_sorted=True)
+
+    def remove(self, game_id):
+        with self.lock:
+            self._remove(game_id)
+
+    def set_visibility(self, game_id, visibility, private_collection_id):
+        with self.lock:
+            row = self.games.get(game_id)
+            if row is not None:
+                row['visibility'] = visibility
+                row['private_collection_id'] = private_collection_id
+
+    def _add(self, row, keep_sorted):
+        game_id = row['id']
+        title = normalize(row['title'])
+        self.games[game_id] = row
+        if keep_sorted:
+            bisect.insort(self.titles, (title, game_id))
+        else:
+            self.titles.append((title, game_id))
+        for word in set(words(row['title'])):
+            if word not in self.postings:
+                self.postings[word] = set()
+                if keep_sorted:
+                    bisect.insort(self.words, word)
+            self.postings[word].add(game_id)
+        for tag in {normalize(row['genre']), normalize(row['platform'])}:
+            self.tags.setdefault(tag, set()).add(game_id)
+        for trigram in trigrams(row['title']):
+            self.trigrams.setdefault(trigram, set()).add(game_id)
+
+    def _remove(self, game_id):
+        row = self.games.pop(game_id, None)
+        if row is None:
+            return
+        entry = (normalize(row['title']), game_id)
+        position = bisect.bisect_left(self.titles, entry)
+        if position < len(self.titles) and self.titles[position] == entry:
+            del self.titles[position]
+        for word in set(words(row['title'])):
+            ids = self.postings.get(word)
+            if ids is None:
+                continue
+            ids.discard(game_id)
+            if not ids:
+                del self.postings[word]
+                position = bisect.bisect_left(self.words, word)
+                if position < len(self.words) and self.words[position] == word:
+                    del self.words[position]
+        for tag in {normalize(row['genre']), normalize(row['platform'])}:
+            ids = self.tags.get(tag)
+            if ids is not None:
+                ids.discard(game_id)
+                if not ids:
+                    del self.tags[tag]
+        for trigram in trigrams(row['title']):
+            ids = self.trigrams.get(trigram)
+            if ids is not None:
+                ids.discard(game_id)
+                if not ids:
+                    del self.trigrams[trigram]
+
+    # Lookups
+
+    def search(self, query, limit=8, is_visible=lambda row: True):
+        """
+        Up to ``limit`` game rows matching ``query``: titles starting with it
+        first, then titles with a word starting with it, then games whose
+        genre or platform starts with it.
+        """
+        prefix = normalize(query).strip()
+        tokens = words(query)
+        if not prefix or not tokens:
+            return []
+
+        with self.lock:
+            results = []
+            seen = set()
+
+            def take(game_id):
+                row = self.games.get(game_id)
+                if row is not None and game_id not in seen and is_visible(row):
+                    seen.add(game_id)
+                    results.append(row)
+                return len(results) >= limit
+
+            # 1. Whole title starts with the query
+            for position in range(bisect.bisect_left(self.titles, (prefix,)), len(self.titles)):
+                title, game_id = self.titles[position]
+                if not title.startswith(prefix) or take(game_id):
+                    break
+
+            # 2. Some title word starts with the last token and the earlier tokens are whole words
+            if len(results) < limit:
+                start = len(results)
+                *complete, last = tokens
+                required = [self.postings.get(word, set()) for word in complete]
+                for position in range(bisect.bisect_left(self.words, last), len(self.words)):
+                    word = self.words[position]
+                    if not word.startswith(last):
+                        break
+                    if any(take(game_id) for game_id in self.postings[word].intersection(*required)):
+                        break
+                results[start:] = sorted(results[start:], key=lambda row: row['title'])
+
+            # 3. Genre or platform starts with the query
+            if len(results) < limit:
+                start = len(results)
+                for tag, ids in self.tags.items():
+                    if tag.startswith(prefix) and any(take(game_id) for game_id in ids):
+                        break
+                results[start:] = sorted(results[start:], key=lambda row: row['title'])
+
+            return results
+
+    def similar(self, query, limit=60, threshold=0.5):
+        """
+        Ids of games whose title shares at least ``threshold`` of the query's
+        trigrams, best first, as ``[(id, score), ...]``. Close to pg_trgm's
+        word_similarity, so "zeldda" still finds "The Legend of Zelda".
+        """
+        wanted = trigrams(query)
+        if not wanted:
+            return []
+
+        with self.lock:
+            shared = Counter()
+            for trigram in wanted:
+                shared.update(self.trigrams.get(trigram, ()))
+
+            scored = []
+            needed = threshold * len(wanted)
+            for game_id, count in shared.items():
+                if count >= needed:
+                    title_size = len(trigrams(self.games[game_id]['title']))
+                    # Ties go to the title with fewer extra trigrams
+                    scored.append((count / len(wanted), count / (len(wanted) + title_size - count), game_id))
+            scored.sort(reverse=True)
+            return [(game_id, score) for score, _, game_id in scored[:limit]]
+
+    # Freshness
+
+    def ensure_fresh(self):
+        if not self.needs_refresh():
+            return
+        # Nothing to serve yet, so wait for the first build; after that a
+        # thread that finds a refresh under way just uses the index as it is
+        if not self.refresh_lock.acquire(blocking=self.built_at is None):
+            return
+        try:
+            # Another thread may have refreshed while this one waited
+            needed = self.needs_refresh()
+            if needed == 'rebuild':
+                self.rebuild()
+            elif needed == 'sync':
+                self.sync()
+        finally:
+            self.refresh_lock.release()
+
+    def needs_refresh(self):
+        now = time.monotonic()
+        if self.built_at is None or now - self.built_at > REBUILD_SECONDS:
+            return 'rebuild'
+        if now - self.synced_at > SYNC_SECONDS:
+            return 'sync'
+        return None
+
+    def rebuild(self):
+        rows = list(Game.objects.values(*INDEX_FIELDS).iterator(chunk_size=5000))
+        self.build(rows)
+        self.watermark = max((row['updated_at'] for row in rows), default=None)
+
+    def sync(self):
+        """Apply games changed by other processes since the last look."""
+        changed = Game.objects.values(*INDEX_FIELDS)
+        if self.watermark is not None:
+            changed = changed.filter(updated_at__gte=self.watermark - SYNC_OVERLAP)
+        for row in changed:
+            self.add(row)
+            if self.watermark is None or row['updated_at'] > self.watermark:
+                self.watermark = row['updated_at']
+        self.synced_at = time.monotonic()
+
+
+index = TypeaheadIndex()
+
+
+def suggest(query, user, limit=8):
+    index.ensure_fresh()
+    scopes = scopes_for(user)
+    if scopes is None:
+        return index.search(query, limit)
+    scopes = set(scopes)
+    return index.search(
+        query, limit,
+        is_visible=lambda row: visibility_scope(row['visibility'], row['private_collection_id']) in scopes,
+    )
@@ -0,0 +1,128 @@
+"""
+UPC allocation in blocks.
+
+Each process reserves a block of BLOCK_SIZE consecutive codes with a single
+UPDATE on the UpcSequence row, then hands them out from memory, so saving
+a game no longer probes the table with random guesses and bulk_create can
+number thousands of games at once. Codes use UPC number system 4
+(reserved for in-store use) and get the usual check digit.
+
+A game is usually saved inside a transaction, and reserving there would
+keep the sequence row locked until that transaction ends, making every
+other worker's saves wait. So the reservation goes through a short-lived
+second connection that commits it straight away. SQLite only allows one
+writer at a time anyway, so there it stays in the caller's transaction and
+reserves just the codes asked for: nothing is left over to share before it
+commits, and a rollback takes the reservation with it.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+from .models import Game, UpcSequence, calculate_upc_check_digit
+
+SEQUENCE = 'game'
+BLOCK_SIZE = 1000
+FIRST_VALUE = 40_000_000_000
+LAST_VALUE = 49_999_999_999
+
+
+def format_upc(value):
+    body = f'{value:011d}'
+    return body + calculate_upc_check_digit(body)
+
+
+@contextmanager
+def _separate_connection():
+    """A second connection to the database in autocommit, closed again afterwards."""
+    own = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        yield own
+    finally:
+        own.close()
+
+
+def reserves_in_caller_transaction():
+    """Whether a block reserved now would only be committed with the caller's transaction."""
+    return connection.in_atomic_block and connection.vendor == 'sqlite'
+
+
+def _reserve(own, size):
+    table = UpcSequence._meta.db_table
+    with own.cursor() as cursor:
+        # One statement, so the row is only locked for as long as it runs
+        cursor.execute(
+            f'INSERT INTO {table} (name, next_value) VALUES (%s, %s) '
+            f'ON CONFLICT (name) DO UPDATE SET next_value = {table}.next_value + %s '
+            f'RETURNING next_value',
+            [SEQUENCE, FIRST_VALUE + size, size],
+        )
+        return cursor.fetchone()[0]
+
+
+def reserve_block(size):
+    """Reserve ``size`` consecutive values and return them as a range."""
+    if not connection.in_atomic_block or reserves_in_caller_transaction():
+        end = _reserve(connection, size)
+    else:
+        with _separate_connection() as own:
+            end = _reserve(own, size)
+    if end - 1 > LAST_VALUE:
+        raise RuntimeError('UPC range exhausted')
+    return range(end - size, end)
+
+
+def unused_upcs(values):
+    """UPCs for ``values`` minus any already taken, e.g. by games entered with a printed code."""
+    upcs = [format_upc(value) for value in values]
+    if not upcs:
+        return []
+    # Codes are fixed width, so string order is numeric order
+    taken = set(Game.objects.filter(upc__gte=upcs[0], upc__lte=upcs[-1]).values_list('upc', flat=True))
+    return [upc for upc in upcs if upc not in taken]
+
+
+class UpcAllocator:
+    def __init__(self, block_size=BLOCK_SIZE):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.pool = []
+
+    def allocate(self, count):
+        """Return ``count`` unused UPCs."""
+        with self.lock:
+            upcs = self.pool[:count]
+            del self.pool[:count]
+        while len(upcs) < count:
+            needed = count - len(upcs)
+            # A block reserved in the caller's transaction could still roll
+            # back, so none of it may go to the shared pool: take no more than needed
+            size = needed if reserves_in_caller_transaction() else max(self.block_size, needed)
+            block = unused_upcs(reserve_block(size))
+            upcs.extend(block[:needed])
+            self.release(block[needed:])
+        return upcs
+
+    def release(self, upcs):
+        with self.lock:
+            self.pool.extend(upcs)
+
+    def clear(self):
+        with self.lock:
+            self.pool = []
+
+
+allocator = UpcAllocator()
+
+
+def allocate_upcs(count):
+    return allocator.allocate(count)
+
+
+def assign_upcs(games):
+    """Give every game in ``games`` that has no UPC yet a fresh one."""
+    missing = [game for game in games if not game.upc]
+    for game, upc in zip(missing, allocate_upcs(len(missing))):
+        game.upc = upc
+    return games
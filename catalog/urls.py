@@ -6,9 +6,12 @@ app_name = 'catalog'
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path('typeahead/', views.typeahead, name='typeahead'),
     path('add/', views.add_game, name='add_game'),
     path('edit/<str:upc>/', views.edit_game, name='edit_game'),
     path('request-borrow/<str:upc>/', views.request_borrow, name='request_borrow'),
+    path('hold/<str:upc>/', views.place_hold, name='place_hold'),
+    path('hold/<str:upc>/cancel/', views.cancel_hold, name='cancel_hold'),
     path('my-loans/', views.my_loans, name='my_loans'),
     path('manage-borrow-requests/', views.manage_borrow_requests, name='manage_borrow_requests'),
     path('approve-borrow-request/<int:request_id>/', views.approve_borrow_request, name='approve_borrow_request'),
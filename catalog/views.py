@@ -1,15 +1,58 @@
-from .models import Game, BorrowRequest, Loan, Rating, Comment
+from .models import Game, BorrowRequest, Hold, Loan, Rating, Comment, FacetCount
 from django.shortcuts import render, redirect, get_object_or_404
 from .forms import GameForm, CommentForm, RatingForm, BorrowRequestForm
 from django.contrib.auth.decorators import login_required
-from collection.models import Collection, CollectionAccessRequest
-from django.db.models import Q
+from collection.models import Collection
 from django.utils import timezone
-from datetime import timedelta
+from django.utils.functional import SimpleLazyObject
 from django.contrib import messages
 from django.views.decorators.http import require_POST
-
-
+from django.http import JsonResponse
+from django.urls import reverse
+from .search import search_games
+from .pagination import KeysetPage, cursor_values, encode_cursor, paginate_keyset
+from .fuzzy import fuzzy_search
+from .loans import GameUnavailable, RequestAlreadyProcessed, end_loan
+from .typeahead import suggest
+from .etags import catalog_etag, conditional_page, game_detail_etag
+from . import archive, facets, holds, loans, recommendations
+
+
+# Columns a catalog card needs; everything else (description included) stays in the database
+CARD_FIELDS = [
+    'id', 'upc', 'title', 'genre', 'platform', 'location', 'release_date', 'image', 'image_derived_from', 'created_at',
+]
+
+# Annotations added by GameQuerySet.with_card_state
+CARD_STATE = [
+    'on_loan', 'current_borrower_username', 'has_pending_borrow_request', 'rating_average',
+    'user_has_loan', 'user_has_pending_request',
+]
+
+CATALOG_ORDERINGS = {
+    'newest': ['-created_at', '-id'],
+    'title': ['title', 'id'],
+}
+
+CATALOG_PAGE_SIZE = 60
+RECENT_RATINGS = 10
+COMMENTS_PAGE_SIZE = 20
+COMMENT_ORDERING = ['-created_at', '-id']
+# Fragments are keyed on the game's versions, so this only bounds how long
+# unused entries linger
+GAME_DETAIL_CACHE_SECONDS = 60 * 60
+HISTORY_LENGTH = 20
+
+
+def game_cards(games, user):
+    """Project a Game queryset down to plain dicts holding what a card renders."""
+    # Keep existing annotations such as search_rank, the paginator sorts on them
+    annotations = list(games.query.annotations)
+    games = games.with_card_state(user)
+    return games.values(*CARD_FIELDS, *annotations, *CARD_STATE)
+
+
+@conditional_page(catalog_etag)
 def index(request):
     # Get all public collections
     public_collections = Collection.objects.filter(is_private=False)
@@ -17,56 +60,129 @@ def index(request):
     # Start with all games
     games = Game.objects.all()
     search_query = request.GET.get('search', '')
+    sort = request.GET.get('sort', 'newest')
+    if sort not in CATALOG_ORDERINGS:
+        sort = 'newest'
+    ordering = CATALOG_ORDERINGS[sort]
+
+    # Librarians see everything, patrons public/unlisted games plus private
+    # collections they were granted, anonymous visitors public games only.
+    # Backed by the maintained Game.visibility columns, so no collection joins.
+    games = games.visible_to(request.user)
+    games = facets.filter_games(games, request.GET)
+    searchable_games = games
 
     if search_query:
-        games = games.filter(
-            Q(title__icontains=search_query) |
-            Q(description__icontains=search_query) |
-            Q(genre__icontains=search_query) |
-            Q(platform__icontains=search_query) |
-            Q(location__icontains=search_query)
-        )
-
-    # If user is authenticated and not a Librarian, filter games based on access
-    if request.user.is_authenticated and request.user.userprofile.role == 'Patron':
-        # Get IDs of private collections the user has access to
-        approved_requests = CollectionAccessRequest.objects.filter(
-            requester=request.user,
-            status='approved'
-        ).values_list('collection_id', flat=True)
-        
-        # Filter games to show:
-        # 1. Games that are in public collections
-        # 2. Games that are in private collections the user has access to
-        # 3. Games that are not in any collection
-        games = games.filter(
-            Q(collections__is_private=False) |  # Public collections
-            Q(collections__id__in=approved_requests) |  # Private collections with access
-            ~Q(collections__isnull=False)  # Games not in any collection
-        ).distinct()
-    elif not request.user.is_authenticated:
-        # For non-authenticated users, only show games from public collections
-        games = games.filter(collections__is_private=False).distinct()
-    else:
-        # For Librarians, show all games
-        games = games.distinct()
+        # Relevance-ranked full-text search, see catalog/search.py
+        games = search_games(games, search_query)
+        ordering = ['-search_rank', 'id']
 
-    
-    return render(request, "index.html", {
-        "games": games,
+    page = paginate_keyset(
+        game_cards(games, request.user), ordering,
+        cursor=request.GET.get('cursor'), page_size=CATALOG_PAGE_SIZE,
+    )
+
+    # Nothing matched, maybe a typo: fall back to titles that look similar
+    fuzzy_matches = False
+    if search_query and not page.object_list and not request.GET.get('cursor'):
+        similar = game_cards(fuzzy_search(searchable_games, search_query), request.user)[:CATALOG_PAGE_SIZE]
+        page = KeysetPage(list(similar), None)
+        fuzzy_matches = bool(page.object_list)
+
+    context = {
+        "games": page,
+        "fuzzy_matches": fuzzy_matches,
+        "next_page_query": _next_page_query(request, page),
         "public_collections": public_collections,
+        "active_facets": [(facet, request.GET[facet]) for facet in facets.FACETS if request.GET.get(facet)],
+        "search_query": search_query,
+        "sort": sort,
+    }
+
+    # The "load more" button only needs the next batch of cards
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        return render(request, "catalog/game_cards.html", context)
+
+    context["facets"] = _facet_links(request, facets.facet_counts(request.user))
+    return render(request, "index.html", context)
+
+
+def _next_page_query(request, page):
+    if not page.has_next:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = page.next_cursor
+    return params.urlencode()
+
+
+def _facet_links(request, counts):
+    """Facet values with the query string that toggles each one on or off."""
+    labels = dict(FacetCount.FACET_CHOICES)
+    groups = []
+    for facet, values in counts.items():
+        links = []
+        for value, count in values:
+            params = request.GET.copy()
+            params.pop('cursor', None)
+            selected = params.get(facet) == value
+            if selected:
+                params.pop(facet)
+            else:
+                params[facet] = value
+            links.append({'value': value, 'count': count, 'selected': selected, 'query': params.urlencode()})
+        if links:
+            groups.append({'name': labels[facet], 'values': links})
+    return groups
+
+
+def typeahead(request):
+    """Title suggestions for the search box, served from the in-memory prefix index."""
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+    results = suggest(request.GET.get('q', ''), request.user, limit=limit)
+    return JsonResponse({
+        'results': [
+            {
+                'title': row['title'],
+                'upc': row['upc'],
+                'genre': row['genre'],
+                'platform': row['platform'],
+                'url': reverse('catalog:game_detail', args=[row['upc']]),
+            }
+            for row in results
+        ]
     })
 
 
+@conditional_page(game_detail_etag)
 def game_detail(request, upc):
-    game = get_object_or_404(Game, upc=upc)
-    comments = game.comments.all()
-    ratings = game.ratings.all()
+    games = Game.objects.with_card_state(request.user).select_related('current_loan__borrower')
+    game = get_object_or_404(games, upc=upc)
+    # Only loaded when the cached comments fragment for this page has expired
+    comments_cursor = request.GET.get('comments', '')
+    # The fragment is keyed on where the page starts as decoded, not on the
+    # raw parameter, and a cursor that doesn't decode isn't cached at all
+    comments_after = cursor_values(game.comments.all(), COMMENT_ORDERING, comments_cursor)
+    comments_key = encode_cursor(comments_after) if comments_after is not None else ''
+    comments_cacheable = not comments_cursor or comments_after is not None
+    comments = SimpleLazyObject(lambda: paginate_keyset(
+        game.comments.select_related('user'), COMMENT_ORDERING,
+        cursor=comments_cursor, page_size=COMMENTS_PAGE_SIZE,
+    ))
+    # The average and histogram come from the aggregates on the game row
+    ratings = game.ratings.select_related('user')[:RECENT_RATINGS]
+    collections = game.collections.select_related('creator')
     user_rating = None
     user_comment = None
     user_has_commented = False
 
+    user_hold_position = None
     if request.user.is_authenticated:
+        user_hold = Hold.objects.filter(game=game, patron=request.user).first()
+        if user_hold:
+            user_hold_position = holds.queue_position(user_hold)
         user_rating = Rating.objects.filter(game=game, user=request.user).first()
         try:
             user_comment = Comment.objects.get(game=game, user=request.user)
@@ -110,12 +226,22 @@ def game_detail(request, upc):
     return render(request, 'game_detail.html', {
         'game': game,
         'comments': comments,
+        'comments_key': comments_key,
+        'comments_cache_seconds': GAME_DETAIL_CACHE_SECONDS if comments_cacheable else 0,
         'ratings': ratings,
+        'collections': collections,
+        'also_borrowed': recommendations.neighbors(game, request.user),
+        'cache_seconds': GAME_DETAIL_CACHE_SECONDS,
+        'can_moderate': request.user.is_authenticated and request.user.userprofile.role == 'Librarian',
         'comment_form': comment_form,
         'rating_form': rating_form,
         'user_rating': user_rating,
         'user_has_commented': user_has_commented,
         'user_comment': user_comment,
+        'hold_count': game.holds.count() if game.is_on_loan else 0,
+        'user_hold_position': user_hold_position,
+        # The loan length the waitlisted patron gets once it is handed to them
+        'hold_form': BorrowRequestForm(auto_id='hold_%s'),
     })
 
 
@@ -141,7 +267,7 @@ def request_borrow(request, upc):
     
     # Check if game is available
     if game.is_on_loan:
-        messages.error(request, 'This game is not available for borrowing.')
+        messages.error(request, 'This game is not available for borrowing, join the waitlist to get it next.')
         return redirect('catalog:game_detail', upc=game.upc)
     
     # Check if user already has an active loan for this game
@@ -174,16 +300,43 @@ def request_borrow(request, upc):
     })
 
 
+@login_required
+@require_POST
+def place_hold(request, upc):
+    game = get_object_or_404(Game, upc=upc)
+    form = BorrowRequestForm(request.POST)
+    duration_days = form.cleaned_data['duration_days'] if form.is_valid() else 14
+    try:
+        position = holds.place_hold(game, request.user, duration_days)
+    except holds.CannotHold as error:
+        messages.error(request, str(error))
+    else:
+        messages.success(request, f'You are number {position} on the waitlist. The game is lent to you when it comes back.')
+    return redirect('catalog:game_detail', upc=game.upc)
+
+
+@login_required
+@require_POST
+def cancel_hold(request, upc):
+    game = get_object_or_404(Game, upc=upc)
+    if holds.cancel_hold(game, request.user):
+        messages.success(request, 'You left the waitlist.')
+    return redirect('catalog:game_detail', upc=game.upc)
+
+
 @login_required
 def my_loans(request):
     # Get active loans for the current user
     active_loans = Loan.objects.filter(
         borrower=request.user,
         is_returned=False
-    ).select_related('game')
+    ).select_related('game').order_by('due_date')
     
     context = {
         'active_loans': active_loans,
+        # Read across the hot and archive tables, see catalog.archive
+        'past_loans': archive.loan_history(request.user)[:HISTORY_LENGTH],
+        'past_requests': archive.request_history(request.user)[:HISTORY_LENGTH],
     }
     
     return render(request, 'my_loans.html', context)
@@ -195,7 +348,9 @@ def manage_borrow_requests(request):
         messages.error(request, 'Only librarians can manage borrow requests.')
         return redirect('catalog:index')
     
-    pending_requests = BorrowRequest.objects.filter(status='pending').order_by('request_date')
+    pending_requests = BorrowRequest.objects.filter(status='pending').order_by('request_date').select_related(
+        'game', 'requester'
+    )
     return render(request, 'manage_borrow_requests.html', {
         'pending_requests': pending_requests
     })
@@ -209,31 +364,16 @@ def approve_borrow_request(request, request_id):
     
     borrow_request = get_object_or_404(BorrowRequest, id=request_id)
     
-    # Check if game is already on loan
-    active_loan = Loan.objects.filter(
-        game=borrow_request.game,
-        is_returned=False
-    ).first()
-    
-    if active_loan:
+    # Create the loan using the requested duration and close the request together,
+    # fails if the game is already on loan or another librarian got there first
+    try:
+        loans.approve_borrow_request(borrow_request, request.user)
+    except GameUnavailable:
         messages.error(request, 'This game is already on loan to another patron.')
         return redirect('catalog:manage_borrow_requests')
-    
-    # Create new loan using the requested duration
-    borrow_date = timezone.now()
-    due_date = borrow_date + timedelta(days=borrow_request.duration_days)
-    Loan.objects.create(
-        game=borrow_request.game,
-        borrower=borrow_request.requester,
-        borrow_date=borrow_date,
-        due_date=due_date
-    )
-    
-    # Update borrow request
-    borrow_request.status = 'approved'
-    borrow_request.processed_date = timezone.now()
-    borrow_request.processed_by = request.user
-    borrow_request.save()
+    except RequestAlreadyProcessed:
+        messages.warning(request, 'This request has already been processed.')
+        return redirect('catalog:manage_borrow_requests')
     
     messages.success(request, 'Borrow request approved successfully.')
     return redirect('catalog:manage_borrow_requests')
@@ -265,7 +405,7 @@ def delete_game(request, upc):
     game = get_object_or_404(Game, upc=upc)
     
     # Check if the game has any active loans
-    if Loan.objects.filter(game=game, is_returned=False).exists():
+    if game.is_on_loan:
         messages.error(request, 'Cannot delete a game that is currently on loan.')
         return redirect('catalog:index')
     
@@ -306,7 +446,7 @@ def edit_game(request, upc):
 
 @login_required
 def return_game(request, upc):
-    game = get_object_or_404(Game, upc=upc)
+    game = get_object_or_404(Game.objects.select_related('current_loan__borrower'), upc=upc)
     
     # Check if game is on loan
     if not game.is_on_loan:
@@ -314,7 +454,7 @@ def return_game(request, upc):
         return redirect('catalog:game_detail', upc=game.upc)
     
     # Get the active loan
-    loan = Loan.objects.get(game=game, is_returned=False)
+    loan = game.current_loan
     
     # Check if user is the borrower or a librarian
     if request.user != loan.borrower and request.user.userprofile.role != 'Librarian':
@@ -322,13 +462,13 @@ def return_game(request, upc):
         return redirect('catalog:game_detail', upc=game.upc)
     
     if request.method == 'POST':
-        # Mark loan as returned
-        loan.is_returned = True
-        loan.return_date = timezone.now()
-        loan.save()
+        # Mark loan as returned, the game goes to the first patron on the waitlist if there is one
+        next_loan = end_loan(loan)
         
         if request.user.userprofile.role == 'Librarian':
             messages.success(request, f'Game has been returned by {loan.borrower.get_full_name() or loan.borrower.username}.')
+            if next_loan:
+                messages.info(request, f'It is now on loan to {next_loan.borrower.username}, who was first on the waitlist.')
         else:
             messages.success(request, 'Game has been returned successfully.')
         
@@ -0,0 +1,95 @@
+"""
+Approving and rejecting collection access requests in bulk, for the
+librarian panel.
+
+Approving a request also lends the requester every game of the collection
+that is on the shelf, like the one-at-a-time view does. A batch takes the
+same handful of queries whatever its size.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from catalog.loans import ALREADY_PROCESSED, APPROVED, REJECTED, start_loans
+from catalog.models import Game
+from .models import Collection, CollectionAccessRequest
+
+# Loans made on approval last this long, as in libpanel
+ACCESS_LOAN_DAYS = 14
+
+
+def _locked_requests(request_ids):
+    return list(
+        CollectionAccessRequest.objects.select_for_update(of=('self',))
+        .select_related('collection', 'requester')
+        .filter(pk__in=request_ids)
+        .order_by('created_at', 'pk')
+    )
+
+
+def bulk_approve_access_requests(request_ids):
+    """
+    Approve a batch of access requests in one transaction. Returns
+    (request, outcome, titles of the games that were already on loan).
+    """
+    with transaction.atomic():
+        requests = _locked_requests(request_ids)
+        pending = [
+            access_request for access_request in requests if access_request.status == CollectionAccessRequest.PENDING
+        ]
+
+        memberships = Collection.games.through.objects.filter(
+            collection__in={access_request.collection_id for access_request in pending}
+        ).order_by('game_id')
+        games_by_collection = defaultdict(list)
+        for collection_id, game_id in memberships.values_list('collection_id', 'game_id'):
+            games_by_collection[collection_id].append(game_id)
+
+        wanted = [
+            (access_request, game_id)
+            for access_request in pending
+            for game_id in games_by_collection[access_request.collection_id]
+        ]
+        loans = start_loans([
+            (game_id, access_request.requester_id, ACCESS_LOAN_DAYS) for access_request, game_id in wanted
+        ])
+        unavailable = defaultdict(list)
+        for (access_request, game_id), loan in zip(wanted, loans):
+            if loan is None:
+                unavailable[access_request.pk].append(game_id)
+        titles = dict(Game.objects.filter(
+            pk__in={game_id for game_ids in unavailable.values() for game_id in game_ids}
+        ).values_list('pk', 'title'))
+
+        now = timezone.now()
+        for access_request in pending:
+            access_request.status = CollectionAccessRequest.APPROVED
+            # bulk_update doesn't fill in auto_now fields
+            access_request.updated_at = now
+        CollectionAccessRequest.objects.bulk_update(pending, ['status', 'updated_at'])
+
+    approved = {access_request.pk for access_request in pending}
+    return [
+        (access_request, APPROVED, [titles[game_id] for game_id in unavailable[access_request.pk]])
+        if access_request.pk in approved else (access_request, ALREADY_PROCESSED, [])
+        for access_request in requests
+    ]
+
+
+def bulk_reject_access_requests(request_ids):
+    """Reject a batch of access requests in one transaction, returns (request, outcome) pairs."""
+    with transaction.atomic():
+        requests = _locked_requests(request_ids)
+        now = timezone.now()
+        report, rejected = [], []
+        for access_request in requests:
+            if access_request.status != CollectionAccessRequest.PENDING:
+                report.append((access_request, ALREADY_PROCESSED))
+                continue
+            access_request.status = CollectionAccessRequest.REJECTED
+            access_request.updated_at = now
+            rejected.append(access_request)
+            report.append((access_request, REJECTED))
+        CollectionAccessRequest.objects.bulk_update(rejected, ['status', 'updated_at'])
+    return report
@@ -1,5 +1,6 @@
 from django import forms
 from catalog.models import Game
+from . import membership
 from .models import Collection, CollectionAccessRequest
 
 
@@ -10,9 +11,12 @@ class CollectionForm(forms.ModelForm):
     description = forms.CharField(
         widget=forms.Textarea(attrs={'class': 'form-control', 'rows': 3, 'placeholder': 'Enter collection description'})
     )
+    # Picked by UPC with the searchable picker, see collection.views.game_picker,
+    # so the form never lists the whole catalog
     games = forms.ModelMultipleChoiceField(
         queryset=Game.objects.all(),
-        widget=forms.CheckboxSelectMultiple(attrs={'class': 'form-check-input'}),
+        to_field_name='upc',
+        widget=forms.MultipleHiddenInput,
         required=True
     )
 
@@ -34,32 +38,25 @@ class CollectionForm(forms.ModelForm):
                 widget=forms.CheckboxInput(attrs={'class': 'form-check-input'})
             )
 
-        # Filter out games that are in private collections except the current
-        private_games = Game.objects.filter(collections__is_private=True).exclude(collections=self.instance).distinct()
-        self.fields['games'].queryset = self.fields['games'].queryset.exclude(id__in=private_games)
+        # Games in other private collections can't be picked
+        self.fields['games'].queryset = membership.eligible_games(self.instance)
+
+    def selected_games(self):
+        """The picked games, for the picker to show. Only the selection is loaded, never the catalog."""
+        # UPCs whether they were posted or come from the instance
+        return Game.objects.filter(upc__in=self['games'].value() or []).order_by('title')
 
     def clean_games(self):
         games = self.cleaned_data['games']
-        collection = self.instance
-
-        for game in games:
-            # If the game is in a private collection, it cannot be added to any other collection
-            if game.collections.filter(is_private=True).exclude(id=collection.id).exists():
-                raise forms.ValidationError(f"Game '{game.title}' is already in a private collection and cannot be "
-                                            f"added to another collection.")
-
+        # If the game is in a private collection, it cannot be added to any other collection
+        membership.check_exclusive(self.instance, games)
         return games
 
     def save(self, commit=True):
         instance = super().save(commit=False)
         if commit:
             instance.save()
-            instance.games.set(self.cleaned_data['games'])
-
-            if instance.is_private and instance.pk:
-                for game in instance.games.all():
-                    for collection in game.collections.exclude(id=instance.id):
-                        collection.games.remove(game)
+            membership.set_games(instance, self.cleaned_data['games'])
         return instance
 
 
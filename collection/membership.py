@@ -0,0 +1,79 @@
+"""
+Which games are in which collections, keeping private collections
+exclusive: a game in a private collection is in no other collection.
+
+Everything here works on the whole set of games at once through the
+membership table. Checking a selection is one query, and taking games into
+a private collection is one DELETE of their other memberships, whether
+that is one game or five hundred.
+"""
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+
+from catalog.models import Game
+from .models import Collection
+from .visibility import refresh_game_visibility
+
+Membership = Collection.games.through
+
+
+def eligible_games(collection=None):
+    """
+    Games that may go into ``collection``: those in no private collection,
+    or only in this one. Reads the maintained Game.private_collection column.
+    """
+    eligible = Q(private_collection__isnull=True)
+    if collection is not None and collection.pk:
+        eligible |= Q(private_collection=collection.pk)
+    return Game.objects.filter(eligible)
+
+
+def private_conflicts(collection, games):
+    """Titles of ``games`` (a queryset or ids) that are already in a private collection other than ``collection``."""
+    return list(
+        Membership.objects.filter(game__in=games, collection__is_private=True)
+        .exclude(collection_id=collection.pk)
+        .order_by('game__title')
+        .values_list('game__title', flat=True)
+        .distinct()
+    )
+
+
+def check_exclusive(collection, games):
+    conflicts = private_conflicts(collection, games)
+    if conflicts:
+        raise ValidationError(
+            f"Game '{conflicts[0]}' is already in a private collection and cannot be added to another collection."
+        )
+
+
+def claim_games(collection):
+    """Take a private ``collection``'s games out of every other collection."""
+    others = Membership.objects.filter(
+        game_id__in=Membership.objects.filter(collection_id=collection.pk).values('game_id')
+    ).exclude(collection_id=collection.pk)
+    removed = list(others.values_list('game_id', 'collection_id'))
+    if not removed:
+        return
+    # A plain delete on the through table, m2m_changed is not sent so the
+    # signal handlers' work is done here for the whole set
+    others.delete()
+    Collection.objects.filter(pk__in={collection_id for _, collection_id in removed}).update(
+        updated_at=timezone.now()
+    )
+    refresh_game_visibility(game_id for game_id, _ in removed)
+
+
+def set_games(collection, games):
+    """Make ``games`` exactly the games of ``collection``."""
+    collection.games.set(games)
+    if collection.is_private:
+        claim_games(collection)
+
+
+def add_game(collection, game):
+    check_exclusive(collection, [game.pk])
+    collection.games.add(game)
+    if collection.is_private:
+        claim_games(collection)
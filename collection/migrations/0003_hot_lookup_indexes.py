@@ -0,0 +1,27 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("collection", "0002_collectionaccessrequest"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="collectionaccessrequest",
+            index=models.Index(
+                condition=models.Q(("status", "pending")),
+                fields=["created_at", "id"],
+                name="access_request_pending_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="collectionaccessrequest",
+            index=models.Index(
+                fields=["requester", "status"], name="access_request_requester_idx"
+            ),
+        ),
+    ]
@@ -1,7 +1,6 @@
 from django.contrib.auth.models import User
 from django.db import models
 from catalog.models import Game
-from django.core.exceptions import ValidationError
 
 
 class Collection(models.Model):
@@ -17,15 +16,8 @@ class Collection(models.Model):
         return f"{self.name} by {self.creator.username}"
 
     def add_game(self, game):
-        if game.collections.filter(is_private=True).exclude(id=self.id).exists():
-            raise ValidationError("Cannot add game to collection. Game is already in a private collection.")
-
-        self.games.add(game)
-
-        # If adding to a private collection, remove from all other collections
-        if self.is_private:
-            for collection in game.collections.exclude(id=self.id):
-                collection.games.remove(game)
+        from .membership import add_game
+        add_game(self, game)
 
     def save(self, *args, **kwargs):
         super().save(*args, **kwargs)
@@ -50,6 +42,13 @@ class CollectionAccessRequest(models.Model):
 
     class Meta:
         unique_together = ['collection', 'requester']
+        indexes = [
+            # The librarian panel's pending list, oldest first
+            models.Index(fields=['created_at', 'id'], condition=models.Q(status='pending'),
+                         name='access_request_pending_idx'),
+            # Which private collections a patron was granted, see GameQuerySet.visible_to
+            models.Index(fields=['requester', 'status'], name='access_request_requester_idx'),
+        ]
 
     def __str__(self):
         return f"{self.requester.username}'s request for {self.collection.name}"
@@ -0,0 +1,38 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from catalog.models import FacetCount
+from .models import Collection
+from .visibility import refresh_game_visibility
+
+
+@receiver(m2m_changed, sender=Collection.games.through)
+def collection_games_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        # game.collections.add(...) and friends: only one game is affected
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            refresh_game_visibility([instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_game_ids = list(instance.games.values_list('id', flat=True))
+    elif action == 'post_clear':
+        refresh_game_visibility(getattr(instance, '_cleared_game_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        refresh_game_visibility(pk_set)
+
+
+@receiver(post_save, sender=Collection)
+def collection_saved(sender, instance, created, **kwargs):
+    # Privacy may have flipped; a new collection has no games yet
+    if not created:
+        refresh_game_visibility(instance.games.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Collection)
+def collection_deleting(sender, instance, **kwargs):
+    instance._deleted_game_ids = list(instance.games.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Collection)
+def collection_deleted(sender, instance, **kwargs):
+    refresh_game_visibility(getattr(instance, '_deleted_game_ids', []))
+    # Nobody can be granted access to this collection any more
+    FacetCount.objects.filter(scope=f'private:{instance.pk}').delete()
@@ -1,11 +1,16 @@
 from django.test import TestCase
+from django.urls import reverse
 from .models import Collection
 from .forms import CollectionForm
 from datetime import date
 from django.contrib.auth.models import User
 from catalog.models import Game, generate_upc
+from catalog.pagination import encode_cursor
 from catalog.forms import GameForm
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
 
 class CollectionFormTest(TestCase):
@@ -48,7 +53,7 @@ class CollectionFormTest(TestCase):
         self.collection_data = {
             'name': 'Test Collection',
             'description': 'A collection for testing',
-            'games': [self.game1.id, self.game2.id],
+            'games': [self.game1.upc, self.game2.upc],
             'is_private': True
         }
     
@@ -88,4 +93,230 @@ class CollectionFormTest(TestCase):
         invalid_data['games'] = []
         form = CollectionForm(data=invalid_data, user=self.regular_user)
         self.assertFalse(form.is_valid())
-        self.assertIn('games', form.errors)
\ No newline at end of file
+        self.assertIn('games', form.errors)
+
+class GameVisibilityTest(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='testpass123')
+        self.librarian.userprofile.role = 'Librarian'
+        self.librarian.userprofile.save()
+        self.patron = User.objects.create_user(username='patron', password='testpass123')
+        self.game = Game.objects.create(
+            title='Game 1',
+            description='Description 1',
+            release_date=date(2023, 1, 1),
+            genre='Action',
+            platform='PC',
+        )
+        self.public = Collection.objects.create(name='Public', description='', creator=self.librarian)
+        self.private = Collection.objects.create(
+            name='Private', description='', creator=self.librarian, is_private=True
+        )
+
+    def visibility(self):
+        self.game.refresh_from_db()
+        return self.game.visibility, self.game.private_collection_id
+
+    def visible_to(self, user):
+        return list(Game.objects.visible_to(user))
+
+    def test_follows_membership_changes(self):
+        self.assertEqual(self.visibility(), (Game.UNLISTED, None))
+
+        self.public.games.add(self.game)
+        self.assertEqual(self.visibility(), (Game.PUBLIC, None))
+
+        self.public.games.remove(self.game)
+        self.private.games.add(self.game)
+        self.assertEqual(self.visibility(), (Game.PRIVATE, self.private.id))
+
+        self.game.collections.clear()
+        self.assertEqual(self.visibility(), (Game.UNLISTED, None))
+
+    def test_follows_privacy_and_deletion(self):
+        self.public.games.add(self.game)
+        self.public.is_private = True
+        self.public.save()
+        self.assertEqual(self.visibility(), (Game.PRIVATE, self.public.id))
+
+        self.public.delete()
+        self.assertEqual(self.visibility(), (Game.UNLISTED, None))
+
+    def test_game_save_keeps_maintained_columns(self):
+        stale = Game.objects.get(pk=self.game.pk)
+        self.public.games.add(self.game)
+        stale.title = 'Renamed'
+        stale.save()
+        self.assertEqual(self.visibility(), (Game.PUBLIC, None))
+
+    def test_visible_to(self):
+        from django.contrib.auth.models import AnonymousUser
+        from .models import CollectionAccessRequest
+
+        self.assertEqual(self.visible_to(AnonymousUser()), [])
+        self.assertEqual(self.visible_to(self.patron), [self.game])
+
+        self.private.games.add(self.game)
+        self.assertEqual(self.visible_to(self.patron), [])
+        self.assertEqual(self.visible_to(self.librarian), [self.game])
+
+        access = CollectionAccessRequest.objects.create(
+            collection=self.private, requester=self.patron, status=CollectionAccessRequest.APPROVED
+        )
+        self.assertEqual(self.visible_to(self.patron), [self.game])
+
+        access.status = CollectionAccessRequest.REJECTED
+        access.save()
+        self.assertEqual(self.visible_to(self.patron), [])
+
+
+class CollectionSearchTest(TestCase):
+    def test_misspelled_game_title_finds_collection(self):
+        from catalog import typeahead
+        typeahead.index.clear()
+        self.addCleanup(typeahead.index.clear)
+        creator = User.objects.create_user(username='creator', password='testpass123')
+        game = Game.objects.create(title='Halo Infinite', description='', release_date=date(2021, 12, 8),
+                                   genre='Shooter', platform='Xbox')
+        collection = Collection.objects.create(name='Shooters', description='', creator=creator)
+        collection.games.add(game)
+        self.client.force_login(creator)
+
+        response = self.client.get('/collections/', {'search': 'Halo Infinte'})
+        self.assertTrue(response.context['fuzzy_matches'])
+        self.assertEqual(list(response.context['collections']), [collection])
+
+
+class CollectionConditionalGetTest(TestCase):
+    def test_etag_changes_when_access_is_granted(self):
+        from .models import CollectionAccessRequest
+        creator = User.objects.create_user(username='creator', password='testpass123')
+        patron = User.objects.create_user(username='patron', password='testpass123')
+        collection = Collection.objects.create(name='Vault', description='', creator=creator, is_private=True)
+        url = f'/collections/{collection.pk}/'
+        self.client.force_login(patron)
+
+        # No access yet: redirected, but still validated
+        refused = self.client.get(url)
+        self.assertEqual(refused.status_code, 302)
+        access_request = CollectionAccessRequest.objects.create(collection=collection, requester=patron)
+        access_request.status = 'approved'
+        access_request.save()
+
+        # The first page after the redirect shows its queued message
+        self.client.get(url)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=refused['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        game = Game.objects.create(title='Halo', description='', release_date=date(2001, 11, 15),
+                                   genre='Shooter', platform='Xbox')
+        collection.games.add(game)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+class MembershipTest(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='testpass123')
+        self.librarian.userprofile.role = 'Librarian'
+        self.librarian.userprofile.save()
+        self.games = [
+            Game.objects.create(title=f'Game {i:02d}', description='', release_date=date(2023, 1, 1),
+                                genre='Action', platform='PC')
+            for i in range(40)
+        ]
+        self.public = Collection.objects.create(name='Public', description='', creator=self.librarian)
+        self.public.games.set(self.games)
+
+    def save_private(self, games):
+        form = CollectionForm(data={
+            'name': 'Vault', 'description': 'Vault', 'games': [game.upc for game in games], 'is_private': True,
+        }, user=self.librarian)
+        with CaptureQueriesContext(connection) as validating:
+            self.assertTrue(form.is_valid(), form.errors)
+        form.instance.creator = self.librarian
+        with CaptureQueriesContext(connection) as saving:
+            collection = form.save()
+        return collection, len(validating), len(saving)
+
+    def test_private_save_takes_the_same_queries_for_any_size(self):
+        _, small_validating, small_saving = self.save_private(self.games[:2])
+        collection, validating, saving = self.save_private(self.games[10:40])
+
+        self.assertEqual((validating, saving), (small_validating, small_saving))
+        self.assertEqual(validating, 2)
+        self.assertEqual(self.public.games.count(), 8)
+        self.assertEqual(collection.games.count(), 30)
+        self.assertEqual(
+            set(Game.objects.filter(pk__in=[game.pk for game in self.games[10:40]])
+                .values_list('visibility', 'private_collection')),
+            {(Game.PRIVATE, collection.pk)},
+        )
+
+    def test_games_in_a_private_collection_are_refused(self):
+        collection, _, _ = self.save_private(self.games[:2])
+        other = Collection.objects.create(name='Other', description='', creator=self.librarian)
+        with self.assertRaisesMessage(ValidationError, "Game 'Game 01'"):
+            other.add_game(self.games[1])
+
+        form = CollectionForm(data={'name': 'Other', 'description': 'Other', 'games': [self.games[0].upc]},
+                              instance=other, user=self.librarian)
+        self.assertFalse(form.is_valid())
+        collection.add_game(self.games[5])
+        self.assertEqual(list(self.games[5].collections.all()), [collection])
+
+
+class GamePickerTest(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='testpass123')
+        self.librarian.userprofile.role = 'Librarian'
+        self.librarian.userprofile.save()
+        self.patron = User.objects.create_user(username='patron', password='testpass123')
+        self.games = [
+            Game.objects.create(title=f'Quest {i:02d}', description='', release_date=date(2023, 1, 1),
+                                genre='RPG', platform='PC')
+            for i in range(25)
+        ]
+        self.vault = Collection.objects.create(name='Vault', description='', creator=self.librarian, is_private=True)
+        self.vault.games.add(self.games[0])
+
+    def pick(self, user, **params):
+        self.client.force_login(user)
+        return self.client.get(reverse('collection:game_picker'), params).json()
+
+    def test_pages_through_eligible_games(self):
+        first = self.pick(self.librarian)
+        self.assertEqual([game['title'] for game in first['results']][:2], ['Quest 01', 'Quest 02'])
+        self.assertEqual(len(first['results']), 20)
+        second = self.pick(self.librarian, cursor=first['next'])
+        self.assertEqual([game['title'] for game in second['results']][-1], 'Quest 24')
+        self.assertIsNone(second['next'])
+        self.assertEqual(self.pick(self.librarian, cursor=encode_cursor([7, 'x']))['results'], first['results'])
+
+        # The vault's own game is offered when editing the vault, to those who may edit it
+        self.assertEqual(self.pick(self.librarian, q='quest 00', collection=self.vault.pk)['results'][0]['upc'],
+                         self.games[0].upc)
+        self.assertNotIn(self.games[0].upc,
+                         [game['upc'] for game in self.pick(self.patron, collection=self.vault.pk)['results']])
+
+    def test_edit_page_cost_does_not_depend_on_the_catalog(self):
+        self.client.force_login(self.librarian)
+        url = reverse('collection:edit_collection', args=[self.vault.pk])
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get(url)
+        self.assertContains(response, f'value="{self.games[0].upc}"')
+        for i in range(50):
+            Game.objects.create(title=f'Filler {i}', description='', release_date=date(2023, 1, 1),
+                                genre='RPG', platform='PC')
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(len(large), len(small))
+        self.assertNotContains(response, 'Filler')
+
+    def test_create_by_upc(self):
+        self.client.force_login(self.librarian)
+        self.client.post(reverse('collection:create_collection'), {
+            'name': 'Picks', 'description': 'Picked', 'games': [self.games[1].upc, self.games[2].upc],
+        })
+        collection = Collection.objects.get(name='Picks')
+        self.assertEqual(sorted(collection.games.values_list('title', flat=True)), ['Quest 01', 'Quest 02'])
@@ -7,6 +7,7 @@ app_name = 'collection'
 urlpatterns = [
     path("", views.index, name="index"),
     path('create/', views.create_collection, name='create_collection'),
+    path('games/', views.game_picker, name='game_picker'),
     path('<int:pk>/', views.view_collection, name='view_collection'),
     path('edit/<int:pk>/', views.edit_collection, name='edit_collection'),
     path('delete/<int:pk>/', views.delete_collection, name='delete_collection'),
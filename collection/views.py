@@ -4,6 +4,15 @@ from .forms import CollectionForm
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db.models import Q
+from django.http import JsonResponse
+from catalog.models import Game
+from catalog.fuzzy import fuzzy_search
+from catalog.etags import collection_etag, conditional_page
+from catalog.pagination import paginate_keyset
+from catalog.search import search_games
+from . import membership
+
+PICKER_PAGE_SIZE = 20
 
 
 def index(request):
@@ -28,9 +37,19 @@ def index(request):
     else:
         collections = search.filter(is_private=False)
 
+    # Nothing matched, maybe a typo: show collections holding similarly titled games
+    fuzzy_matches = False
+    if search_query and not collections.exists():
+        similar_games = list(fuzzy_search(Game.objects.all(), search_query).values_list('id', flat=True)[:60])
+        collections = Collection.objects.filter(games__in=similar_games).distinct()
+        if not request.user.is_authenticated:
+            collections = collections.filter(is_private=False)
+        fuzzy_matches = collections.exists()
+
     # Simply pass the collections directly
     return render(request, "collection/index.html", {
-        "collections": collections
+        "collections": collections,
+        "fuzzy_matches": fuzzy_matches,
     })
 
 
@@ -53,6 +72,7 @@ def create_collection(request):
     return render(request, 'collection/create_collection.html', {'form': form})
 
 
+@conditional_page(collection_etag)
 def view_collection(request, pk):
     collection = get_object_or_404(Collection, pk=pk)
 
@@ -72,7 +92,41 @@ def view_collection(request, pk):
         messages.error(request, 'You do not have permission to view this private collection.')
         return redirect('collection:index')
 
-    return render(request, 'collection/view_collection.html', {'collection': collection})
+    # Loan and request state for every card comes with the games in one query
+    games = collection.games.with_card_state(request.user)
+    return render(request, 'collection/view_collection.html', {'collection': collection, 'games': games})
+
+
+@login_required
+def game_picker(request):
+    """
+    Games that can be added to a collection, searched and paged by title for
+    the collection forms' picker. Pass ``collection`` when editing one, so
+    its own private games are offered too.
+    """
+    collection = None
+    collection_id = request.GET.get('collection', '')
+    if collection_id.isdigit():
+        collection = Collection.objects.filter(pk=collection_id).first()
+        # Only those who may edit it get its private games listed
+        if collection and collection.creator != request.user and request.user.userprofile.role != 'Librarian':
+            collection = None
+
+    games = membership.eligible_games(collection).visible_to(request.user)
+    query = request.GET.get('q', '').strip()
+    if query:
+        games = search_games(games, query)
+    page = paginate_keyset(
+        games.values('id', 'upc', 'title', 'platform', 'genre'), ['title', 'id'],
+        cursor=request.GET.get('cursor'), page_size=PICKER_PAGE_SIZE,
+    )
+    return JsonResponse({
+        'results': [
+            {'upc': row['upc'], 'title': row['title'], 'platform': row['platform'], 'genre': row['genre']}
+            for row in page
+        ],
+        'next': page.next_cursor,
+    })
 
 
 @login_required
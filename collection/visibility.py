@@ -0,0 +1,55 @@
+"""
+Keeps Game.visibility and Game.private_collection in step with collection
+membership, so the catalog can filter on two indexed columns of the game
+table instead of joining through Collection.games on every page view.
+"""
+from collections import defaultdict
+
+from django.utils import timezone
+
+from catalog.models import Game
+from catalog.signals import game_visibility_changed
+from .models import Collection
+
+
+def refresh_game_visibility(game_ids):
+    """Recompute the visibility columns of the given games from their collections."""
+    game_ids = set(game_ids)
+    if not game_ids:
+        return
+
+    state = {game_id: (Game.UNLISTED, None) for game_id in game_ids}
+    memberships = Collection.games.through.objects.filter(game_id__in=game_ids).values_list(
+        'game_id', 'collection_id', 'collection__is_private'
+    )
+    for game_id, collection_id, is_private in memberships:
+        visibility, private_collection_id = state[game_id]
+        if not is_private:
+            visibility = Game.PUBLIC
+        else:
+            private_collection_id = collection_id
+            if visibility != Game.PUBLIC:
+                visibility = Game.PRIVATE
+        state[game_id] = (visibility, private_collection_id)
+
+    current = Game.objects.filter(id__in=game_ids).values_list('id', 'visibility', 'private_collection_id')
+    changes = {
+        game_id: ((visibility, private_collection_id), state[game_id])
+        for game_id, visibility, private_collection_id in current
+        if (visibility, private_collection_id) != state[game_id]
+    }
+    if not changes:
+        return
+
+    # One UPDATE per distinct state, usually just one for a whole collection
+    games_by_state = defaultdict(list)
+    for game_id, (old_state, new_state) in changes.items():
+        games_by_state[new_state].append(game_id)
+    for (visibility, private_collection_id), ids in games_by_state.items():
+        Game.objects.filter(id__in=ids).update(
+            visibility=visibility,
+            private_collection_id=private_collection_id,
+            # Lets other processes notice the change, see catalog.typeahead
+            updated_at=timezone.now(),
+        )
+    game_visibility_changed.send(sender=Game, changes=changes)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("home", "0004_userprofile_real_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userprofile",
+            name="profile_pic_derived_from",
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+    ]
@@ -11,6 +11,8 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     role = models.CharField(max_length=20, choices=ROLE_CHOICES, default='Patron')
     profile_pic = models.ImageField(upload_to="images/", default="images/default.jpg")
+    # Name of the picture the resized copies were made from, set by catalog.images
+    profile_pic_derived_from = models.CharField(max_length=100, blank=True, editable=False)
     real_name = models.CharField(max_length=255, blank=True, null=True)
 
     def __str__(self):
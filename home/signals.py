@@ -1,6 +1,7 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
+from catalog import images
 from .models import UserProfile
 
 
@@ -14,3 +15,10 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     if not instance.is_superuser and hasattr(instance, 'userprofile'):
         instance.userprofile.save()
+
+
+@receiver(post_save, sender=UserProfile)
+def derive_profile_pictures(sender, instance, raw=False, **kwargs):
+    # Everyone starts with the same default picture, only uploads need resizing
+    if not raw and instance.profile_pic.name != UserProfile._meta.get_field('profile_pic').default:
+        images.schedule_derivatives(instance, 'profile_pic', 'profile_pic_derived_from')
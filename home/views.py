@@ -2,15 +2,18 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from .models import UserProfile
 from .forms import ProfileForm
+from catalog import recommendations
 from django.urls import reverse
 
 
 def index(request):
     username = None
     profileimage = None
+    for_you = []
 
     if request.user.is_authenticated:
         username = request.user.username
+        for_you = recommendations.for_you(request.user)
         try:
             profileimage = request.user.userprofile.profile_pic
         except:
@@ -18,7 +21,8 @@ def index(request):
 
     context = {
         'username': username,
-        'profileimage': profileimage
+        'profileimage': profileimage,
+        'for_you': for_you,
     }
 
     return render(request, 'home/index.html', context)
@@ -0,0 +1,191 @@
+"""
+Circulation rollups for the librarian panel's analytics page.
+
+The loan and borrow request columns are pulled once with values_list,
+from both the hot and the archive tables, into NumPy arrays. Every rollup
+after that is a few vectorized passes (bincount and ufunc.at over game
+indexes) rather than a Python loop over rows. Per game figures are summed
+up to genre and platform the same way.
+
+Reading the whole history is too slow for a page view, so
+`manage.py refresh_analytics` works the report out on a schedule and
+stores it in CirculationReport together with the newest loan it counts.
+The page shows the last stored report along with when it was computed, and
+flags it as stale once loans newer than that one exist.
+"""
+import itertools
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from catalog.models import ArchivedBorrowRequest, ArchivedLoan, BorrowRequest, Game, Loan
+from .models import CirculationReport
+
+DAY = 24 * 60 * 60
+MONTHS = 12
+IDLE_DAYS = 90
+LISTED = 20
+CHUNK_SIZE = 10_000
+
+LOAN_COLUMNS = ('game_id', 'borrow_date', 'due_date', 'return_date')
+
+
+def _timestamps(values):
+    """Datetimes as float epoch seconds, None as NaN."""
+    return np.fromiter((np.nan if value is None else value.timestamp() for value in values),
+                       dtype=np.float64, count=len(values))
+
+
+def _columns(querysets, fields, dates=()):
+    """Stream ``fields`` of each queryset into one array per field."""
+    chunks = []
+    for queryset in querysets:
+        rows = queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE)
+        while chunk := list(itertools.islice(rows, CHUNK_SIZE)):
+            chunks.append([
+                _timestamps(column) if field in dates else np.array(column, dtype=np.int64)
+                for field, column in zip(fields, zip(*chunk))
+            ])
+    if not chunks:
+        return {field: np.empty(0, dtype=np.float64 if field in dates else np.int64) for field in fields}
+    return {field: np.concatenate([chunk[i] for chunk in chunks]) for i, field in enumerate(fields)}
+
+
+def load_columns():
+    """Everything the rollups read, as arrays. Games are in id order."""
+    rows = list(Game.objects.order_by('pk').values_list('pk', 'title', 'genre', 'platform'))
+    ids, titles, genres, platforms = zip(*rows) if rows else ((), (), (), ())
+    games = {
+        'id': np.array(ids, dtype=np.int64),
+        'title': list(titles),
+        'genre': np.array(genres, dtype=object),
+        'platform': np.array(platforms, dtype=object),
+    }
+    loans = _columns([Loan.objects.all(), ArchivedLoan.objects.all()], LOAN_COLUMNS,
+                     dates={'borrow_date', 'due_date', 'return_date'})
+    requests = _columns([BorrowRequest.objects.all(), ArchivedBorrowRequest.objects.all()], ('game_id',))
+    return games, loans, requests
+
+
+def _month_index(timestamps):
+    return timestamps.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+
+
+def _rate(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=denominator > 0)
+
+
+def _rows(names, sums):
+    """One row per name from figures summed per name, aligned with ``names``."""
+    avg_days = _rate(sums['loan_days'], sums['returned'])
+    overdue_rate = _rate(sums['late'], sums['loans'])
+    return [
+        {
+            'name': name,
+            'games': int(sums['games'][i]),
+            'loans': int(sums['loans'][i]),
+            'loans_per_month': float(sums['recent'][i] / MONTHS),
+            'avg_days': float(avg_days[i]),
+            'overdue_rate': float(overdue_rate[i]),
+            'idle': int(sums['idle'][i]),
+            'requests': int(sums['requests'][i]),
+        }
+        for i, name in enumerate(names)
+    ]
+
+
+def _grouped(names, per_game):
+    """Sum the per game figures up to one row per distinct name."""
+    labels, group = np.unique(names, return_inverse=True)
+    return _rows(labels, {
+        key: np.bincount(group, weights=values, minlength=len(labels)) for key, values in per_game.items()
+    })
+
+
+def rollup(games, loans, requests, now):
+    """
+    Utilization per game, genre and platform. ``now`` is epoch seconds,
+    loans per month count the last MONTHS calendar months including this one.
+    """
+    count = len(games['id'])
+    game = np.searchsorted(games['id'], loans['game_id'])
+    returned = ~np.isnan(loans['return_date'])
+
+    this_month = _month_index(np.array([now]))[0]
+    months_ago = this_month - _month_index(loans['borrow_date'])
+    recent = (months_ago >= 0) & (months_ago < MONTHS)
+    late = np.where(returned, loans['return_date'] > loans['due_date'], loans['due_date'] < now)
+
+    last_borrowed = np.full(count, -np.inf)
+    np.maximum.at(last_borrowed, game, loans['borrow_date'])
+    on_loan = np.bincount(game[~returned], minlength=count) > 0
+    idle = ~on_loan & (last_borrowed < now - IDLE_DAYS * DAY)
+
+    per_game = {
+        'games': np.ones(count),
+        'loans': np.bincount(game, minlength=count),
+        'recent': np.bincount(game[recent], minlength=count),
+        'returned': np.bincount(game[returned], minlength=count),
+        'loan_days': np.bincount(game[returned], minlength=count,
+                                 weights=(loans['return_date'] - loans['borrow_date'])[returned] / DAY),
+        'late': np.bincount(game, weights=late, minlength=count),
+        'idle': idle,
+        'requests': np.bincount(np.searchsorted(games['id'], requests['game_id']), minlength=count),
+    }
+    per_game = {key: np.asarray(values, dtype=np.float64) for key, values in per_game.items()}
+
+    busiest = np.argsort(-per_game['recent'], kind='stable')[:LISTED]
+    busiest = busiest[per_game['recent'][busiest] > 0]
+    # Never borrowed first, then longest idle
+    longest_idle = np.flatnonzero(idle)[np.argsort(last_borrowed[idle], kind='stable')][:LISTED]
+    month_counts = np.bincount(MONTHS - 1 - months_ago[recent], minlength=MONTHS)
+    return {
+        'months': [
+            (str(np.datetime64(int(this_month) - MONTHS + 1 + i, 'M')), int(month_counts[i]))
+            for i in range(MONTHS)
+        ],
+        'total': _rows(['All games'], {key: values.sum(keepdims=True) for key, values in per_game.items()})[0],
+        'by_genre': _grouped(games['genre'], per_game),
+        'by_platform': _grouped(games['platform'], per_game),
+        'busiest': _rows([games['title'][i] for i in busiest], {
+            key: values[busiest] for key, values in per_game.items()
+        }),
+        'longest_idle': [
+            (games['title'][i], None if np.isinf(last_borrowed[i]) else
+             datetime.fromtimestamp(last_borrowed[i], tz=dt_timezone.utc))
+            for i in longest_idle
+        ],
+    }
+
+
+def refresh_report(now=None):
+    """Work the report out from the full history and store it, returns it."""
+    now = now or timezone.now()
+    # Read first, a loan made while the columns load leaves the report stale rather than looking counted
+    latest_loan_id = Loan.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    report = rollup(*load_columns(), now=now.timestamp())
+    CirculationReport.objects.update_or_create(pk=1, defaults={
+        'report': report, 'computed_at': now, 'latest_loan_id': latest_loan_id,
+    })
+    return report
+
+
+def circulation_report():
+    """
+    The last stored report with its computed_at and the number of loans made
+    since (new_loans, a primary key range count), or None before the first refresh.
+    """
+    stored = CirculationReport.objects.filter(pk=1).first()
+    if stored is None:
+        return None
+    report = stored.report
+    # JSON gave the dates back as strings
+    report['longest_idle'] = [
+        (title, parse_datetime(last_borrowed) if last_borrowed else None)
+        for title, last_borrowed in report['longest_idle']
+    ]
+    report['computed_at'] = stored.computed_at
+    report['new_loans'] = Loan.objects.filter(pk__gt=stored.latest_loan_id).count()
+    return report
@@ -0,0 +1,68 @@
+import random
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from catalog.benchmarks import rolled_back, seed_games, timer
+from catalog.models import Game, Loan
+from libpanel.analytics import load_columns, rollup
+
+
+def synthetic_loans(count, game_ids, borrower_id, now, seed=0):
+    """Yield unsaved, returned Loans spread over the last five years."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        borrowed = now - timedelta(seconds=rng.randrange(5 * 365 * 24 * 60 * 60))
+        due = borrowed + timedelta(days=rng.choice([7, 14, 21, 28]))
+        returned = due + timedelta(hours=rng.randrange(-14 * 24, 7 * 24))
+        yield Loan(game_id=rng.choice(game_ids), borrower_id=borrower_id, borrow_date=borrowed, due_date=due,
+                   return_date=max(returned, borrowed), is_returned=True)
+
+
+def orm_loop(games):
+    """The per row version: every game's loans fetched and walked in Python."""
+    for game in games:
+        lengths = [(loan.return_date - loan.borrow_date).days for loan in game.loans.all() if loan.is_returned]
+        sum(lengths) / len(lengths) if lengths else 0
+
+
+class Command(BaseCommand):
+    help = 'Time the NumPy circulation rollups on synthetic loans against a per game ORM loop'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=10_000_000)
+        parser.add_argument('--games', type=int, default=20_000)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--sample', type=int, default=200,
+                            help='Games walked by the ORM loop, the full run is extrapolated')
+
+    def handle(self, *args, **options):
+        results = {}
+        now = timezone.now()
+        with rolled_back():
+            seed_games(options['games'])
+            borrower = User.objects.create(username='benchmark-borrower')
+            game_ids = list(Game.objects.values_list('pk', flat=True))
+            with timer(results, 'seed'):
+                loans = synthetic_loans(options['loans'], game_ids, borrower.pk, now)
+                created = 0
+                while created < options['loans']:
+                    batch = [loan for _, loan in zip(range(options['batch_size']), loans)]
+                    Loan.objects.bulk_create(batch)
+                    created += len(batch)
+            self.stdout.write(f'Seeded {created:,} loans over {len(game_ids):,} games in {results["seed"]:.1f}s')
+
+            with timer(results, 'load'):
+                columns = load_columns()
+            with timer(results, 'rollup'):
+                rollup(*columns, now=now.timestamp())
+            with timer(results, 'orm'):
+                orm_loop(Game.objects.order_by('?')[:options['sample']])
+
+        orm_total = results['orm'] / options['sample'] * len(game_ids)
+        self.stdout.write(f'values_list into arrays: {results["load"]:.1f}s')
+        self.stdout.write(f'Vectorized rollups:      {results["rollup"]:.2f}s')
+        self.stdout.write(f'ORM loop, estimated:     {orm_total:.0f}s '
+                          f'({results["orm"]:.1f}s for {options["sample"]} games)')
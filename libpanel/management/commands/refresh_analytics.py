@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from libpanel.analytics import refresh_report
+
+
+class Command(BaseCommand):
+    help = 'Work out the circulation report from the full loan history and store it for the analytics page'
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        report = refresh_report()
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed the circulation report over {report["total"]["loans"]} loans '
+            f'in {time.perf_counter() - start:.1f}s.'
+        ))
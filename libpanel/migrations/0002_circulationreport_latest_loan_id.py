@@ -0,0 +1,18 @@
+# Generated by Django 4.2.18 on 2026-10-18 14:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("libpanel", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="circulationreport",
+            name="latest_loan_id",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
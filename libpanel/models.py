@@ -1,3 +1,13 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 
-# Create your models here.
+
+class CirculationReport(models.Model):
+    """The last report `manage.py refresh_analytics` worked out, the analytics page shows it as is."""
+    report = models.JSONField(encoder=DjangoJSONEncoder)
+    computed_at = models.DateTimeField()
+    # Newest loan the report counts, any loan after it makes the report stale
+    latest_loan_id = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'Circulation report of {self.computed_at}'
@@ -1,3 +1,186 @@
+import io
+import re
+from datetime import date, timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from catalog import loans
+from catalog.models import ArchivedLoan, BorrowRequest, Game, Loan
+from libpanel import analytics
+from collection.models import Collection, CollectionAccessRequest
+
+
+class BulkRequestTest(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='testpass123')
+        self.librarian.userprofile.role = 'Librarian'
+        self.librarian.userprofile.save()
+        self.patrons = [User.objects.create(username=f'patron{i}') for i in range(4)]
+        self.games = [
+            Game.objects.create(title=f'Game {i}', description='', release_date=date(2000, 1, 1),
+                                genre='RPG', platform='SNES')
+            for i in range(3)
+        ]
+        self.client.force_login(self.librarian)
+
+    def borrow(self, game, patron):
+        return BorrowRequest.objects.create(game=game, requester=patron)
+
+    def test_bulk_approve_reports_conflicts(self):
+        first = self.borrow(self.games[0], self.patrons[0])
+        second = self.borrow(self.games[0], self.patrons[1])
+        out = self.borrow(self.games[1], self.patrons[2])
+        loans.start_loan(self.games[1], self.patrons[3], 14)
+        done = self.borrow(self.games[2], self.patrons[3])
+        done.status = BorrowRequest.REJECTED
+        done.save()
+
+        report = loans.bulk_approve_borrow_requests([first.pk, second.pk, out.pk, done.pk], self.librarian)
+
+        self.assertEqual([(item.pk, outcome) for item, outcome in report], [
+            (first.pk, loans.APPROVED), (second.pk, loans.ON_LOAN),
+            (out.pk, loans.ON_LOAN), (done.pk, loans.ALREADY_PROCESSED),
+        ])
+        self.games[0].refresh_from_db()
+        self.assertEqual(self.games[0].current_loan.borrower, self.patrons[0])
+        self.assertEqual(BorrowRequest.objects.get(pk=first.pk).processed_by, self.librarian)
+        self.assertEqual(BorrowRequest.objects.get(pk=second.pk).status, BorrowRequest.PENDING)
+
+    def test_bulk_approve_queries_do_not_grow_with_the_batch(self):
+        def approve(requests):
+            # Savepoints included
+            with self.assertNumQueries(9):
+                loans.bulk_approve_borrow_requests([request.pk for request in requests], self.librarian)
+
+        approve([self.borrow(self.games[0], self.patrons[0])])
+        approve([self.borrow(game, patron) for game, patron in zip(self.games[1:], self.patrons[1:])])
+        self.assertEqual(Loan.objects.count(), 3)
+
+    def test_approvals_on_different_games_share_no_lock(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from catalog.models import CatalogVersion
+        requests = [self.borrow(game, patron) for game, patron in zip(self.games[:2], self.patrons[:2])]
+        version = CatalogVersion.current()
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            for borrow_request in requests:
+                with CaptureQueriesContext(connection) as queries:
+                    loans.approve_borrow_request(borrow_request, self.librarian)
+                # Only the request, its game and their loan are written while the transaction is open
+                written = {re.match(r'(?:UPDATE|INSERT INTO) "(\w+)"', query['sql']) for query in queries}
+                written = {match[1] for match in written if match}
+                self.assertEqual(written, {'catalog_borrowrequest', 'catalog_game', 'catalog_loan'})
+        self.assertEqual(CatalogVersion.current(), version)
+
+        for callback in callbacks:
+            callback()
+        self.assertGreater(CatalogVersion.current(), version)
+
+    def test_bulk_reject_view(self):
+        requests = [self.borrow(game, patron) for game, patron in zip(self.games, self.patrons)]
+        response = self.client.post(reverse('libpanel:bulk_borrow_requests'), {
+            'action': 'reject', 'borrow_requests': [request.pk for request in requests[:2]],
+        }, follow=True)
+        self.assertContains(response, 'Rejected: Game 0 for patron0; Game 1 for patron1.')
+        self.assertEqual(
+            list(BorrowRequest.objects.order_by('pk').values_list('status', flat=True)),
+            ['rejected', 'rejected', 'pending'],
+        )
+
+    def test_bulk_access_approval_lends_what_is_available(self):
+        collection = Collection.objects.create(name='Vault', description='', creator=self.librarian, is_private=True)
+        collection.games.add(*self.games[:2])
+        loans.start_loan(self.games[1], self.patrons[3], 14)
+        access_request = CollectionAccessRequest.objects.create(collection=collection, requester=self.patrons[0])
+
+        response = self.client.post(reverse('libpanel:bulk_access_requests'), {
+            'action': 'approve', 'access_requests': [access_request.pk],
+        }, follow=True)
+
+        self.assertContains(response, 'Approved: Vault for patron0 (unavailable: Game 1).')
+        access_request.refresh_from_db()
+        self.assertEqual(access_request.status, CollectionAccessRequest.APPROVED)
+        self.assertEqual(list(self.patrons[0].loans.values_list('game__title', flat=True)), ['Game 0'])
+
+
+class LoansPageTest(TestCase):
+    def test_filter_by_due_state(self):
+        librarian = User.objects.create_user(username='librarian', password='testpass123')
+        librarian.userprofile.role = 'Librarian'
+        librarian.userprofile.save()
+        for title in ['Late', 'Fine']:
+            game = Game.objects.create(title=title, description='', release_date=date(2000, 1, 1),
+                                       genre='RPG', platform='SNES')
+            loans.start_loan(game, librarian, 14)
+        Loan.objects.filter(game__title='Late').update(due_state=Loan.OVERDUE)
+        self.client.force_login(librarian)
+
+        response = self.client.get(reverse('libpanel:loans'), {'state': 'overdue'})
+        self.assertEqual([loan.game.title for loan in response.context['all_active_loans']], ['Late'])
+
+
+class AnalyticsTest(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create_user(username='librarian', password='testpass123')
+        self.librarian.userprofile.role = 'Librarian'
+        self.librarian.userprofile.save()
+        self.now = timezone.now()
+        self.games = {
+            title: Game.objects.create(title=title, description='', release_date=date(2000, 1, 1),
+                                       genre=genre, platform='SNES')
+            for title, genre in [('Busy', 'RPG'), ('Late', 'RPG'), ('Shelf', 'Puzzle')]
+        }
+
+    def lend(self, title, borrowed_days_ago, days, returned_after=None):
+        borrowed = self.now - timedelta(days=borrowed_days_ago)
+        return Loan.objects.create(
+            game=self.games[title], borrower=self.librarian, borrow_date=borrowed,
+            due_date=borrowed + timedelta(days=days), is_returned=returned_after is not None,
+            return_date=None if returned_after is None else borrowed + timedelta(days=returned_after),
+        )
+
+    def test_rollups_per_genre(self):
+        self.lend('Busy', 30, 14, returned_after=10)
+        self.lend('Busy', 20, 14, returned_after=20)
+        self.lend('Late', 20, 14)
+        ArchivedLoan.objects.create(id=999, game=self.games['Shelf'], borrower=self.librarian,
+                                    borrow_date=self.now - timedelta(days=400),
+                                    due_date=self.now - timedelta(days=386),
+                                    return_date=self.now - timedelta(days=390))
+
+        call_command('refresh_analytics', stdout=io.StringIO())
+        report = analytics.circulation_report()
+
+        rpg, puzzle = report['by_genre'][1], report['by_genre'][0]
+        self.assertEqual((rpg['name'], rpg['loans'], rpg['avg_days'], rpg['idle']), ('RPG', 3, 15.0, 0))
+        self.assertAlmostEqual(rpg['overdue_rate'], 2 / 3)
+        self.assertEqual((puzzle['loans'], puzzle['avg_days'], puzzle['idle']), (1, 10.0, 1))
+        self.assertEqual(report['total']['loans'], 4)
+        self.assertEqual([row['name'] for row in report['busiest']], ['Busy', 'Late'])
+        [(title, last_borrowed)] = report['longest_idle']
+        self.assertEqual((title, last_borrowed.date()), ('Shelf', ArchivedLoan.objects.get().borrow_date.date()))
+
+    def test_page_shows_the_last_refresh_without_reading_history(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('libpanel:analytics'))
+        self.assertContains(response, 'No report yet')
+
+        analytics.refresh_report()
+        loans.start_loan(self.games['Shelf'], self.librarian, 14)
+        with patch.object(analytics, 'load_columns') as load_columns:
+            response = self.client.get(reverse('libpanel:analytics'))
+        load_columns.assert_not_called()
+        self.assertEqual(response.context['total']['loans'], 0)
+        self.assertContains(response, '1 loan made since then is not counted yet')
 
-# Create your tests here.
+        analytics.refresh_report()
+        response = self.client.get(reverse('libpanel:analytics'))
+        self.assertEqual(response.context['total']['loans'], 1)
+        self.assertEqual(response.context['new_loans'], 0)
+        self.assertNotContains(response, 'not counted yet')
+        self.assertContains(response, 'As of')
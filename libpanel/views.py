@@ -4,8 +4,11 @@ from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.contrib import messages
 from collection.models import CollectionAccessRequest
+from collection.access import bulk_approve_access_requests, bulk_reject_access_requests
 from catalog.models import BorrowRequest, Loan
-from datetime import timedelta
+from catalog.loans import GameUnavailable, RequestAlreadyProcessed, start_loan
+from catalog import loans as catalog_loans
+from .analytics import IDLE_DAYS, circulation_report
 from django.utils import timezone
 from django.db import transaction
 
@@ -61,18 +64,12 @@ def approve_collection_access_request(request, request_id):
             if hasattr(collection, 'shared_with'):
                 collection.shared_with.add(access_request.requester)
 
-            for game in collection.games.all():
-                is_on_loan = Loan.objects.filter(game=game, return_date__isnull=True).exists()
-                if is_on_loan:
+            # Always locked in the same order, so two approvals can't deadlock
+            for game in collection.games.order_by('pk'):
+                try:
+                    start_loan(game, access_request.requester, 14)
+                except GameUnavailable:
                     unavailable_games.append(game.title)
-                    continue
-
-                Loan.objects.create(
-                    game=game,
-                    borrower=access_request.requester,
-                    borrow_date=timezone.now(),
-                    due_date=timezone.now() + timedelta(days=14)
-                )
 
         if unavailable_games:
             messages.warning(
@@ -118,22 +115,15 @@ def approve_borrow_request(request, request_id):
     
     try:
         borrow_request = BorrowRequest.objects.get(id=request_id)
-        borrow_request.status = 'approved'
-        borrow_request.processed_by = request.user
-        borrow_request.processed_date = timezone.now()
-        borrow_request.save()
-        
-        # Create a new loan record using the requested duration
-        loan = Loan.objects.create(
-            game=borrow_request.game,
-            borrower=borrow_request.requester,
-            borrow_date=timezone.now(),
-            due_date=timezone.now() + timedelta(days=borrow_request.duration_days)
-        )
-        
+        # Creates a loan using the requested duration
+        catalog_loans.approve_borrow_request(borrow_request, request.user)
         messages.success(request, 'Borrow request approved successfully.')
     except BorrowRequest.DoesNotExist:
         messages.error(request, 'Borrow request not found.')
+    except GameUnavailable:
+        messages.error(request, 'This game is already on loan to another patron.')
+    except RequestAlreadyProcessed:
+        messages.warning(request, 'This request has already been processed.')
     
     return redirect('libpanel:requests')
 
@@ -148,6 +138,8 @@ def reject_borrow_request(request, request_id):
     try:
         borrow_request = BorrowRequest.objects.get(id=request_id)
         borrow_request.status = 'rejected'
+        borrow_request.processed_date = timezone.now()
+        borrow_request.processed_by = request.user
         borrow_request.save()
         messages.success(request, 'Borrow request rejected successfully.')
     except BorrowRequest.DoesNotExist:
@@ -163,16 +155,93 @@ def requests(request):
         return redirect('home:index')
     
     # Get pending collection access requests
-    access_requests = CollectionAccessRequest.objects.filter(status='pending').order_by('created_at')
+    access_requests = CollectionAccessRequest.objects.filter(status='pending').order_by('created_at').select_related(
+        'collection', 'requester'
+    )
     
     # Get pending game borrow requests
-    borrow_requests = BorrowRequest.objects.filter(status='pending').order_by('request_date')
+    borrow_requests = BorrowRequest.objects.filter(status='pending').order_by('request_date').select_related(
+        'game', 'requester'
+    )
     
     return render(request, "libpanel/requests.html", {
         'access_requests': access_requests,
         'borrow_requests': borrow_requests
     })
 
+# Outcome, message level and heading of the bulk action reports
+BULK_MESSAGES = [
+    (catalog_loans.APPROVED, messages.SUCCESS, 'Approved'),
+    (catalog_loans.REJECTED, messages.SUCCESS, 'Rejected'),
+    (catalog_loans.ON_LOAN, messages.WARNING, 'Already on loan, left pending'),
+    (catalog_loans.ALREADY_PROCESSED, messages.INFO, 'Already processed by someone else'),
+]
+
+
+def _selected_ids(request, name):
+    return [value for value in request.POST.getlist(name) if value.isdigit()]
+
+
+def _report(request, report, describe):
+    """Turn a bulk helper's (request, outcome, ...) report into one message per outcome."""
+    by_outcome = {}
+    for item in report:
+        by_outcome.setdefault(item[1], []).append(item)
+    for outcome, level, text in BULK_MESSAGES:
+        items = by_outcome.get(outcome)
+        if items:
+            messages.add_message(request, level, f'{text}: {"; ".join(describe(*item) for item in items)}.')
+
+
+@login_required
+@require_POST
+def bulk_borrow_requests(request):
+    if request.user.userprofile.role != 'Librarian':
+        messages.error(request, 'You do not have permission to perform this action.')
+        return redirect('home:index')
+
+    def describe(item, outcome):
+        return f'{item.game.title} for {item.requester.username}'
+
+    request_ids = _selected_ids(request, 'borrow_requests')
+    action = request.POST.get('action')
+    if not request_ids:
+        messages.warning(request, 'No borrow requests were selected.')
+    elif action == 'approve':
+        _report(request, catalog_loans.bulk_approve_borrow_requests(request_ids, request.user), describe)
+    elif action == 'reject':
+        _report(request, catalog_loans.bulk_reject_borrow_requests(request_ids, request.user), describe)
+    else:
+        messages.error(request, 'Unknown action.')
+    return redirect('libpanel:requests')
+
+
+@login_required
+@require_POST
+def bulk_access_requests(request):
+    if request.user.userprofile.role != 'Librarian':
+        messages.error(request, 'You do not have permission to perform this action.')
+        return redirect('home:index')
+
+    def describe(item, outcome, unavailable=()):
+        text = f'{item.collection.name} for {item.requester.username}'
+        if unavailable:
+            text += f' (unavailable: {", ".join(unavailable)})'
+        return text
+
+    request_ids = _selected_ids(request, 'access_requests')
+    action = request.POST.get('action')
+    if not request_ids:
+        messages.warning(request, 'No access requests were selected.')
+    elif action == 'approve':
+        _report(request, bulk_approve_access_requests(request_ids), describe)
+    elif action == 'reject':
+        _report(request, bulk_reject_access_requests(request_ids), describe)
+    else:
+        messages.error(request, 'Unknown action.')
+    return redirect('libpanel:requests')
+
+
 @login_required
 def loans(request):
     if request.user.userprofile.role != 'Librarian':
@@ -180,10 +249,35 @@ def loans(request):
 
     all_active_loans = Loan.objects.filter(
         is_returned=False
-    ).select_related('game', 'borrower')
+    ).select_related('game', 'borrower').order_by('due_date', 'id')
+
+    # Overdue / due soon as last marked by `manage.py scan_overdue_loans`
+    state = request.GET.get('state', '')
+    if state in dict(Loan.DUE_STATE_CHOICES):
+        all_active_loans = all_active_loans.filter(due_state=state)
 
     context = {
         'all_active_loans': all_active_loans,
+        'state': state,
+        'due_states': Loan.DUE_STATE_CHOICES,
     }
 
     return render(request, 'libpanel/loans.html', context)
+
+
+@login_required
+def analytics(request):
+    if request.user.userprofile.role != 'Librarian':
+        return redirect('home')
+
+    # Worked out by `manage.py refresh_analytics`, not on the request
+    report = circulation_report()
+    if report is None:
+        return render(request, 'libpanel/analytics.html', {'report': None})
+    context = {
+        **report,
+        'report': report,
+        'busiest_month': max((count for _, count in report['months']), default=0),
+        'idle_days': IDLE_DAYS,
+    }
+    return render(request, 'libpanel/analytics.html', context)
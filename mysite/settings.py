@@ -198,7 +198,8 @@ if os.getenv("AWS_ACCESS_KEY_ID") and os.getenv("AWS_SECRET_ACCESS_KEY") and os.
     # Use S3 storage if AWS credentials are provided
     AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
     AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-    DEFAULT_FILE_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+    # Uploads are stored under a hash of their content, see mysite/storage.py
+    DEFAULT_FILE_STORAGE = 'mysite.storage.ContentAddressedS3Storage'
     AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
     AWS_DEFAULT_ACL = None
     AWS_S3_CUSTOM_DOMAIN = f'{AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com'
@@ -206,6 +207,6 @@ if os.getenv("AWS_ACCESS_KEY_ID") and os.getenv("AWS_SECRET_ACCESS_KEY") and os.
     AWS_S3_REGION_NAME = 'us-east-2'
 else:
     # Use local file storage if AWS credentials are not provided
-    DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+    DEFAULT_FILE_STORAGE = 'mysite.storage.ContentAddressedFileSystemStorage'
     # The media files will be stored in the MEDIA_ROOT directory
     # which is already defined above
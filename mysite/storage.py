@@ -0,0 +1,76 @@
+"""
+Content-addressed media storage.
+
+Uploads are stored under the SHA-256 of their bytes, e.g.
+game_images/3f/a1/3fa1...c9.jpg, keeping the upload_to directory and the
+extension. Uploading the same box art again stores nothing new and gets
+the same name back, and since a name's content never changes its URL can
+be cached forever.
+
+The mixin works on top of any Django storage; settings picks the file
+system or S3 flavour.
+"""
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from storages.backends.s3boto3 import S3Boto3Storage
+
+# Safe for every content-addressed name, the bytes behind it never change
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class ContentAddressedMixin:
+    # Names already derived from a content-addressed one (the resized copies
+    # from catalog.images) are kept as given
+    passthrough_prefixes = ('derivatives/',)
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk if isinstance(chunk, bytes) else chunk.encode())
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory = posixpath.dirname(name.replace('\\', '/'))
+        extension = os.path.splitext(name)[1].lower()
+        return posixpath.join(directory, digest[:2], digest[2:4], digest + extension)
+
+    def is_content_addressed(self, name):
+        return not name.startswith(self.passthrough_prefixes)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        if not self.is_content_addressed(name):
+            return super().save(name, content, max_length=max_length)
+
+        key = self.content_name(self.generate_filename(name), content)
+        if max_length is not None and len(key) > max_length:
+            raise ValueError(f'Content-addressed name {key!r} is longer than {max_length} characters')
+        if self.exists(key):
+            return key
+        stored = self._save(key, content)
+        if stored != key:
+            # Someone stored the same bytes between our exists() and _save(),
+            # and the backend picked another name for our copy
+            self.delete(stored)
+        return key
+
+
+class ContentAddressedFileSystemStorage(ContentAddressedMixin, FileSystemStorage):
+    """
+    Local flavour. Whatever serves MEDIA_ROOT should send
+    IMMUTABLE_CACHE_CONTROL for everything except the legacy names.
+    """
+
+
+class ContentAddressedS3Storage(ContentAddressedMixin, S3Boto3Storage):
+    def get_object_parameters(self, name):
+        params = super().get_object_parameters(name)
+        params.setdefault('CacheControl', IMMUTABLE_CACHE_CONTROL)
+        return params